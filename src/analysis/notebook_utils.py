@@ -13,8 +13,13 @@
 # limitations under the License.
 
 """Helper methods for the AlphaFold Colab notebook."""
+import collections
 import enum
+import heapq
+import io
+import itertools
 import json
+import operator
 from typing import Any, Mapping, Optional, Sequence, Tuple
 from . import parsers
 from . import residue_constants
@@ -98,29 +103,67 @@ def merge_chunked_msa(
     results: Sequence[Mapping[str, Any]],
     max_hits: Optional[int] = None
     ) -> parsers.Msa:
-  """Merges chunked database hits together into hits for the full database."""
-  unsorted_results = []
+  """Merges chunked database hits together into hits for the full database.
+
+  The hits of each chunk are ranked by e-value from its tblout and the names
+  in the first block of its Stockholm alignment, keeping only its best
+  `max_hits` hits on a heap. The ranked chunks are then merged lazily, and
+  only the rows of the overall best `max_hits` hits are parsed, so memory and
+  time scale with `max_hits` rather than with the total number of hits. Ties
+  are broken by chunk and then by row order, as in a stable sort of all hits.
+
+  Args:
+    results: The jackhmmer results of each database chunk, with the Stockholm
+      alignment under 'sto' and the tblout under 'tbl'. The first sequence of
+      each alignment is the query.
+    max_hits: The maximum number of hits to return. All hits are returned if
+      None.
+
+  Returns:
+    The query followed by the hits of all chunks, sorted by e-value.
+  """
+  by_e_value = operator.itemgetter(0)
+  ranked_chunks = []
+  query_names = []
   for chunk_index, chunk in enumerate(results):
-    msa = parsers.parse_stockholm(chunk['sto'])
-    e_values_dict = parsers.parse_e_values_from_tblout(chunk['tbl'])
+    e_values = parsers.parse_e_values_from_tblout(chunk['tbl'])
+    names = parsers.iter_stockholm_names(io.StringIO(chunk['sto']))
+    query_name = next(names)
+    query_names.append(query_name)
+    if chunk_index == 0:
+      # Only take query (first hit) from the first chunk.
+      names = itertools.chain([query_name], names)
     # Jackhmmer lists sequences as <sequence name>/<residue from>-<residue to>.
-    e_values = [e_values_dict[t.partition('/')[0]] for t in msa.descriptions]
-    chunk_results = zip(
-        msa.sequences, msa.deletion_matrix, msa.descriptions, e_values)
-    if chunk_index != 0:
-      next(chunk_results)  # Only take query (first hit) from the first chunk.
-    unsorted_results.extend(chunk_results)
-
-  sorted_by_evalue = sorted(unsorted_results, key=lambda x: x[-1])
-  merged_sequences, merged_deletion_matrix, merged_descriptions, _ = zip(
-      *sorted_by_evalue)
-  merged_msa = parsers.Msa(sequences=merged_sequences,
-                           deletion_matrix=merged_deletion_matrix,
-                           descriptions=merged_descriptions)
-  if max_hits is not None:
-    merged_msa = merged_msa.truncate(max_seqs=max_hits)
-
-  return merged_msa
+    hits = ((e_values[name.partition('/')[0]], chunk_index, name)
+            for name in names)
+    if max_hits is None:
+      ranked_chunks.append(sorted(hits, key=by_e_value))
+    else:
+      ranked_chunks.append(heapq.nsmallest(max_hits, hits, key=by_e_value))
+  top_hits = list(itertools.islice(
+      heapq.merge(*ranked_chunks, key=by_e_value), max_hits))
+
+  hit_names = collections.defaultdict(set)
+  for _, chunk_index, name in top_hits:
+    hit_names[chunk_index].add(name)
+  rows = {}
+  for chunk_index, names in hit_names.items():
+    # Deletions are counted with respect to the query of the chunk.
+    msa = parsers.read_stockholm(
+        io.StringIO(results[chunk_index]['sto']),
+        sequence_names=names | {query_names[chunk_index]})
+    for row in zip(msa.sequences, msa.deletion_matrix, msa.descriptions):
+      rows[chunk_index, row[-1]] = row
+
+  merged_sequences, merged_deletion_matrix, merged_descriptions = [], [], []
+  for _, chunk_index, name in top_hits:
+    sequence, deletion_vector, description = rows[chunk_index, name]
+    merged_sequences.append(sequence)
+    merged_deletion_matrix.append(deletion_vector)
+    merged_descriptions.append(description)
+  return parsers.Msa(sequences=merged_sequences,
+                     deletion_matrix=merged_deletion_matrix,
+                     descriptions=merged_descriptions)
 
 
 def show_msa_info(
@@ -14,17 +14,41 @@
 
 """Functions for parsing various file formats."""
 import collections
+import collections.abc
+import contextlib
 import dataclasses
+import hashlib
+import io
 import itertools
+import json
+import mmap
+import os
 import re
 import string
-from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Set
+from typing import (Any, Callable, Dict, IO, Iterable, Iterator, List,
+                    Optional, Sequence, Tuple, Set, Union)
+
+import numpy as np
 
 # Internal import (7716).
 
 
 DeletionMatrix = Sequence[Sequence[int]]
 
+# Layout of an ArrayMsa file: the magic bytes, the length of a JSON header
+# as a little-endian uint64, the header, then each array starting at an
+# offset aligned to _ARRAY_MSA_ALIGNMENT bytes. The header maps the name of
+# each array to its dtype, shape and offset.
+_ARRAY_MSA_MAGIC = b'ARRAYMSA1'
+_ARRAY_MSA_ALIGNMENT = 64
+_ARRAY_MSA_FIELDS = ('residues', 'deletion_indptr', 'deletion_columns',
+                     'deletion_counts', 'description_buffer',
+                     'description_offsets')
+# A path to an MSA file or a file object opened in text mode.
+MsaFile = Union[str, os.PathLike, IO[str]]
+# A path to an output file or a file object opened in binary mode.
+BinaryOutput = Union[str, os.PathLike, IO[bytes]]
+
 
 @dataclasses.dataclass(frozen=True)
 class Msa:
@@ -52,17 +76,236 @@ class Msa:
                descriptions=self.descriptions[:max_seqs])
 
 
-@dataclasses.dataclass(frozen=True)
+class _LazyRows(collections.abc.Sequence):
+  """A read-only sequence whose items are decoded on access."""
+
+  def __init__(self, num_rows: int, decode_row: Callable[[int], Any]):
+    self._num_rows = num_rows
+    self._decode_row = decode_row
+
+  def __len__(self):
+    return self._num_rows
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [self._decode_row(i)
+              for i in range(*index.indices(self._num_rows))]
+    if index < 0:
+      index += self._num_rows
+    if not 0 <= index < self._num_rows:
+      raise IndexError(f'Row index out of range: {index}')
+    return self._decode_row(index)
+
+
+@dataclasses.dataclass(frozen=True, eq=False)
+class ArrayMsa:
+  """Class representing a parsed MSA file as compact arrays.
+
+  Residues are stored as a [num_seqs, num_res] uint8 matrix of ASCII codes,
+  the deletion matrix in compressed sparse row form (most entries are zero)
+  and the descriptions as a single UTF-8 buffer. The `sequences`,
+  `deletion_matrix` and `descriptions` properties decode rows on access, so an
+  ArrayMsa can be passed to code that reads an `Msa`.
+  """
+  residues: np.ndarray
+  deletion_indptr: np.ndarray
+  deletion_columns: np.ndarray
+  deletion_counts: np.ndarray
+  description_buffer: bytes
+  description_offsets: np.ndarray
+
+  def __post_init__(self):
+    if not (self.residues.shape[0] ==
+            self.deletion_indptr.shape[0] - 1 ==
+            self.description_offsets.shape[0] - 1):
+      raise ValueError(
+          'All fields for an MSA must have the same length. '
+          f'Got {self.residues.shape[0]} sequences, '
+          f'{self.deletion_indptr.shape[0] - 1} rows in the deletion matrix '
+          f'and {self.description_offsets.shape[0] - 1} descriptions.')
+
+  @classmethod
+  def from_arrays(cls, residues: np.ndarray, deletion_matrix: np.ndarray,
+                  descriptions: Sequence[str]) -> 'ArrayMsa':
+    """Creates an ArrayMsa from a residue matrix and a dense deletion matrix."""
+    rows, columns = np.nonzero(deletion_matrix)
+    indptr = np.zeros(residues.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=residues.shape[0]), out=indptr[1:])
+    encoded = [description.encode('utf-8') for description in descriptions]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return cls(residues=np.ascontiguousarray(residues, dtype=np.uint8),
+               deletion_indptr=indptr,
+               deletion_columns=columns.astype(np.int32),
+               deletion_counts=deletion_matrix[rows, columns].astype(np.int32),
+               description_buffer=b''.join(encoded),
+               description_offsets=offsets)
+
+  @classmethod
+  def from_msa(cls, msa: Msa) -> 'ArrayMsa':
+    """Creates an ArrayMsa from an `Msa`."""
+    num_res = len(msa.sequences[0]) if len(msa) else 0
+    residues = np.frombuffer(
+        ''.join(msa.sequences).encode('ascii'), dtype=np.uint8).reshape(
+            len(msa), num_res)
+    deletion_matrix = np.array(msa.deletion_matrix, dtype=np.int32).reshape(
+        len(msa), num_res)
+    return cls.from_arrays(residues, deletion_matrix, msa.descriptions)
+
+  def __len__(self):
+    return self.residues.shape[0]
+
+  def truncate(self, max_seqs: int):
+    num_seqs = len(range(len(self))[:max_seqs])
+    num_deletions = self.deletion_indptr[num_seqs]
+    return ArrayMsa(
+        residues=self.residues[:num_seqs],
+        deletion_indptr=self.deletion_indptr[:num_seqs + 1],
+        deletion_columns=self.deletion_columns[:num_deletions],
+        deletion_counts=self.deletion_counts[:num_deletions],
+        description_buffer=self.description_buffer[
+            :self.description_offsets[num_seqs]],
+        description_offsets=self.description_offsets[:num_seqs + 1])
+
+  def _sequence(self, index: int) -> str:
+    return self.residues[index].tobytes().decode('ascii')
+
+  def _deletion_row(self, index: int) -> List[int]:
+    row = np.zeros(self.residues.shape[1], dtype=np.int32)
+    start, end = self.deletion_indptr[index:index + 2]
+    row[self.deletion_columns[start:end]] = self.deletion_counts[start:end]
+    return row.tolist()
+
+  def _description(self, index: int) -> str:
+    start, end = self.description_offsets[index:index + 2]
+    return self.description_buffer[start:end].decode('utf-8')
+
+  @property
+  def sequences(self) -> Sequence[str]:
+    return _LazyRows(len(self), self._sequence)
+
+  @property
+  def deletion_matrix(self) -> DeletionMatrix:
+    return _LazyRows(len(self), self._deletion_row)
+
+  @property
+  def descriptions(self) -> Sequence[str]:
+    return _LazyRows(len(self), self._description)
+
+  def dense_deletion_matrix(self) -> np.ndarray:
+    """Returns the deletion matrix as a [num_seqs, num_res] int32 array."""
+    deletion_matrix = np.zeros(self.residues.shape, dtype=np.int32)
+    rows = np.repeat(np.arange(len(self)), np.diff(self.deletion_indptr))
+    deletion_matrix[rows, self.deletion_columns] = self.deletion_counts
+    return deletion_matrix
+
+  def select_rows(self, rows: np.ndarray) -> 'ArrayMsa':
+    """Returns an ArrayMsa holding the given rows, in the given order."""
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = self.deletion_indptr[rows]
+    counts = self.deletion_indptr[rows + 1] - starts
+    indptr = np.zeros(rows.size + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    entries = np.repeat(starts - indptr[:-1], counts) + np.arange(indptr[-1])
+    description_starts = self.description_offsets[rows]
+    description_ends = self.description_offsets[rows + 1]
+    offsets = np.zeros(rows.size + 1, dtype=np.int64)
+    np.cumsum(description_ends - description_starts, out=offsets[1:])
+    return ArrayMsa(
+        residues=self.residues[rows],
+        deletion_indptr=indptr,
+        deletion_columns=self.deletion_columns[entries],
+        deletion_counts=self.deletion_counts[entries],
+        description_buffer=b''.join(
+            self.description_buffer[start:end] for start, end in zip(
+                description_starts.tolist(), description_ends.tolist())),
+        description_offsets=offsets)
+
+  def to_msa(self) -> Msa:
+    """Decodes all rows into an `Msa`."""
+    return Msa(sequences=list(self.sequences),
+               deletion_matrix=list(self.deletion_matrix),
+               descriptions=list(self.descriptions))
+
+  def save(self, path: str):
+    """Writes the arrays to a file that `load` can memory-map."""
+    arrays = {name: np.ascontiguousarray(getattr(self, name))
+              for name in _ARRAY_MSA_FIELDS if name != 'description_buffer'}
+    arrays['description_buffer'] = np.frombuffer(
+        self.description_buffer, dtype=np.uint8)
+
+    header = {}
+    offset = 0
+    for name in _ARRAY_MSA_FIELDS:
+      header[name] = {'dtype': arrays[name].dtype.str,
+                      'shape': arrays[name].shape,
+                      'offset': offset}
+      offset += -(-arrays[name].nbytes // _ARRAY_MSA_ALIGNMENT) * (
+          _ARRAY_MSA_ALIGNMENT)
+    encoded_header = json.dumps(header).encode('ascii')
+    data_start = len(_ARRAY_MSA_MAGIC) + 8 + len(encoded_header)
+    data_start += -data_start % _ARRAY_MSA_ALIGNMENT
+
+    with open(path, 'wb') as f:
+      f.write(_ARRAY_MSA_MAGIC)
+      f.write(len(encoded_header).to_bytes(8, 'little'))
+      f.write(encoded_header)
+      for name in _ARRAY_MSA_FIELDS:
+        f.seek(data_start + header[name]['offset'])
+        f.write(arrays[name].tobytes())
+      f.truncate(data_start + offset)
+
+  @classmethod
+  def load(cls, path: str) -> 'ArrayMsa':
+    """Memory-maps an ArrayMsa written by `save`.
+
+    The residue and deletion arrays are read-only views of the mapped file, so
+    loading does not read them and rows are only paged in when accessed. The
+    descriptions buffer is copied.
+
+    Args:
+      path: The path to a file written by `save`.
+
+    Returns:
+      The ArrayMsa.
+
+    Raises:
+      ValueError: If the file is not an ArrayMsa file.
+    """
+    with open(path, 'rb') as f:
+      if f.read(len(_ARRAY_MSA_MAGIC)) != _ARRAY_MSA_MAGIC:
+        raise ValueError(f'Not an ArrayMsa file: {path}')
+      header_length = int.from_bytes(f.read(8), 'little')
+      header = json.loads(f.read(header_length))
+      data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    data_start = len(_ARRAY_MSA_MAGIC) + 8 + header_length
+    data_start += -data_start % _ARRAY_MSA_ALIGNMENT
+
+    arrays = {}
+    for name in _ARRAY_MSA_FIELDS:
+      dtype = np.dtype(header[name]['dtype'])
+      shape = tuple(header[name]['shape'])
+      arrays[name] = np.frombuffer(
+          data, dtype=dtype, count=int(np.prod(shape)),
+          offset=data_start + header[name]['offset']).reshape(shape)
+    arrays['description_buffer'] = arrays['description_buffer'].tobytes()
+    return cls(**arrays)
+
+
+@dataclasses.dataclass(frozen=True, eq=False)
 class TemplateHit:
-  """Class representing a template hit."""
+  """Class representing a template hit.
+
+  The residue indices are int64 arrays, with -1 for gaps.
+  """
   index: int
   name: str
   aligned_cols: int
   sum_probs: Optional[float]
   query: str
   hit_sequence: str
-  indices_query: List[int]
-  indices_hit: List[int]
+  indices_query: np.ndarray
+  indices_hit: np.ndarray
 
 
 def parse_fasta(fasta_string: str) -> Tuple[Sequence[str], Sequence[str]]:
@@ -77,7 +320,7 @@ def parse_fasta(fasta_string: str) -> Tuple[Sequence[str], Sequence[str]]:
     * A list of sequence descriptions taken from the comment lines. In the
       same order as the sequences.
   """
-  sequences = []
+  sequence_chunks = []
   descriptions = []
   index = -1
   for line in fasta_string.splitlines():
@@ -85,42 +328,132 @@ def parse_fasta(fasta_string: str) -> Tuple[Sequence[str], Sequence[str]]:
     if line.startswith('>'):
       index += 1
       descriptions.append(line[1:])  # Remove the '>' at the beginning.
-      sequences.append('')
+      sequence_chunks.append([])
       continue
     elif not line:
       continue  # Skip blank lines.
-    sequences[index] += line
+    sequence_chunks[index].append(line)
 
+  sequences = [''.join(chunks) for chunks in sequence_chunks]
   return sequences, descriptions
 
 
-def parse_stockholm(stockholm_string: str) -> Msa:
-  """Parses sequences and deletion matrix from stockholm format alignment.
+@contextlib.contextmanager
+def _open_msa_file(msa_file: MsaFile) -> Iterator[IO[str]]:
+  """Opens an MSA file for reading unless it is already a file object."""
+  if isinstance(msa_file, (str, os.PathLike)):
+    with open(msa_file) as f:
+      yield f
+  else:
+    yield msa_file
+
+
+def _iter_fasta_records(
+    lines: Iterable[str],
+    max_sequences: Optional[int] = None) -> Iterator[Tuple[str, str]]:
+  """Yields (description, sequence) pairs from the lines of a FASTA file."""
+  if max_sequences is not None and max_sequences <= 0:
+    return
+  num_sequences = 0
+  description = None
+  chunks = []
+  for line in lines:
+    line = line.strip()
+    if line.startswith('>'):
+      if description is not None:
+        yield description, ''.join(chunks)
+        num_sequences += 1
+        if max_sequences is not None and num_sequences >= max_sequences:
+          return
+      description = line[1:]  # Remove the '>' at the beginning.
+      chunks = []
+    elif line and description is not None:
+      chunks.append(line)
+  if description is not None:
+    yield description, ''.join(chunks)
+
+
+def iter_fasta(
+    fasta_file: MsaFile,
+    max_sequences: Optional[int] = None) -> Iterator[Tuple[str, str]]:
+  """Yields (description, sequence) pairs from a FASTA file.
+
+  The file is read line by line, and the lines of each sequence are joined
+  once the record is complete, so the memory used is bounded by the size of
+  the largest record rather than by the size of the file.
 
   Args:
-    stockholm_string: The string contents of a stockholm file. The first
-      sequence in the file should be the query sequence.
+    fasta_file: A path to a FASTA file or a file object opened in text mode.
+    max_sequences: The maximum number of sequences to read. All sequences are
+      read if None.
 
-  Returns:
-    A tuple of:
-      * A list of sequences that have been aligned to the query. These
-        might contain duplicates.
-      * The deletion matrix for the alignment as a list of lists. The element
-        at `deletion_matrix[i][j]` is the number of residues deleted from
-        the aligned sequence i at residue position j.
-      * The names of the targets matched, including the jackhmmer subsequence
-        suffix.
+  Yields:
+    The description (without the leading '>') and the sequence of each
+    record, in file order.
   """
-  name_to_sequence = collections.OrderedDict()
-  for line in stockholm_string.splitlines():
-    line = line.strip()
-    if not line or line.startswith(('#', '//')):
-      continue
-    name, sequence = line.split()
-    if name not in name_to_sequence:
-      name_to_sequence[name] = ''
-    name_to_sequence[name] += sequence
+  with _open_msa_file(fasta_file) as f:
+    yield from _iter_fasta_records(f, max_sequences=max_sequences)
+
+
+def _fasta_record_offsets(data: bytes) -> np.ndarray:
+  """Returns the offsets of the description lines of FASTA file contents."""
+  offsets = [0] if data[:1] == b'>' else []
+  position = data.find(b'\n>')
+  while position != -1:
+    offsets.append(position + 1)
+    position = data.find(b'\n>', position + 1)
+  offsets.append(len(data))  # Add the end of the final record.
+  return np.array(offsets, dtype=np.int64)
+
+
+class FastaIndex(collections.abc.Sequence):
+  """Random access to the records of a FASTA file by their byte offsets.
+
+  The offsets of the description lines are found in a single scan of the
+  memory-mapped file. Accessing record k then seeks to its offset and only
+  reads that record, so a batch job can process any record of a large
+  multi-FASTA file without reading the records before it. The offsets can be
+  saved and passed back to skip the scan.
+  """
+
+  def __init__(self, fasta_path: str, offsets: Optional[np.ndarray] = None):
+    """Initializes the index.
+
+    Args:
+      fasta_path: The path to the FASTA file.
+      offsets: The `offsets` of an index of the same file. The file is
+        scanned if None.
+    """
+    self._fasta_path = fasta_path
+    if offsets is None:
+      with open(fasta_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size:
+          with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offsets = _fasta_record_offsets(data)
+        else:
+          offsets = _fasta_record_offsets(b'')
+    self.offsets = offsets  # The start of each record and the end of file.
 
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [self[i] for i in range(*index.indices(len(self)))]
+    if index < 0:
+      index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError(f'Record index out of range: {index}')
+    start, end = self.offsets[index], self.offsets[index + 1]
+    with open(self._fasta_path, 'rb') as f:
+      f.seek(start)
+      record = f.read(end - start).decode()
+    return next(_iter_fasta_records(record.splitlines()))
+
+
+def _stockholm_to_msa_python(
+    name_to_sequence: Dict[str, str]) -> Msa:
+  """Builds an Msa from aligned stockholm rows one character at a time."""
   msa = []
   deletion_matrix = []
 
@@ -154,12 +487,244 @@ def parse_stockholm(stockholm_string: str) -> Msa:
              descriptions=list(name_to_sequence.keys()))
 
 
-def parse_a3m(a3m_string: str) -> Msa:
+_GAP = ord('-')
+# Number of alignment rows processed at once when counting deletions. Bounds
+# the size of the intermediate cumulative sum matrix.
+_DELETION_CHUNK_ROWS = 4096
+
+
+def _stockholm_residue_matrix(sequences: Sequence[str]) -> Optional[np.ndarray]:
+  """Decodes equal-length aligned rows into a [num_seqs, num_cols] uint8 array.
+
+  Returns None if the rows are ragged or not ASCII, in which case the caller
+  should fall back to the pure Python implementation.
+  """
+  num_cols = len(sequences[0])
+  if any(len(sequence) != num_cols for sequence in sequences):
+    return None
+  try:
+    buffer = ''.join(sequences).encode('ascii')
+  except UnicodeEncodeError:
+    return None
+  return np.frombuffer(buffer, dtype=np.uint8).reshape(len(sequences), num_cols)
+
+
+def _stockholm_deletion_counts(residues: np.ndarray,
+                               query_non_gaps: np.ndarray) -> np.ndarray:
+  """Counts residues inserted w.r.t. the query before each query column.
+
+  Args:
+    residues: A [num_seqs, num_cols] uint8 array of aligned residues.
+    query_non_gaps: A [num_cols] boolean mask of the non-gap query columns.
+
+  Returns:
+    A [num_seqs, num_query_residues] int32 array. The element at [i, j] is the
+    number of residues of sequence i in query gap columns between query
+    residue j - 1 and query residue j.
+  """
+  keep_columns = np.flatnonzero(query_non_gaps)
+  query_gaps = ~query_non_gaps
+  deletions = np.zeros((residues.shape[0], keep_columns.size), dtype=np.int32)
+  if not keep_columns.size or not query_gaps.any():
+    return deletions
+  for start in range(0, residues.shape[0], _DELETION_CHUNK_ROWS):
+    chunk = residues[start:start + _DELETION_CHUNK_ROWS]
+    insertions = (chunk != _GAP) & query_gaps
+    # Query residue columns never hold insertions, so the running insertion
+    # count sampled at those columns only grows between consecutive ones.
+    running = np.cumsum(insertions, axis=1, dtype=np.int32)[:, keep_columns]
+    deletions[start:start + chunk.shape[0]] = np.diff(
+        running, axis=1, prepend=0)
+  return deletions
+
+
+def _stockholm_to_msa_numpy(
+    name_to_sequence: Dict[str, str]) -> Msa:
+  """Builds an Msa from aligned stockholm rows using array operations."""
+  sequences = list(name_to_sequence.values())
+  residues = _stockholm_residue_matrix(sequences)
+  if residues is None:
+    return _stockholm_to_msa_python(name_to_sequence)
+
+  query_non_gaps = residues[0] != _GAP
+  aligned = np.ascontiguousarray(residues[:, query_non_gaps])
+  aligned_buffer = aligned.tobytes().decode('ascii')
+  width = aligned.shape[1]
+  msa = [aligned_buffer[i * width:(i + 1) * width]
+         for i in range(aligned.shape[0])]
+  deletion_matrix = _stockholm_deletion_counts(
+      residues, query_non_gaps).tolist()
+
+  return Msa(sequences=msa,
+             deletion_matrix=deletion_matrix,
+             descriptions=list(name_to_sequence.keys()))
+
+
+def _iter_stockholm_rows(
+    lines: Iterable[str],
+    max_sequences: Optional[int] = None,
+    sequence_names: Optional[Set[str]] = None) -> Iterator[Tuple[str, str]]:
+  """Concatenates the alignment blocks of stockholm lines by sequence name."""
+  name_to_chunks = collections.OrderedDict()
+  for line in lines:
+    line = line.strip()
+    if not line or line.startswith(('#', '//')):
+      continue
+    name, sequence = line.split()
+    chunks = name_to_chunks.get(name)
+    if chunks is None:
+      if max_sequences is not None and len(name_to_chunks) >= max_sequences:
+        continue
+      if sequence_names is not None and name not in sequence_names:
+        continue
+      chunks = name_to_chunks[name] = []
+    chunks.append(sequence)
+
+  while name_to_chunks:
+    # Release the chunks of each row as soon as it has been yielded.
+    name, chunks = name_to_chunks.popitem(last=False)
+    yield name, ''.join(chunks)
+
+
+def iter_stockholm(
+    stockholm_file: MsaFile,
+    max_sequences: Optional[int] = None,
+    sequence_names: Optional[Set[str]] = None) -> Iterator[Tuple[str, str]]:
+  """Yields (name, aligned sequence) pairs from a stockholm file.
+
+  The file is read line by line and only the rows of the first
+  `max_sequences` sequence names are kept, so the memory used is bounded by
+  the size of the truncated alignment rather than by the size of the file.
+  Since a row can be split across several alignment blocks, rows are yielded
+  once the whole file has been read.
+
+  Args:
+    stockholm_file: A path to a stockholm file or a file object. The first
+      sequence in the file should be the query sequence.
+    max_sequences: The maximum number of sequences to read. All sequences are
+      read if None.
+    sequence_names: The names of the sequences to read. All sequences are read
+      if None.
+
+  Yields:
+    The name of each sequence and its aligned sequence, in file order.
+  """
+  with _open_msa_file(stockholm_file) as f:
+    yield from _iter_stockholm_rows(
+        f, max_sequences=max_sequences, sequence_names=sequence_names)
+
+
+def iter_stockholm_names(stockholm_file: MsaFile) -> Iterator[str]:
+  """Yields the sequence names of a stockholm file, in file order.
+
+  Every alignment block lists all the sequences, so only the lines of the
+  first block are read.
+
+  Args:
+    stockholm_file: A path to a stockholm file or a file object.
+
+  Yields:
+    The name of each sequence, as in the descriptions of `parse_stockholm`.
+  """
+  with _open_msa_file(stockholm_file) as f:
+    in_block = False
+    for line in f:
+      line = line.strip()
+      if not line:
+        if in_block:
+          return
+      elif line.startswith('//'):
+        return
+      elif not line.startswith('#'):
+        in_block = True
+        yield line.partition(' ')[0]
+
+
+def _stockholm_to_msa(
+    name_to_sequence: Dict[str, str], vectorized: bool) -> Msa:
+  if vectorized and name_to_sequence:
+    return _stockholm_to_msa_numpy(name_to_sequence)
+  return _stockholm_to_msa_python(name_to_sequence)
+
+
+def _stockholm_to_array_msa(name_to_sequence: Dict[str, str]) -> ArrayMsa:
+  """Builds an ArrayMsa from aligned stockholm rows."""
+  sequences = list(name_to_sequence.values())
+  residues = _stockholm_residue_matrix(sequences) if sequences else None
+  if residues is None:
+    return ArrayMsa.from_msa(_stockholm_to_msa_python(name_to_sequence))
+  query_non_gaps = residues[0] != _GAP
+  return ArrayMsa.from_arrays(
+      residues=residues[:, query_non_gaps],
+      deletion_matrix=_stockholm_deletion_counts(residues, query_non_gaps),
+      descriptions=list(name_to_sequence.keys()))
+
+
+def read_stockholm(stockholm_file: MsaFile,
+                   max_sequences: Optional[int] = None,
+                   vectorized: bool = True,
+                   compact: bool = False,
+                   sequence_names: Optional[Set[str]] = None
+                   ) -> Union[Msa, ArrayMsa]:
+  """Reads a stockholm file without loading its full contents into memory.
+
+  Args:
+    stockholm_file: A path to a stockholm file or a file object.
+    max_sequences: The maximum number of sequences to read. All sequences are
+      read if None.
+    vectorized: Whether to use the NumPy engine of `parse_stockholm`.
+    compact: Whether to return an `ArrayMsa` instead of an `Msa`.
+    sequence_names: The names of the sequences to read. All sequences are read
+      if None. Deletions are counted with respect to the first sequence read,
+      so it should include the name of the query.
+
+  Returns:
+    The parsed MSA, equal to `parse_stockholm` of the truncated file.
+  """
+  name_to_sequence = collections.OrderedDict(
+      iter_stockholm(stockholm_file, max_sequences=max_sequences,
+                     sequence_names=sequence_names))
+  if compact:
+    return _stockholm_to_array_msa(name_to_sequence)
+  return _stockholm_to_msa(name_to_sequence, vectorized)
+
+
+def parse_stockholm(stockholm_string: str, vectorized: bool = True) -> Msa:
+  """Parses sequences and deletion matrix from stockholm format alignment.
+
+  Args:
+    stockholm_string: The string contents of a stockholm file. The first
+      sequence in the file should be the query sequence.
+    vectorized: Whether to decode the alignment into a uint8 residue matrix
+      and compute the query gap mask and the deletion counts with NumPy. The
+      result is identical to the character by character implementation, which
+      is used when this is False or when the aligned rows are ragged.
+
+  Returns:
+    A tuple of:
+      * A list of sequences that have been aligned to the query. These
+        might contain duplicates.
+      * The deletion matrix for the alignment as a list of lists. The element
+        at `deletion_matrix[i][j]` is the number of residues deleted from
+        the aligned sequence i at residue position j.
+      * The names of the targets matched, including the jackhmmer subsequence
+        suffix.
+  """
+  name_to_sequence = collections.OrderedDict(
+      _iter_stockholm_rows(stockholm_string.splitlines()))
+  return _stockholm_to_msa(name_to_sequence, vectorized)
+
+
+def parse_a3m(a3m_string: str, vectorized: bool = True) -> Msa:
   """Parses sequences and deletion matrix from a3m format alignment.
 
   Args:
     a3m_string: The string contents of a a3m file. The first sequence in the
       file should be the query sequence.
+    vectorized: Whether to classify the residues of all rows with a byte
+      lookup table and count deletions with NumPy. The result is identical to
+      the character by character implementation, which is used when this is
+      False or when the aligned rows are ragged.
 
   Returns:
     A tuple of:
@@ -171,6 +736,12 @@ def parse_a3m(a3m_string: str) -> Msa:
       * A list of descriptions, one per sequence, from the a3m file.
   """
   sequences, descriptions = parse_fasta(a3m_string)
+  return _a3m_to_msa(sequences, descriptions, vectorized)
+
+
+def _a3m_to_msa_python(
+    sequences: Sequence[str], descriptions: Sequence[str]) -> Msa:
+  """Builds an Msa from a3m rows by splitting off lowercase insertions."""
   deletion_matrix = []
   for msa_sequence in sequences:
     deletion_vec = []
@@ -191,6 +762,121 @@ def parse_a3m(a3m_string: str) -> Msa:
              descriptions=descriptions)
 
 
+# Lookup table of the byte values that are insertions in a3m rows.
+_A3M_INSERTIONS = np.zeros(256, dtype=bool)
+_A3M_INSERTIONS[ord('a'):ord('z') + 1] = True
+
+
+def _a3m_arrays(
+    sequences: Sequence[str]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+  """Splits a3m rows into aligned residues and deletion counts with NumPy.
+
+  Args:
+    sequences: The raw a3m rows, including lowercase insertions.
+
+  Returns:
+    A [num_seqs, num_res] uint8 array of aligned residues and a
+    [num_seqs, num_res] int32 array of deletion counts, or None if the rows are
+    not ASCII or do not all have the same number of aligned residues.
+  """
+  if not sequences:
+    return None
+  num_res = None
+  residue_chunks = []
+  deletion_chunks = []
+  for start in range(0, len(sequences), _DELETION_CHUNK_ROWS):
+    chunk = sequences[start:start + _DELETION_CHUNK_ROWS]
+    try:
+      codes = np.frombuffer(''.join(chunk).encode('ascii'), dtype=np.uint8)
+    except UnicodeEncodeError:
+      return None
+    row_ends = np.cumsum([len(sequence) for sequence in chunk], dtype=np.int64)
+    row_starts = row_ends - [len(sequence) for sequence in chunk]
+    # Byte offsets of the aligned residues, in row order.
+    positions = np.flatnonzero(~_A3M_INSERTIONS[codes])
+    num_aligned = np.diff(np.searchsorted(positions, row_ends), prepend=0)
+    if num_res is None:
+      num_res = int(num_aligned[0])
+    if (num_aligned != num_res).any():
+      return None
+    residue_chunks.append(codes[positions].reshape(len(chunk), num_res))
+    # Insertions are the bytes skipped between consecutive aligned residues
+    # of a row, or between the start of the row and its first residue.
+    positions = positions.reshape(len(chunk), num_res)
+    deletions = np.empty(positions.shape, dtype=np.int32)
+    if num_res:
+      deletions[:, 0] = positions[:, 0] - row_starts
+      np.subtract(positions[:, 1:], positions[:, :-1], out=deletions[:, 1:],
+                  casting='unsafe')
+      deletions[:, 1:] -= 1
+    deletion_chunks.append(deletions)
+  return np.concatenate(residue_chunks), np.concatenate(deletion_chunks)
+
+
+def _a3m_to_msa(sequences: Sequence[str],
+                descriptions: Sequence[str],
+                vectorized: bool = True) -> Msa:
+  arrays = _a3m_arrays(sequences) if vectorized else None
+  if arrays is None:
+    return _a3m_to_msa_python(sequences, descriptions)
+  residues, deletion_matrix = arrays
+  num_res = residues.shape[1]
+  residue_buffer = residues.tobytes().decode('ascii')
+  aligned_sequences = [residue_buffer[i * num_res:(i + 1) * num_res]
+                       for i in range(residues.shape[0])]
+  return Msa(sequences=aligned_sequences,
+             deletion_matrix=deletion_matrix.tolist(),
+             descriptions=descriptions)
+
+
+def iter_a3m(
+    a3m_file: MsaFile,
+    max_sequences: Optional[int] = None) -> Iterator[Tuple[str, str]]:
+  """Yields (description, sequence) pairs from an a3m file.
+
+  Args:
+    a3m_file: A path to an a3m file or a file object.
+    max_sequences: The maximum number of sequences to read. All sequences are
+      read if None.
+
+  Yields:
+    The description and the raw a3m sequence (including lowercase insertions)
+    of each record, as soon as the record has been read.
+  """
+  with _open_msa_file(a3m_file) as f:
+    yield from _iter_fasta_records(f, max_sequences=max_sequences)
+
+
+def read_a3m(a3m_file: MsaFile,
+             max_sequences: Optional[int] = None,
+             vectorized: bool = True,
+             compact: bool = False) -> Union[Msa, ArrayMsa]:
+  """Reads an a3m file without loading its full contents into memory.
+
+  Args:
+    a3m_file: A path to an a3m file or a file object.
+    max_sequences: The maximum number of sequences to read. All sequences are
+      read if None.
+    vectorized: Whether to use the NumPy engine of `parse_a3m`.
+    compact: Whether to return an `ArrayMsa` instead of an `Msa`.
+
+  Returns:
+    The parsed MSA, equal to `parse_a3m` of the truncated file.
+  """
+  sequences = []
+  descriptions = []
+  for description, sequence in iter_a3m(a3m_file, max_sequences=max_sequences):
+    descriptions.append(description)
+    sequences.append(sequence)
+  if compact:
+    arrays = _a3m_arrays(sequences) if vectorized else None
+    if arrays is None:
+      return ArrayMsa.from_msa(_a3m_to_msa_python(sequences, descriptions))
+    residues, deletion_matrix = arrays
+    return ArrayMsa.from_arrays(residues, deletion_matrix, descriptions)
+  return _a3m_to_msa(sequences, descriptions, vectorized)
+
+
 def _convert_sto_seq_to_a3m(
     query_non_gaps: Sequence[bool], sto_seq: str) -> Iterable[str]:
   for is_query_res_non_gap, sequence_res in zip(query_non_gaps, sto_seq):
@@ -274,59 +960,339 @@ def _keep_line(line: str, seqnames: Set[str]) -> bool:
     return seqname in seqnames
 
 
-def truncate_stockholm_msa(stockholm_msa_path: str, max_sequences: int) -> str:
-  """Reads + truncates a Stockholm file while preventing excessive RAM usage."""
+# Prefixes of the lines that end the alignment rows of a block: blank lines,
+# the reference annotation and the end tag.
+_STOCKHOLM_BOUNDARY_PREFIXES = (b'\n', b'\r', b'#=GC RF', b'//')
+# Number of bytes copied at a time to the truncated Stockholm file.
+_COPY_CHUNK_BYTES = 1 << 20
+
+
+def _first_stockholm_sequence_names(data: mmap.mmap,
+                                    max_sequences: int) -> Set[bytes]:
+  """Returns the names of the first sequences of a Stockholm file."""
   seqnames = set()
-  filtered_lines = []
+  data.seek(0)
+  for line in iter(data.readline, b''):
+    if line.strip() and not line.startswith((b'#', b'//')):
+      seqnames.add(line.partition(b' ')[0])
+      if len(seqnames) >= max_sequences:
+        break
+  return seqnames
 
-  with open(stockholm_msa_path) as f:
-    for line in f:
-      if line.strip() and not line.startswith(('#', '//')):
-        # Ignore blank lines, markup and end symbols - remainder are alignment
-        # sequence parts.
-        seqname = line.partition(' ')[0]
-        seqnames.add(seqname)
-        if len(seqnames) >= max_sequences:
-          break
-
-    f.seek(0)
-    for line in f:
-      if _keep_line(line, seqnames):
-        filtered_lines.append(line)
 
-  return ''.join(filtered_lines)
+def _find_stockholm_boundary(data: mmap.mmap, pos: int) -> int:
+  """Returns the offset of the first boundary line after the line at `pos`."""
+  end = len(data)
+  for prefix in _STOCKHOLM_BOUNDARY_PREFIXES:
+    found = data.find(b'\n' + prefix, pos, end + len(prefix))
+    if found != -1:
+      end = found + 1
+  return end
+
+
+def _iter_kept_stockholm_spans(
+    data: mmap.mmap, seqnames: Set[bytes]) -> Iterator[Tuple[int, int]]:
+  """Yields the byte spans of the lines of a Stockholm file to keep.
+
+  Consecutive kept lines are merged into a single span. Once the row of every
+  sequence in `seqnames` has been kept in a block, the rest of the block only
+  holds other sequences and markup, so it is skipped up to the next boundary
+  line without reading its lines. #=GS lines are not counted, as a sequence
+  can have several of them.
+
+  Args:
+    data: The memory-mapped Stockholm file.
+    seqnames: The names of the sequences to keep.
+
+  Yields:
+    (start, end) byte offsets of runs of lines that `_keep_line` keeps.
+  """
+  span_start = span_end = 0
+  num_kept = 0  # Sequence rows kept since the last boundary.
+  pos = 0
+  data.seek(0)
+  for line in iter(data.readline, b''):
+    # Same decisions as _keep_line, on bytes.
+    stripped = line.strip()
+    if (not stripped or stripped == b'//' or
+        line.startswith((b'# STOCKHOLM', b'#=GC RF'))):
+      keep = True
+      num_kept = 0
+    else:
+      if line.startswith(b'#=GS'):
+        keep = line.split(maxsplit=2)[1] in seqnames
+      elif line.startswith(b'#'):
+        keep = False
+      else:
+        keep = line.partition(b' ')[0] in seqnames
+        num_kept += keep
+    if keep:
+      if pos != span_end:
+        if span_end > span_start:
+          yield span_start, span_end
+        span_start = pos
+      span_end = pos + len(line)
+    pos += len(line)
+    if num_kept == len(seqnames):
+      pos = _find_stockholm_boundary(data, pos - 1)
+      data.seek(pos)
+      num_kept = 0
+  if span_end > span_start:
+    yield span_start, span_end
+
+
+def truncate_stockholm_msa(
+    stockholm_msa_path: str, max_sequences: int,
+    output: Optional[BinaryOutput] = None) -> Optional[str]:
+  """Reads + truncates a Stockholm file while preventing excessive RAM usage.
+
+  The file is memory-mapped. The names of the first `max_sequences` sequences
+  are read from the first block, then the kept lines are copied to the output
+  as byte slices of the file, so that memory use does not depend on the size
+  of the file. As in HMMER output, each sequence is assumed to appear at most
+  once per block.
+
+  Args:
+    stockholm_msa_path: The path to the Stockholm file.
+    max_sequences: The maximum number of sequences to keep.
+    output: A path or a binary file object to write the truncated file to.
+      If None, the truncated file is returned as a string.
+
+  Returns:
+    The truncated Stockholm file if `output` is None, None otherwise.
+  """
+  with contextlib.ExitStack() as stack:
+    if output is None:
+      out = io.BytesIO()
+    elif isinstance(output, (str, os.PathLike)):
+      out = stack.enter_context(open(output, 'wb'))
+    else:
+      out = output
+
+    f = stack.enter_context(open(stockholm_msa_path, 'rb'))
+    if os.fstat(f.fileno()).st_size:  # Empty files cannot be memory-mapped.
+      data = stack.enter_context(
+          mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+      seqnames = _first_stockholm_sequence_names(data, max_sequences)
+      for start, end in _iter_kept_stockholm_spans(data, seqnames):
+        for chunk_start in range(start, end, _COPY_CHUNK_BYTES):
+          out.write(
+              data[chunk_start:min(end, chunk_start + _COPY_CHUNK_BYTES)])
+
+    if output is None:
+      return out.getvalue().decode()
+  return None
+
+
+def _stockholm_descriptions(stockholm_msa: str) -> Dict[str, str]:
+  """Returns the #=GS DE description of each sequence of a stockholm file."""
+  descriptions = {}
+  for line in _iter_lines(stockholm_msa):
+    if line.startswith('#=GS'):
+      fields = line.split(maxsplit=3)
+      if len(fields) == 4 and fields[2] == 'DE':
+        descriptions[fields[1]] = fields[3]
+  return descriptions
+
+
+def merge_stockholm_msas(stockholm_msas: Sequence[str],
+                         tblouts: Sequence[str],
+                         max_sequences: Optional[int] = None) -> str:
+  """Merges the alignments of one query against several database shards.
+
+  The query of the first shard is kept as the first row, followed by the hits
+  of all shards sorted by the e-values of their tblouts, ties being broken by
+  shard and then by row order. A sequence found in several shards is only
+  kept once.
+
+  Each shard has its own insert columns, so the merged alignment gives every
+  query residue the widest insertion found before it in any shard and pads
+  the other shards' insertions with gaps. Each merged row therefore parses
+  to the same aligned sequence and deletion counts as in its own shard.
+
+  Args:
+    stockholm_msas: The stockholm alignments of the query against each shard.
+      The first sequence of each alignment is the query.
+    tblouts: The jackhmmer tblouts of the shards, in the same order.
+    max_sequences: The maximum number of sequences to keep, including the
+      query. All sequences are kept if None.
+
+  Returns:
+    The merged alignment as a stockholm file with a single block.
+
+  Raises:
+    ValueError: If the shards are not aligned to the same query, if an
+      alignment has ragged or non-ASCII rows, or if a sequence of a shard is
+      not in its tblout, as when a shard search failed or was truncated.
+  """
+  shard_names = []
+  shard_residues = []
+  for stockholm_msa in stockholm_msas:
+    name_to_sequence = collections.OrderedDict(
+        _iter_stockholm_rows(_iter_lines(stockholm_msa)))
+    residues = _stockholm_residue_matrix(list(name_to_sequence.values()))
+    if residues is None:
+      raise ValueError('Stockholm alignment rows are ragged or not ASCII.')
+    shard_names.append(list(name_to_sequence))
+    shard_residues.append(residues)
+
+  queries = [residues[0][residues[0] != _GAP] for residues in shard_residues]
+  if any(not np.array_equal(query, queries[0]) for query in queries):
+    raise ValueError('Shards are not aligned to the same query.')
+
+  # Rank the hits of all shards by e-value with a stable sort.
+  hits = []
+  for shard_index, tblout in enumerate(tblouts):
+    e_values = parse_e_values_from_tblout(tblout)
+    for row_index, name in enumerate(shard_names[shard_index]):
+      if not row_index:
+        continue
+      # Jackhmmer names the rows <sequence name>/<from>-<to>.
+      target_name = name.partition('/')[0]
+      if target_name not in e_values:
+        raise ValueError(
+            f'Sequence {name} of shard {shard_index} is not in the tblout of '
+            'the shard.')
+      hits.append((e_values[target_name], shard_index, row_index))
+  hits.sort(key=lambda hit: hit[0])
+  rows = [(0, 0)]  # The query of the first shard.
+  seen_names = {shard_names[0][0]}
+  for _, shard_index, row_index in hits:
+    if max_sequences is not None and len(rows) >= max_sequences:
+      break
+    name = shard_names[shard_index][row_index]
+    if name not in seen_names:
+      seen_names.add(name)
+      rows.append((shard_index, row_index))
+
+  # Number of insert columns before each query residue and after the last one,
+  # for each shard and for the merged alignment.
+  match_columns = [np.flatnonzero(residues[0] != _GAP)
+                   for residues in shard_residues]
+  insert_widths = [
+      np.diff(np.concatenate([[-1], columns, [len(residues[0])]])) - 1
+      for columns, residues in zip(match_columns, shard_residues)]
+  merged_widths = np.max(insert_widths, axis=0)
+  region_starts = np.concatenate([[0], np.cumsum(merged_widths + 1)])
+  merged_length = region_starts[-1] - 1
+  merged_match_columns = region_starts[:-2] + merged_widths[:-1]
+
+  merged = np.full((len(rows), merged_length), _GAP, dtype=np.uint8)
+  row_shards = np.array([shard_index for shard_index, _ in rows])
+  row_indices = np.array([row_index for _, row_index in rows])
+  for shard_index, residues in enumerate(shard_residues):
+    out_rows = np.flatnonzero(row_shards == shard_index)
+    if not out_rows.size:
+      continue
+    # Map each column of the shard to the merged alignment: insert columns
+    # keep their offset within their insertion, and query residues move to
+    # the end of the widened insertion before them.
+    is_match = residues[0] != _GAP
+    matches_before = np.cumsum(is_match) - is_match
+    previous_match = np.concatenate(
+        [[-1], match_columns[shard_index]])[matches_before]
+    insert_offsets = np.arange(residues.shape[1]) - previous_match - 1
+    column_map = region_starts[matches_before] + np.where(
+        is_match, merged_widths[matches_before], insert_offsets)
+    merged[np.ix_(out_rows, column_map)] = residues[row_indices[out_rows]]
+
+  reference = np.full(merged_length, ord('.'), dtype=np.uint8)
+  reference[merged_match_columns] = ord('x')
+  names = [shard_names[shard_index][row_index]
+           for shard_index, row_index in rows]
+  width = max(len(name) for name in names + ['#=GC RF'])
+
+  shard_descriptions = [_stockholm_descriptions(stockholm_msa)
+                        for stockholm_msa in stockholm_msas]
+  lines = ['# STOCKHOLM 1.0', '']
+  for name, (shard_index, _) in zip(names, rows):
+    description = shard_descriptions[shard_index].get(name)
+    if description is not None:
+      lines.append(f'#=GS {name:<{width}} DE {description}')
+  lines.append('')
+  lines.extend(f'{name:<{width}} {row.tobytes().decode("ascii")}'
+               for name, row in zip(names, merged))
+  lines.append(f'{"#=GC RF":<{width}} {reference.tobytes().decode("ascii")}')
+  lines.append('//')
+  return '\n'.join(lines) + '\n'
+
+
+def _remove_empty_columns_from_block_python(
+    block_lines: Sequence[str]) -> List[str]:
+  """Masks the empty columns of a block by scanning every column in turn."""
+  *alignment_lines, reference_annotation_line = block_lines
+  _, _, first_alignment = reference_annotation_line.rpartition(' ')
+  mask = []
+  for j in range(len(first_alignment)):
+    for unprocessed_line in alignment_lines:
+      prefix, _, alignment = unprocessed_line.rpartition(' ')
+      if alignment[j] != '-':
+        mask.append(True)
+        break
+    else:  # Every row contained a hyphen - empty column.
+      mask.append(False)
+
+  if not any(mask):  # All columns were empty. Output empty lines for chunk.
+    return [''] * len(block_lines)
+  processed_lines = []
+  for unprocessed_line in block_lines:
+    prefix, _, alignment = unprocessed_line.rpartition(' ')
+    masked_alignment = ''.join(itertools.compress(alignment, mask))
+    processed_lines.append(f'{prefix} {masked_alignment}')
+  return processed_lines
+
+
+def _remove_empty_columns_from_block(block_lines: Sequence[str]) -> List[str]:
+  """Masks the empty columns of a block with one pass over a residue matrix.
+
+  Args:
+    block_lines: The alignment rows of a block followed by its reference
+      annotation row.
 
+  Returns:
+    The rows with the columns that only contain gaps removed, or empty rows if
+    all columns are empty.
+  """
+  split_lines = [line.rpartition(' ') for line in block_lines]
+  alignments = [alignment for _, _, alignment in split_lines]
+  residues = _stockholm_residue_matrix(alignments)
+  if residues is None:
+    return _remove_empty_columns_from_block_python(block_lines)
+  # The reference annotation row does not count towards column occupancy.
+  mask = (residues[:-1] != _GAP).any(axis=0)
+  if not mask.any():  # All columns were empty. Output empty lines for chunk.
+    return [''] * len(block_lines)
+  width = int(mask.sum())
+  masked = np.ascontiguousarray(residues[:, mask]).tobytes().decode('ascii')
+  return [f'{prefix} {masked[i * width:(i + 1) * width]}'
+          for i, (prefix, _, _) in enumerate(split_lines)]
+
+
+def remove_empty_columns_from_stockholm_msa(stockholm_msa: str,
+                                            vectorized: bool = True) -> str:
+  """Removes empty columns (dashes-only) from a Stockholm MSA.
+
+  Args:
+    stockholm_msa: The string contents of a stockholm file.
+    vectorized: Whether to compute the column occupancy mask of each block
+      with NumPy. The result is identical to the column by column scan, which
+      is used when this is False or when the rows of a block are ragged.
 
-def remove_empty_columns_from_stockholm_msa(stockholm_msa: str) -> str:
-  """Removes empty columns (dashes-only) from a Stockholm MSA."""
+  Returns:
+    The stockholm MSA without the columns that only contain gaps.
+  """
+  remove_empty_columns = (_remove_empty_columns_from_block if vectorized
+                          else _remove_empty_columns_from_block_python)
   processed_lines = {}
   unprocessed_lines = {}
   for i, line in enumerate(stockholm_msa.splitlines()):
     if line.startswith('#=GC RF'):
-      reference_annotation_i = i
-      reference_annotation_line = line
-      # Reached the end of this chunk of the alignment. Process chunk.
-      _, _, first_alignment = line.rpartition(' ')
-      mask = []
-      for j in range(len(first_alignment)):
-        for _, unprocessed_line in unprocessed_lines.items():
-          prefix, _, alignment = unprocessed_line.rpartition(' ')
-          if alignment[j] != '-':
-            mask.append(True)
-            break
-        else:  # Every row contained a hyphen - empty column.
-          mask.append(False)
-      # Add reference annotation for processing with mask.
-      unprocessed_lines[reference_annotation_i] = reference_annotation_line
-
-      if not any(mask):  # All columns were empty. Output empty lines for chunk.
-        for line_index in unprocessed_lines:
-          processed_lines[line_index] = ''
-      else:
-        for line_index, unprocessed_line in unprocessed_lines.items():
-          prefix, _, alignment = unprocessed_line.rpartition(' ')
-          masked_alignment = ''.join(itertools.compress(alignment, mask))
-          processed_lines[line_index] = f'{prefix} {masked_alignment}'
+      # Reached the end of this chunk of the alignment. Process chunk together
+      # with the reference annotation.
+      unprocessed_lines[i] = line
+      processed_lines.update(zip(
+          unprocessed_lines,
+          remove_empty_columns(list(unprocessed_lines.values()))))
 
       # Clear raw_alignments.
       unprocessed_lines = {}
@@ -337,44 +1303,268 @@ def remove_empty_columns_from_stockholm_msa(stockholm_msa: str) -> str:
   return '\n'.join((processed_lines[i] for i in range(len(processed_lines))))
 
 
+def _iter_lines(text: str) -> Iterator[str]:
+  """Yields the lines of a string without copying them all into a list."""
+  start = 0
+  while start < len(text):
+    end = text.find('\n', start)
+    if end == -1:
+      end = len(text)
+    yield text[start:end].rstrip('\r')
+    start = end + 1
+
+
+class SequenceDeduplicator:
+  """Remembers which sequences have been seen by their fixed-size digests.
+
+  Only a 16 byte BLAKE2 digest is kept per distinct sequence rather than the
+  sequence itself, which bounds the memory used to deduplicate deep MSAs. The
+  probability of a digest collision is negligible at this size.
+  """
+
+  def __init__(self):
+    self._digests = set()
+
+  def __len__(self):
+    return len(self._digests)
+
+  def add(self, sequence: bytes) -> bool:
+    """Records a sequence and returns whether it had not been seen before."""
+    digest = hashlib.blake2b(sequence, digest_size=16).digest()
+    if digest in self._digests:
+      return False
+    self._digests.add(digest)
+    return True
+
+  def filter_rows(self, residues: np.ndarray) -> np.ndarray:
+    """Records the rows of a 2-D array and returns the indices of new ones."""
+    residues = np.ascontiguousarray(residues)
+    return np.array([i for i, row in enumerate(residues)
+                     if self.add(row.tobytes())], dtype=np.int64)
+
+
+def deduplicate_msas(
+    msas: Sequence[Union[Msa, ArrayMsa]]) -> List[Union[Msa, ArrayMsa]]:
+  """Removes sequences that already occur earlier in the same or a prior MSA.
+
+  This is the deduplication done when MSA features are built from several
+  MSAs, applied up front so that duplicated rows are never decoded.
+
+  Args:
+    msas: The MSAs in priority order.
+
+  Returns:
+    The MSAs with only the first occurrence of every aligned sequence. MSAs
+    that only held duplicates are returned empty.
+  """
+  deduplicator = SequenceDeduplicator()
+  deduplicated_msas = []
+  for msa in msas:
+    if isinstance(msa, ArrayMsa):
+      deduplicated_msas.append(
+          msa.select_rows(deduplicator.filter_rows(msa.residues)))
+    else:
+      keep_rows = [i for i, sequence in enumerate(msa.sequences)
+                   if deduplicator.add(sequence.encode('utf-8'))]
+      deduplicated_msas.append(Msa(
+          sequences=[msa.sequences[i] for i in keep_rows],
+          deletion_matrix=[msa.deletion_matrix[i] for i in keep_rows],
+          descriptions=[msa.descriptions[i] for i in keep_rows]))
+  return deduplicated_msas
+
+
 def deduplicate_stockholm_msa(stockholm_msa: str) -> str:
-  """Remove duplicate sequences (ignoring insertions wrt query)."""
-  sequence_dict = collections.defaultdict(str)
+  """Remove duplicate sequences (ignoring insertions wrt query).
 
-  # First we must extract all sequences from the MSA.
-  for line in stockholm_msa.splitlines():
+  Each row is hashed block by block after removing the columns that are
+  gaps in the query, so neither the rows nor the distinct masked rows are
+  held in memory, and the kept lines are filtered from the input as it is
+  read a second time.
+  """
+  hashers = collections.OrderedDict()
+  query_name = None
+  mask = []  # Mask of the current block is False for insertions.
+  for line in _iter_lines(stockholm_msa):
     # Only consider the alignments - ignore reference annotation, empty lines,
     # descriptions or markup.
     if line.strip() and not line.startswith(('#', '//')):
-      line = line.strip()
       seqname, alignment = line.split()
-      sequence_dict[seqname] += alignment
+      if query_name is None:
+        # First alignment is the query.
+        query_name = seqname
+      if seqname == query_name:
+        mask = [c != '-' for c in alignment]
+      if seqname not in hashers:
+        hashers[seqname] = hashlib.blake2b(digest_size=16)
+      # Apply mask to remove all insertions from the string.
+      hashers[seqname].update(
+          ''.join(itertools.compress(alignment, mask)).encode('utf-8'))
+
+  deduplicator = SequenceDeduplicator()
+  seqnames = set(seqname for seqname, hasher in hashers.items()
+                 if deduplicator.add(hasher.digest()))
+  del hashers
+
+  return '\n'.join(line for line in _iter_lines(stockholm_msa)
+                   if _keep_line(line, seqnames)) + '\n'
+
+
+# Lookup table that lowercases ASCII letters.
+_LOWERCASE = np.arange(256, dtype=np.uint8)
+_LOWERCASE[ord('A'):ord('Z') + 1] += ord('a') - ord('A')
+_DOT = ord('.')
+
+
+def _sto_rows_to_a3m(rows: np.ndarray) -> List[str]:
+  """Converts pruned stockholm rows to a3m rows like convert_stockholm_to_a3m.
+
+  Dots are dropped from every row, then the remaining residues are matched
+  position by position to the columns of the first (query) row: residues in
+  query gap columns become lowercase insertions and gaps there are dropped.
+  """
+  query_non_gaps = rows[0] != _GAP
+  a3m_rows = []
+  for start in range(0, rows.shape[0], _DELETION_CHUNK_ROWS):
+    chunk = rows[start:start + _DELETION_CHUNK_ROWS]
+    non_dots = chunk != _DOT
+    row_lengths = non_dots.sum(axis=1)
+    row_starts = np.cumsum(row_lengths) - row_lengths
+    residues = chunk[non_dots]
+    # Column of the query matched to each residue once dots are dropped.
+    columns = np.arange(residues.size) - np.repeat(row_starts, row_lengths)
+    is_match = query_non_gaps[columns]
+    keep = is_match | (residues != _GAP)
+    residues = np.where(is_match, residues, _LOWERCASE[residues])[keep]
+    row_ends = np.concatenate([[0], np.cumsum(keep)])[row_starts + row_lengths]
+    buffer = residues.tobytes().decode('ascii')
+    a3m_rows.extend(buffer[begin:end] for begin, end in zip(
+        np.concatenate([[0], row_ends[:-1]]).tolist(), row_ends.tolist()))
+  return a3m_rows
+
+
+def preprocess_stockholm_msa(stockholm_file: MsaFile,
+                             output_format: str = 'a3m',
+                             max_sequences: Optional[int] = None) -> str:
+  """Prepares a stockholm MSA for template search in a single read.
+
+  The result is equivalent to `deduplicate_stockholm_msa` followed by
+  `remove_empty_columns_from_stockholm_msa` and, for the a3m output format,
+  `convert_stockholm_to_a3m`. The file is read once and the alignment is held
+  as a uint8 residue matrix; the stockholm output is rewritten with one
+  padded name column rather than copying the input layout.
 
-  seen_sequences = set()
-  seqnames = set()
-  # First alignment is the query.
-  query_align = next(iter(sequence_dict.values()))
-  mask = [c != '-' for c in query_align]  # Mask is False for insertions.
-  for seqname, alignment in sequence_dict.items():
-    # Apply mask to remove all insertions from the string.
-    masked_alignment = ''.join(itertools.compress(alignment, mask))
-    if masked_alignment in seen_sequences:
-      continue
-    else:
-      seen_sequences.add(masked_alignment)
-      seqnames.add(seqname)
+  Args:
+    stockholm_file: A path to a stockholm file or a file object. The first
+      sequence in the file should be the query sequence.
+    output_format: Either 'a3m' or 'sto'.
+    max_sequences: The maximum number of sequences to read, as in
+      `truncate_stockholm_msa`. All sequences are read if None.
 
-  filtered_lines = []
-  for line in stockholm_msa.splitlines():
-    if _keep_line(line, seqnames):
-      filtered_lines.append(line)
+  Returns:
+    The deduplicated MSA without empty columns, in the requested format.
 
-  return '\n'.join(filtered_lines) + '\n'
+  Raises:
+    ValueError: If the output format is not supported or if the aligned rows
+      are ragged or not ASCII.
+  """
+  if output_format not in ('a3m', 'sto'):
+    raise ValueError(f'Unsupported MSA format: {output_format}')
+
+  name_to_chunks = collections.OrderedDict()
+  markup_lines = []
+  reference_annotations = []
+  with _open_msa_file(stockholm_file) as f:
+    for line in f:
+      if line[:4] == '#=GS':
+        # Description rows are filtered once the kept sequences are known.
+        markup_lines.append(line.rstrip('\n'))
+      elif line.startswith('#=GC RF'):
+        reference_annotations.append(line.split()[-1])
+      elif line.strip() and not line.startswith(('#', '//')):
+        name, sequence = line.split()
+        chunks = name_to_chunks.get(name)
+        if chunks is None:
+          if (max_sequences is not None and
+              len(name_to_chunks) >= max_sequences):
+            continue
+          chunks = name_to_chunks[name] = []
+        chunks.append(sequence)
+
+  names = list(name_to_chunks)
+  residues = _stockholm_residue_matrix(
+      [''.join(name_to_chunks.pop(name)) for name in names])
+  if residues is None:
+    raise ValueError('Stockholm rows must be ASCII and of equal length.')
+  keep_rows = SequenceDeduplicator().filter_rows(
+      residues[:, residues[0] != _GAP])
+  residues = residues[keep_rows]
+  names = [names[i] for i in keep_rows]
+  keep_columns = (residues != _GAP).any(axis=0)
+  kept_names = set(names)
+
+  descriptions = {}
+  for line in markup_lines:
+    columns = line.split(maxsplit=3)
+    if len(columns) < 3 or columns[1] not in kept_names:
+      continue
+    if output_format == 'a3m' and columns[2] == 'DE':
+      descriptions[columns[1]] = columns[3] if len(columns) == 4 else ''
+
+  if output_format == 'a3m':
+    a3m_rows = _sto_rows_to_a3m(residues[:, keep_columns])
+    fasta_chunks = (f'>{name} {descriptions.get(name, "")}\n{row}'
+                    for name, row in zip(names, a3m_rows))
+    return '\n'.join(fasta_chunks) + '\n'  # Include terminating newline.
+
+  # Split the alignment into the blocks delimited by the reference annotation
+  # rows, so that every block is pruned with its own column mask.
+  block_widths = [len(annotation) for annotation in reference_annotations]
+  if sum(block_widths) != residues.shape[1]:
+    block_widths = [residues.shape[1]]
+    reference_annotations = []
+  width = max([len(name) for name in names] + [len('#=GC RF')])
+  lines = ['# STOCKHOLM 1.0', '']
+  lines.extend(line for line in markup_lines
+               if line.split(maxsplit=2)[1] in kept_names)
+  lines.append('')
+  block_start = 0
+  for block_index, block_width in enumerate(block_widths):
+    block_end = block_start + block_width
+    block_columns = np.flatnonzero(keep_columns[block_start:block_end])
+    if block_columns.size:
+      block = np.ascontiguousarray(
+          residues[:, block_start + block_columns]).tobytes().decode('ascii')
+      n = block_columns.size
+      lines.extend(f'{name:<{width}} {block[i * n:(i + 1) * n]}'
+                   for i, name in enumerate(names))
+      if reference_annotations:
+        annotation = reference_annotations[block_index]
+        lines.append(f'{"#=GC RF":<{width}} ' +
+                     ''.join(annotation[c] for c in block_columns))
+      lines.append('')
+    block_start = block_end
+  lines.append('//')
+  return '\n'.join(lines) + '\n'
+
+
+# Summary line of a detailed hit section of an .hhr file.
+_HHR_SUMMARY_PATTERN = re.compile(
+    'Probab=(.*)[\t ]*E-value=(.*)[\t ]*Score=(.*)[\t ]*Aligned_cols=(.*)[\t'
+    ' ]*Identities=(.*)%[\t ]*Similarity=(.*)[\t ]*Sum_probs=(.*)[\t '
+    ']*Template_Neff=(.*)')
+# Query and template sequence lines after their first 17 characters: start,
+# sequence, end (captured for the query only) and total sequence length.
+_HHR_QUERY_PATTERN = re.compile(
+    r'[\t ]*([0-9]*) ([A-Z-]*)[\t ]*([0-9]*) \([0-9]*\)')
+_HHR_HIT_PATTERN = re.compile(
+    r'[\t ]*([0-9]*) ([A-Z-]*)[\t ]*[0-9]* \([0-9]*\)')
+# Start of a detailed hit section.
+_HHR_HIT_START_PATTERN = re.compile(r'^No ', re.MULTILINE)
 
 
 def _get_hhr_line_regex_groups(
-    regex_pattern: str, line: str) -> Sequence[Optional[str]]:
-  match = re.match(regex_pattern, line)
+    regex_pattern: 're.Pattern[str]', line: str) -> Sequence[Optional[str]]:
+  match = regex_pattern.match(line)
   if match is None:
     raise RuntimeError(f'Could not parse query line {line}')
   return match.groups()
@@ -412,11 +1602,7 @@ def _parse_hhr_hit(detailed_lines: Sequence[str]) -> TemplateHit:
   name_hit = detailed_lines[1][1:]
 
   # Parse the summary line.
-  pattern = (
-      'Probab=(.*)[\t ]*E-value=(.*)[\t ]*Score=(.*)[\t ]*Aligned_cols=(.*)[\t'
-      ' ]*Identities=(.*)%[\t ]*Similarity=(.*)[\t ]*Sum_probs=(.*)[\t '
-      ']*Template_Neff=(.*)')
-  match = re.match(pattern, detailed_lines[2])
+  match = _HHR_SUMMARY_PATTERN.match(detailed_lines[2])
   if match is None:
     raise RuntimeError(
         'Could not parse section: %s. Expected this: \n%s to contain summary.' %
@@ -428,8 +1614,8 @@ def _parse_hhr_hit(detailed_lines: Sequence[str]) -> TemplateHit:
   # readable' format which has a fixed length. The strategy employed is to
   # assume that each block starts with the query sequence line, and to parse
   # that with a regexp in order to deduce the fixed length used for that block.
-  query = ''
-  hit_sequence = ''
+  query = []
+  hit_sequence = []
   indices_query = []
   indices_hit = []
   length_block = None
@@ -441,21 +1627,19 @@ def _parse_hhr_hit(detailed_lines: Sequence[str]) -> TemplateHit:
         not line.startswith('Q Consensus')):
       # Thus the first 17 characters must be 'Q <query_name> ', and we can parse
       # everything after that.
-      #              start    sequence       end       total_sequence_length
-      patt = r'[\t ]*([0-9]*) ([A-Z-]*)[\t ]*([0-9]*) \([0-9]*\)'
-      groups = _get_hhr_line_regex_groups(patt, line[17:])
+      groups = _get_hhr_line_regex_groups(_HHR_QUERY_PATTERN, line[17:])
 
       # Get the length of the parsed block using the start and finish indices,
       # and ensure it is the same as the actual block length.
       start = int(groups[0]) - 1  # Make index zero based.
       delta_query = groups[1]
       end = int(groups[2])
-      num_insertions = len([x for x in delta_query if x == '-'])
+      num_insertions = delta_query.count('-')
       length_block = end - start + num_insertions
       assert length_block == len(delta_query)
 
       # Update the query sequence and indices list.
-      query += delta_query
+      query.append(delta_query)
       _update_hhr_residue_indices_list(delta_query, start, indices_query)
 
     elif line.startswith('T '):
@@ -465,15 +1649,13 @@ def _parse_hhr_hit(detailed_lines: Sequence[str]) -> TemplateHit:
           not line.startswith('T Consensus')):
         # Thus the first 17 characters must be 'T <hit_name> ', and we can
         # parse everything after that.
-        #              start    sequence       end     total_sequence_length
-        patt = r'[\t ]*([0-9]*) ([A-Z-]*)[\t ]*[0-9]* \([0-9]*\)'
-        groups = _get_hhr_line_regex_groups(patt, line[17:])
+        groups = _get_hhr_line_regex_groups(_HHR_HIT_PATTERN, line[17:])
         start = int(groups[0]) - 1  # Make index zero based.
         delta_hit_sequence = groups[1]
         assert length_block == len(delta_hit_sequence)
 
         # Update the hit sequence and indices list.
-        hit_sequence += delta_hit_sequence
+        hit_sequence.append(delta_hit_sequence)
         _update_hhr_residue_indices_list(delta_hit_sequence, start, indices_hit)
 
   return TemplateHit(
@@ -481,29 +1663,132 @@ def _parse_hhr_hit(detailed_lines: Sequence[str]) -> TemplateHit:
       name=name_hit,
       aligned_cols=int(aligned_cols),
       sum_probs=sum_probs,
-      query=query,
-      hit_sequence=hit_sequence,
-      indices_query=indices_query,
-      indices_hit=indices_hit,
+      query=''.join(query),
+      hit_sequence=''.join(hit_sequence),
+      indices_query=np.array(indices_query, dtype=np.int64),
+      indices_hit=np.array(indices_hit, dtype=np.int64),
   )
 
 
-def parse_hhr(hhr_string: str) -> Sequence[TemplateHit]:
-  """Parses the content of an entire HHR file."""
-  lines = hhr_string.splitlines()
+class HhrIndex(collections.abc.Sequence):
+  """Lazily parsed hits of an .hhr file.
 
-  # Each .hhr file starts with a results table, then has a sequence of hit
-  # "paragraphs", each paragraph starting with a line 'No <hit number>'. We
-  # iterate through each paragraph to parse each hit.
+  Each .hhr file starts with a results table, then has a sequence of hit
+  "paragraphs", each paragraph starting with a line 'No <hit number>'. The
+  offsets of the paragraphs are found in a single scan, so the number of hits
+  is known without parsing them, and a hit is only parsed when it is accessed.
+  """
 
-  block_starts = [i for i, line in enumerate(lines) if line.startswith('No ')]
+  def __init__(self, hhr_string: str):
+    self._hhr_string = hhr_string
+    self._block_starts = [
+        match.start()
+        for match in _HHR_HIT_START_PATTERN.finditer(hhr_string)]
+    self._block_starts.append(len(hhr_string))  # Add the end of final block.
 
-  hits = []
-  if block_starts:
-    block_starts.append(len(lines))  # Add the end of the final block.
-    for i in range(len(block_starts) - 1):
-      hits.append(_parse_hhr_hit(lines[block_starts[i]:block_starts[i + 1]]))
-  return hits
+  def __len__(self):
+    return len(self._block_starts) - 1
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [self[i] for i in range(*index.indices(len(self)))]
+    if index < 0:
+      index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError(f'Hit index out of range: {index}')
+    block = self._hhr_string[
+        self._block_starts[index]:self._block_starts[index + 1]]
+    return _parse_hhr_hit(block.splitlines())
+
+
+def parse_hhr(hhr_string: str,
+              max_hits: Optional[int] = None) -> Sequence[TemplateHit]:
+  """Parses the content of an entire HHR file.
+
+  Args:
+    hhr_string: The string contents of an .hhr file.
+    max_hits: The number of hits to parse, in file order. All hits are parsed
+      if None.
+
+  Returns:
+    The parsed hits.
+  """
+  return HhrIndex(hhr_string)[:max_hits]
+
+
+def count_hhr_hits(hhr_string: str) -> int:
+  """Returns the number of hits in an .hhr file without parsing them."""
+  return len(HhrIndex(hhr_string))
+
+
+def _count_line_prefixes(data: bytes, prefix: bytes) -> int:
+  """Returns the number of lines of `data` that start with `prefix`."""
+  count = int(data[:len(prefix)] == prefix)
+  needle = b'\n' + prefix
+  position = data.find(needle)
+  while position != -1:
+    count += 1
+    position = data.find(needle, position + 1)
+  return count
+
+
+def _count_stockholm_sequences(data: mmap.mmap) -> int:
+  """Returns the number of sequence names in the first Stockholm block."""
+  names = set()
+  data.seek(0)
+  for line in iter(data.readline, b''):
+    line = line.strip()
+    if not line:
+      if names:
+        break
+    elif line.startswith(b'//'):
+      break
+    elif not line.startswith(b'#'):
+      names.add(line.split(maxsplit=1)[0])
+  return len(names)
+
+
+def _count_a3m_sequences(data: mmap.mmap) -> int:
+  return _count_line_prefixes(data, b'>')
+
+
+def _count_hhr_hits(data: mmap.mmap) -> int:
+  return _count_line_prefixes(data, b'No ')
+
+
+# Record counters of the search outputs by file extension.
+_MSA_FILE_COUNTERS = {
+    'sto': _count_stockholm_sequences,
+    'a3m': _count_a3m_sequences,
+    'hhr': _count_hhr_hits,
+}
+
+
+def count_msa_records(msa_path: str) -> int:
+  """Returns the number of sequences or hits of a search output file.
+
+  The count is the length of the parsed file (`read_stockholm`, `read_a3m` or
+  `HhrIndex`), but only the memory-mapped file is scanned: the sequence name
+  lines of the first block of a .sto file, the description lines of an .a3m
+  file or the 'No ' hit headers of an .hhr file. Nothing else is decoded.
+
+  Args:
+    msa_path: The path to a .sto, .a3m or .hhr file.
+
+  Returns:
+    The number of sequences of an MSA or the number of hits of an .hhr file.
+
+  Raises:
+    ValueError: If the file extension is not one of the above.
+  """
+  counter = _MSA_FILE_COUNTERS.get(msa_path.rpartition('.')[2])
+  if counter is None:
+    raise ValueError(f'Unknown MSA file type: {msa_path}')
+  with open(msa_path, 'rb') as f:
+    if not os.fstat(f.fileno()).st_size:
+      return 0
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+      return counter(data)
 
 
 def parse_e_values_from_tblout(tblout: str) -> Dict[str, float]:
@@ -539,6 +1824,52 @@ def _get_indices(sequence: str, start: int) -> List[int]:
   return indices
 
 
+def _get_indices_batch(
+    sequences: Sequence[str],
+    starts: Sequence[int]) -> Optional[Tuple[List[np.ndarray], np.ndarray]]:
+  """Computes `_get_indices` and the aligned columns of many sequences at once.
+
+  The sequences are concatenated into a single uint8 array. The counter of
+  `_get_indices` before each symbol is the start of its sequence plus the
+  number of non-gap symbols before it in the sequence, which is a cumulative
+  sum over the whole array minus its value at the start of the sequence.
+
+  Args:
+    sequences: The a3m sequences.
+    starts: The index of the first residue of each sequence.
+
+  Returns:
+    A tuple of the residue indices of each sequence, as views into a single
+    int64 array, and the number of match states (uppercase residues) of each
+    sequence. None if a sequence is not ASCII.
+  """
+  try:
+    symbols = np.frombuffer(''.join(sequences).encode('ascii'), dtype=np.uint8)
+  except UnicodeEncodeError:
+    return None
+  lengths = np.fromiter(map(len, sequences), dtype=np.int64,
+                        count=len(sequences))
+  bounds = np.zeros(len(sequences) + 1, dtype=np.int64)
+  np.cumsum(lengths, out=bounds[1:])
+
+  is_gap = symbols == _GAP
+  is_insertion = (symbols >= ord('a')) & (symbols <= ord('z'))
+  is_match = (symbols >= ord('A')) & (symbols <= ord('Z'))
+
+  non_gaps = np.zeros(symbols.size + 1, dtype=np.int64)
+  np.cumsum(~is_gap, out=non_gaps[1:])
+  offsets = np.asarray(starts, dtype=np.int64) - non_gaps[bounds[:-1]]
+  counters = non_gaps[:-1] + np.repeat(offsets, lengths)
+  indices = np.where(is_gap, -1, counters)[~is_insertion]
+
+  kept = np.zeros(symbols.size + 1, dtype=np.int64)
+  np.cumsum(~is_insertion, out=kept[1:])
+  matches = np.zeros(symbols.size + 1, dtype=np.int64)
+  np.cumsum(is_match, out=matches[1:])
+  return (np.split(indices, kept[bounds[1:-1]]),
+          matches[bounds[1:]] - matches[bounds[:-1]])
+
+
 @dataclasses.dataclass(frozen=True)
 class HitMetadata:
   pdb_id: str
@@ -549,13 +1880,16 @@ class HitMetadata:
   text: str
 
 
+# Description of a hit in the a3m output of hmmsearch.
+_HMMSEARCH_DESCRIPTION_PATTERN = re.compile(
+    r'^>?([a-z0-9]+)_(\w+)/([0-9]+)-([0-9]+).*protein length:([0-9]+) *(.*)$')
+
+
 def _parse_hmmsearch_description(description: str) -> HitMetadata:
   """Parses the hmmsearch A3M sequence description line."""
   # Example 1: >4pqx_A/2-217 [subseq from] mol:protein length:217  Free text
   # Example 2: >5g3r_A/1-55 [subseq from] mol:protein length:352
-  match = re.match(
-      r'^>?([a-z0-9]+)_(\w+)/([0-9]+)-([0-9]+).*protein length:([0-9]+) *(.*)$',
-      description.strip())
+  match = _HMMSEARCH_DESCRIPTION_PATTERN.match(description.strip())
 
   if not match:
     raise ValueError(f'Could not parse description: "{description}".')
@@ -571,13 +1905,18 @@ def _parse_hmmsearch_description(description: str) -> HitMetadata:
 
 def parse_hmmsearch_a3m(query_sequence: str,
                         a3m_string: str,
-                        skip_first: bool = True) -> Sequence[TemplateHit]:
+                        skip_first: bool = True,
+                        vectorized: bool = True) -> Sequence[TemplateHit]:
   """Parses an a3m string produced by hmmsearch.
 
   Args:
     query_sequence: The query sequence.
     a3m_string: The a3m string produced by hmmsearch.
     skip_first: Whether to skip the first sequence in the a3m string.
+    vectorized: Whether to compute the residue indices and aligned columns of
+      all hits at once with NumPy. The result is identical to the character
+      by character implementation, which is used when this is False or when a
+      sequence is not ASCII.
 
   Returns:
     A sequence of `TemplateHit` results.
@@ -587,17 +1926,36 @@ def parse_hmmsearch_a3m(query_sequence: str,
   if skip_first:
     parsed_a3m = parsed_a3m[1:]
 
-  indices_query = _get_indices(query_sequence, start=0)
-
-  hits = []
-  for i, (hit_sequence, hit_description) in enumerate(parsed_a3m, start=1):
-    if 'mol:protein' not in hit_description:
-      continue  # Skip non-protein chains.
-    metadata = _parse_hmmsearch_description(hit_description)
+  # Skip non-protein chains, but keep the numbering of all hits.
+  protein_hits = [
+      (i, hit_sequence, _parse_hmmsearch_description(hit_description))
+      for i, (hit_sequence, hit_description) in enumerate(parsed_a3m, start=1)
+      if 'mol:protein' in hit_description]
+  hit_sequences = [hit_sequence for _, hit_sequence, _ in protein_hits]
+
+  batch = None
+  if vectorized:
+    batch = _get_indices_batch(
+        [query_sequence] + hit_sequences,
+        [0] + [metadata.start - 1 for _, _, metadata in protein_hits])
+  if batch is not None:
+    (indices_query, *hit_indices), aligned_cols = batch
+    hit_aligned_cols = aligned_cols[1:].tolist()
+  else:
+    indices_query = np.array(
+        _get_indices(query_sequence, start=0), dtype=np.int64)
+    hit_indices = [
+        np.array(_get_indices(hit_sequence, start=metadata.start - 1),
+                 dtype=np.int64)
+        for _, hit_sequence, metadata in protein_hits]
     # Aligned columns are only the match states.
-    aligned_cols = sum([r.isupper() and r != '-' for r in hit_sequence])
-    indices_hit = _get_indices(hit_sequence, start=metadata.start - 1)
+    hit_aligned_cols = [
+        sum([r.isupper() and r != '-' for r in hit_sequence])
+        for hit_sequence in hit_sequences]
 
+  hits = []
+  for (i, hit_sequence, metadata), indices_hit, aligned_cols in zip(
+      protein_hits, hit_indices, hit_aligned_cols):
     hit = TemplateHit(
         index=i,
         name=f'{metadata.pdb_id}_{metadata.chain}',
@@ -0,0 +1,480 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the MSA and template hit parsers on synthetic search results.
+
+Every benchmark times a parser on a synthetic Stockholm, A3M, HHR, tblout or
+hmmsearch A3M file at each of the requested scales and reports its throughput
+and peak Python memory. Parsers that keep a pure Python reference version are
+checked against it and timed against it as well.
+
+Run from the root of the repository:
+
+  python -m src.analysis.parsers_benchmark \
+      --scales=1000x100,10000x1000,50000x3000 \
+      --output_path=/tmp/parsers_benchmark.json
+
+The results are written as JSON, so that a run on a later commit can be
+compared with them:
+
+  python -m src.analysis.parsers_benchmark \
+      --baseline_path=/tmp/parsers_benchmark.json
+"""
+
+import dataclasses
+import io
+import json
+import platform
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from absl import app
+from absl import flags
+from absl import logging
+import numpy as np
+
+from . import parsers
+
+
+flags.DEFINE_list('scales', ['1000x100', '10000x1000', '50000x3000'],
+                  'Sizes of the synthetic alignments, as <rows>x<columns>')
+flags.DEFINE_list('benchmarks', None,
+                  'Names of the benchmarks to run. Runs all of them if unset')
+flags.DEFINE_integer('repeats', 3, 'Number of timed runs per parser')
+flags.DEFINE_integer('seed', 0, 'Random seed for the synthetic alignments')
+flags.DEFINE_string('output_path', None,
+                    'Path of the JSON file to write the results to')
+flags.DEFINE_string('baseline_path', None,
+                    'Path of the JSON results of an earlier run to compare to')
+flags.DEFINE_float('regression_threshold', 1.2,
+                   'Slowdown relative to the baseline that is reported as a '
+                   'regression')
+FLAGS = flags.FLAGS
+
+_AMINO_ACIDS = np.frombuffer(b'ACDEFGHIKLMNPQRSTVWY', dtype=np.uint8)
+# Number of rows of random numbers drawn at a time by the generators.
+_CHUNK_ROWS = 4096
+# Template searches return far fewer hits than MSA searches return sequences.
+_TEMPLATE_HITS_PER_ROW = 0.1
+
+
+def make_a3m(num_sequences: int, num_columns: int,
+             rng: np.random.Generator) -> str:
+  """Generates an a3m alignment resembling hhblits output."""
+  lines = []
+  for i in range(num_sequences):
+    residues = rng.choice(_AMINO_ACIDS, size=num_columns)
+    if i:
+      residues[rng.random(num_columns) < 0.2] = ord('-')
+    row = []
+    insert_after = np.flatnonzero(rng.random(num_columns) < 0.05) if i else []
+    start = 0
+    for column in insert_after:
+      row.append(residues[start:column + 1].tobytes())
+      row.append(rng.choice(_AMINO_ACIDS, size=rng.integers(1, 8)).tobytes(
+          ).lower())
+      start = column + 1
+    row.append(residues[start:].tobytes())
+    lines.append(f'>seq_{i}\n{b"".join(row).decode("ascii")}')
+  return '\n'.join(lines) + '\n'
+
+
+def make_stockholm(num_sequences: int, num_columns: int,
+                   rng: np.random.Generator, block_width: int = 200) -> str:
+  """Generates a stockholm alignment resembling jackhmmer output.
+
+  About a fifth of the columns are insertions with respect to the query and
+  are only sparsely occupied, as in deep uniref90 alignments.
+  """
+  is_insert = rng.random(num_columns) < 0.2
+  is_insert[0] = False
+  occupancy = np.where(is_insert, 0.01, 0.8)
+  residues = np.empty((num_sequences, num_columns), dtype=np.uint8)
+  for start in range(0, num_sequences, _CHUNK_ROWS):
+    chunk = residues[start:start + _CHUNK_ROWS]
+    chunk[:] = rng.choice(_AMINO_ACIDS, size=chunk.shape)
+    chunk[rng.random(chunk.shape) >= occupancy] = ord('-')
+  residues[0, ~is_insert] = rng.choice(_AMINO_ACIDS, size=(~is_insert).sum())
+  residues[0, is_insert] = ord('-')
+  names = [f'UniRef90_{i}/1-{num_columns}' for i in range(num_sequences)]
+  names[0] = 'query'
+  reference = np.where(is_insert, ord('.'), ord('x')).astype(np.uint8)
+  width = max(len(name) for name in names)
+
+  lines = ['# STOCKHOLM 1.0', '']
+  lines.extend(f'#=GS {name:<{width}} DE [subseq from] Synthetic protein {i}'
+               for i, name in enumerate(names))
+  lines.append('')
+  for start in range(0, num_columns, block_width):
+    block = residues[:, start:start + block_width]
+    lines.extend(f'{name:<{width}} {row.tobytes().decode("ascii")}'
+                 for name, row in zip(names, block))
+    annotation = reference[start:start + block_width].tobytes().decode('ascii')
+    lines.append(f'{"#=GC RF":<{width}} {annotation}')
+    lines.append('')
+  lines.append('//')
+  return '\n'.join(lines) + '\n'
+
+
+def _gapped_sequence(length: int, gap_rate: float,
+                     rng: np.random.Generator) -> str:
+  residues = rng.choice(_AMINO_ACIDS, size=length)
+  residues[rng.random(length) < gap_rate] = ord('-')
+  return residues.tobytes().decode('ascii')
+
+
+def make_hhr(num_hits: int, num_columns: int, rng: np.random.Generator,
+             block_width: int = 80) -> str:
+  """Generates an .hhr file resembling hhsearch output against pdb70."""
+  lines = ['Query         query',
+           f'Match_columns {num_columns}',
+           'No_of_seqs    1000 out of 5000',
+           '',
+           ' No Hit                             Prob E-value P-value  Score    '
+           'SS Cols Query HMM  Template HMM']
+  names = [f'{i % 9000 + 1000:4d}_{chr(ord("A") + i % 26)}'
+           for i in range(num_hits)]
+  for i, name in enumerate(names, start=1):
+    lines.append(f'{i:3d} {name:<30} 99.9 1.1E-30 1.5E-34  200.5   0.0  '
+                 f'{num_columns:4d}    1-{num_columns:<4d}  1-{num_columns}')
+  lines.append('')
+
+  for i, name in enumerate(names, start=1):
+    aligned_cols = int(rng.integers(num_columns // 2, num_columns + 1))
+    lines.append(f'No {i}')
+    lines.append(f'>{name} Synthetic protein {i}; HYDROLASE')
+    lines.append(f'Probab=99.95  E-value=1.2e-30  Score=200.50  '
+                 f'Aligned_cols={aligned_cols}  Identities=35%  '
+                 f'Similarity=0.456  Sum_probs={rng.random() * 100:.1f}  '
+                 f'Template_Neff=8.900')
+    lines.append('')
+    query_start = int(rng.integers(1, 20))
+    hit_start = int(rng.integers(1, 50))
+    for start in range(0, aligned_cols, block_width):
+      width = min(block_width, aligned_cols - start)
+      query = _gapped_sequence(width, 0.1, rng)
+      hit = _gapped_sequence(width, 0.1, rng)
+      query_end = query_start + width - query.count('-') - 1
+      hit_end = hit_start + width - hit.count('-') - 1
+      lines.extend([
+          f'Q ss_pred             {"C" * width}',
+          f'Q query         {query_start:5d} {query} {query_end:4d} '
+          f'({num_columns})',
+          f'Q Consensus     {query_start:5d} {query.lower()} {query_end:4d} '
+          f'({num_columns})',
+          f'                      {"|" * width}',
+          f'T Consensus     {hit_start:5d} {hit.lower()} {hit_end:4d} '
+          f'({num_columns + 50})',
+          f'T {name:<14}{hit_start:5d} {hit} {hit_end:4d} '
+          f'({num_columns + 50})',
+          f'T ss_dssp             {"C" * width}',
+          f'Confidence            {"9" * width}',
+          '',
+      ])
+      query_start, hit_start = query_end + 1, hit_end + 1
+    lines.append('')
+  lines.append('Done!')
+  return '\n'.join(lines) + '\n'
+
+
+def make_tblout(num_sequences: int, rng: np.random.Generator) -> str:
+  """Generates a per-target tblout file resembling jackhmmer output."""
+  lines = ['# target name        accession  query name           accession    '
+           'E-value  score  bias   E-value  score  bias   exp reg clu  ov env '
+           'dom rep inc description of target',
+           '#------------------- ---------- -------------------- ---------- '
+           '--------- ------ ----- --------- ------ -----   --- --- --- --- '
+           '--- --- --- --- ---------------------']
+  e_values = np.sort(10.0 ** rng.uniform(-200, 1, size=num_sequences))
+  for i, e_value in enumerate(e_values):
+    lines.append(f'UniRef90_{i:<10} -          query                -          '
+                 f'{e_value:9.2g} {200.0:6.1f} {0.1:5.1f} {e_value:9.2g} '
+                 f'{200.0:6.1f} {0.1:5.1f}   1.0   1   1   0   1   1   1   1 '
+                 f'Synthetic protein {i} n=1 Tax=Synthetic')
+  lines.append('#')
+  lines.append('# Program:         jackhmmer')
+  lines.append('# [ok]')
+  return '\n'.join(lines) + '\n'
+
+
+def make_hmmsearch_a3m(num_hits: int, num_columns: int,
+                       rng: np.random.Generator) -> Tuple[str, str]:
+  """Generates a query and an a3m alignment resembling hmmsearch output."""
+  query = rng.choice(_AMINO_ACIDS, size=num_columns).tobytes().decode('ascii')
+  lines = ['>query', query]
+  for i in range(num_hits):
+    residues = rng.choice(_AMINO_ACIDS, size=num_columns)
+    is_aligned = np.flatnonzero(rng.random(num_columns) >= 0.3)
+    first, last = is_aligned[0], is_aligned[-1]
+    residues[:first] = ord('-')
+    residues[last + 1:] = ord('-')
+    row = []
+    start = 0
+    for column in np.flatnonzero(rng.random(num_columns) < 0.02):
+      row.append(residues[start:column + 1].tobytes())
+      row.append(rng.choice(_AMINO_ACIDS, size=rng.integers(1, 5)).tobytes(
+          ).lower())
+      start = column + 1
+    row.append(residues[start:].tobytes())
+    sequence = b''.join(row).decode('ascii')
+    hit_start = int(rng.integers(1, 30))
+    hit_end = hit_start + sum(r != '-' for r in sequence) - 1
+    pdb_id = f'{i % 9000 + 1000}x'
+    lines.append(f'>{pdb_id}_{chr(ord("A") + i % 26)}/{hit_start}-{hit_end} '
+                 f'[subseq from] mol:protein length:{hit_end + 10}  '
+                 f'Synthetic protein {i}')
+    lines.append(sequence)
+  return query, '\n'.join(lines) + '\n'
+
+
+@dataclasses.dataclass(frozen=True)
+class Benchmark:
+  """A parser to time on one kind of synthetic input.
+
+  Attributes:
+    name: The name of the benchmark, as passed to --benchmarks.
+    make_input: Generates the input from the number of rows, the number of
+      columns and a random generator. Benchmarks sharing `make_input` and
+      `rows_scale` share the generated input at each scale.
+    run: Runs the parser on the input.
+    reference: Runs the reference version of the parser on the input, if it
+      has one. Its output must be equal to the output of `run`.
+    rows_scale: The number of input rows per row of the requested scale.
+  """
+  name: str
+  make_input: Callable[[int, int, np.random.Generator], Any]
+  run: Callable[[Any], object]
+  reference: Optional[Callable[[Any], object]] = None
+  rows_scale: float = 1.0
+
+
+def _make_tblout(num_rows: int, num_columns: int,
+                 rng: np.random.Generator) -> str:
+  del num_columns  # Unused, tblout files have a fixed number of fields.
+  return make_tblout(num_rows, rng)
+
+
+BENCHMARKS = (
+    Benchmark(
+        name='parse_stockholm',
+        make_input=make_stockholm,
+        run=parsers.parse_stockholm,
+        reference=lambda sto: parsers.parse_stockholm(sto, vectorized=False)),
+    Benchmark(
+        name='read_stockholm_compact',
+        make_input=make_stockholm,
+        run=lambda sto: parsers.read_stockholm(io.StringIO(sto), compact=True)),
+    Benchmark(
+        name='parse_a3m',
+        make_input=make_a3m,
+        run=parsers.parse_a3m,
+        reference=lambda a3m: parsers.parse_a3m(a3m, vectorized=False)),
+    Benchmark(
+        name='read_a3m_compact',
+        make_input=make_a3m,
+        run=lambda a3m: parsers.read_a3m(io.StringIO(a3m), compact=True)),
+    Benchmark(
+        name='convert_stockholm_to_a3m',
+        make_input=make_stockholm,
+        run=parsers.convert_stockholm_to_a3m),
+    Benchmark(
+        name='remove_empty_columns_from_stockholm_msa',
+        make_input=make_stockholm,
+        run=parsers.remove_empty_columns_from_stockholm_msa,
+        reference=lambda sto: parsers.remove_empty_columns_from_stockholm_msa(
+            sto, vectorized=False)),
+    Benchmark(
+        name='deduplicate_stockholm_msa',
+        make_input=make_stockholm,
+        run=parsers.deduplicate_stockholm_msa),
+    Benchmark(
+        name='preprocess_stockholm_msa',
+        make_input=make_stockholm,
+        run=lambda sto: parsers.preprocess_stockholm_msa(io.StringIO(sto))),
+    Benchmark(
+        name='parse_hhr',
+        make_input=make_hhr,
+        run=parsers.parse_hhr,
+        rows_scale=_TEMPLATE_HITS_PER_ROW),
+    Benchmark(
+        name='parse_e_values_from_tblout',
+        make_input=_make_tblout,
+        run=parsers.parse_e_values_from_tblout),
+    Benchmark(
+        name='parse_hmmsearch_a3m',
+        make_input=make_hmmsearch_a3m,
+        run=lambda inputs: parsers.parse_hmmsearch_a3m(*inputs),
+        rows_scale=_TEMPLATE_HITS_PER_ROW),
+)
+
+
+def _time(fn: Callable[[Any], object], data: Any, repeats: int) -> float:
+  """Returns the best wall time of `repeats` calls to `fn` on `data`."""
+  best = float('inf')
+  for _ in range(repeats):
+    t0 = time.perf_counter()
+    fn(data)
+    best = min(best, time.perf_counter() - t0)
+  return best
+
+
+def _peak_memory(fn: Callable[[Any], object], data: Any) -> int:
+  """Returns the peak memory in bytes allocated by a call to `fn` on `data`."""
+  tracemalloc.start()
+  try:
+    fn(data)
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return peak
+
+
+def _input_size(inputs: Any) -> int:
+  """Returns the size in bytes of the text files in a benchmark input."""
+  if isinstance(inputs, str):
+    return len(inputs)
+  return sum(_input_size(x) for x in inputs)
+
+
+def _parse_scale(scale: str) -> Tuple[int, int]:
+  num_rows, num_columns = scale.lower().split('x')
+  return int(num_rows), int(num_columns)
+
+
+def run_benchmarks(benchmarks: Sequence[Benchmark],
+                   scales: Sequence[Tuple[int, int]], repeats: int,
+                   rng: np.random.Generator) -> List[Dict[str, Any]]:
+  """Runs the benchmarks at every scale.
+
+  Args:
+    benchmarks: The benchmarks to run.
+    scales: The (rows, columns) sizes of the synthetic inputs.
+    repeats: The number of timed runs of each parser. The best time is kept.
+    rng: The random generator for the synthetic inputs.
+
+  Returns:
+    One result per benchmark and scale, with the best wall time in seconds,
+    the throughput in MB and input rows per second, and the peak memory in
+    MB traced while parsing the input once.
+
+  Raises:
+    RuntimeError: If a parser's output differs from its reference version.
+  """
+  results = []
+  for num_rows, num_columns in scales:
+    inputs = {}
+    for benchmark in benchmarks:
+      input_rows = max(1, int(num_rows * benchmark.rows_scale))
+      key = (benchmark.make_input, input_rows)
+      if key not in inputs:
+        inputs[key] = benchmark.make_input(input_rows, num_columns, rng)
+      data = inputs[key]
+      input_mb = _input_size(data) / 2**20
+
+      if (benchmark.reference is not None and
+          benchmark.run(data) != benchmark.reference(data)):
+        raise RuntimeError(
+            f'{benchmark.name} differs from its reference version.')
+      seconds = _time(benchmark.run, data, repeats)
+      result = {
+          'benchmark': benchmark.name,
+          'rows': num_rows,
+          'columns': num_columns,
+          'input_mb': round(input_mb, 3),
+          'seconds': seconds,
+          'mb_per_second': input_mb / seconds,
+          'rows_per_second': input_rows / seconds,
+          'peak_memory_mb': _peak_memory(benchmark.run, data) / 2**20,
+      }
+      message = ('%s %dx%d: %.3fs, %.1f MB/s, %.0f rows/s, peak memory '
+                 '%.1f MB')
+      args = [benchmark.name, num_rows, num_columns, seconds,
+              result['mb_per_second'], result['rows_per_second'],
+              result['peak_memory_mb']]
+      if benchmark.reference is not None:
+        result['reference_seconds'] = _time(
+            benchmark.reference, data, repeats)
+        message += ', reference %.3fs (%.1fx)'
+        args += [result['reference_seconds'],
+                 result['reference_seconds'] / seconds]
+      logging.info(message, *args)
+      results.append(result)
+  return results
+
+
+def compare_to_baseline(results: Sequence[Dict[str, Any]],
+                        baseline: Sequence[Dict[str, Any]],
+                        threshold: float) -> List[Dict[str, Any]]:
+  """Logs the change of each result relative to the baseline.
+
+  Args:
+    results: The results of this run.
+    baseline: The results of an earlier run.
+    threshold: The ratio of this run's time to the baseline time above which
+      a result is reported as a regression.
+
+  Returns:
+    The results that regressed.
+  """
+  baseline_seconds = {
+      (r['benchmark'], r['rows'], r['columns']): r['seconds'] for r in baseline}
+  regressions = []
+  for result in results:
+    key = (result['benchmark'], result['rows'], result['columns'])
+    if key not in baseline_seconds:
+      continue
+    ratio = result['seconds'] / baseline_seconds[key]
+    if ratio > threshold:
+      logging.warning('%s %dx%d regressed: %.3fs vs %.3fs in the baseline '
+                      '(%.2fx)', *key, result['seconds'],
+                      baseline_seconds[key], ratio)
+      regressions.append(result)
+    else:
+      logging.info('%s %dx%d: %.2fx the baseline time', *key, ratio)
+  return regressions
+
+
+def _main(argv):
+  del argv
+  benchmarks = BENCHMARKS
+  if FLAGS.benchmarks:
+    unknown = set(FLAGS.benchmarks) - {b.name for b in BENCHMARKS}
+    if unknown:
+      raise ValueError(f'Unknown benchmarks: {sorted(unknown)}')
+    benchmarks = [b for b in BENCHMARKS if b.name in FLAGS.benchmarks]
+  scales = [_parse_scale(scale) for scale in FLAGS.scales]
+
+  rng = np.random.default_rng(FLAGS.seed)
+  results = run_benchmarks(benchmarks, scales, FLAGS.repeats, rng)
+
+  if FLAGS.output_path:
+    with open(FLAGS.output_path, 'w') as f:
+      json.dump({
+          'python_version': platform.python_version(),
+          'numpy_version': np.__version__,
+          'machine': platform.machine(),
+          'processor': platform.processor(),
+          'seed': FLAGS.seed,
+          'repeats': FLAGS.repeats,
+          'results': results,
+      }, f, indent=2)
+  if FLAGS.baseline_path:
+    with open(FLAGS.baseline_path) as f:
+      baseline = json.load(f)['results']
+    compare_to_baseline(results, baseline, FLAGS.regression_threshold)
+
+
+if __name__ == '__main__':
+  app.run(_main)
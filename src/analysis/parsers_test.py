@@ -0,0 +1,713 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests that the fast parser paths match the reference implementations.
+
+The alignments are generated from the query sequences of the FASTA files in
+`sequences/`, with insert columns, empty columns, duplicated rows and several
+alignment blocks, as in jackhmmer output.
+"""
+import collections
+import glob
+import io
+import itertools
+import os
+from typing import List, Sequence, Tuple
+
+import numpy as np
+import pytest
+
+import parsers
+
+
+_SEQUENCES_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    'sequences')
+_FASTA_PATHS = sorted(glob.glob(os.path.join(_SEQUENCES_DIR, '*.fasta')))
+_NUM_HITS = 40
+_BLOCK_WIDTH = 60
+
+_AMINO_ACIDS = np.frombuffer(b'ACDEFGHIKLMNPQRSTVWY', dtype=np.uint8)
+
+
+def _queries() -> List[Tuple[str, str]]:
+  """Returns an (id, sequence) pair for each record of the FASTA files."""
+  queries = []
+  for path in _FASTA_PATHS:
+    with open(path) as f:
+      sequences, _ = parsers.parse_fasta(f.read())
+    name = os.path.splitext(os.path.basename(path))[0]
+    queries.extend((f'{name}_{i}', sequence)
+                   for i, sequence in enumerate(sequences) if sequence)
+  return queries
+
+
+_QUERIES = _queries()
+
+
+def _alignment_rows(query: str, rng: np.random.Generator) -> np.ndarray:
+  """Returns an aligned [num_rows, num_cols] uint8 matrix for a query.
+
+  Query residues are match columns. Insert columns, where the query has a
+  gap, follow some of them; some insert columns are empty. Hits mutate,
+  delete and insert residues, and some hits duplicate an earlier hit apart
+  from its insertions.
+  """
+  query_codes = np.frombuffer(query.upper().encode('ascii'), dtype=np.uint8)
+  num_inserts = rng.choice([0, 0, 0, 1, 2], size=query_codes.size)
+  column_ends = np.cumsum(num_inserts + 1)
+  is_match = np.zeros(column_ends[-1], dtype=bool)
+  is_match[column_ends - num_inserts - 1] = True
+  is_empty = ~is_match & (rng.random(is_match.size) < 0.3)
+
+  rows = np.full((_NUM_HITS + 1, is_match.size), ord('-'), np.uint8)
+  rows[0, is_match] = query_codes
+  for i in range(1, _NUM_HITS + 1):
+    if i % 7 == 0:
+      # Same residues as an earlier hit in the match columns.
+      rows[i, is_match] = rows[i - 3, is_match]
+    else:
+      residues = query_codes.copy()
+      mutated = rng.random(residues.size) < 0.3
+      residues[mutated] = rng.choice(_AMINO_ACIDS, size=mutated.sum())
+      residues[rng.random(residues.size) < 0.1] = ord('-')
+      rows[i, is_match] = residues
+    inserted = ~is_match & ~is_empty & (rng.random(is_match.size) < 0.4)
+    rows[i, inserted] = rng.choice(_AMINO_ACIDS, size=inserted.sum())
+  return rows
+
+
+def _stockholm(query_id: str, query: str, seed: int = 0,
+               num_features: int = 1) -> str:
+  """Returns a jackhmmer-like Stockholm alignment of a query.
+
+  Args:
+    query_id: The name of the query row.
+    query: The query sequence.
+    seed: The seed of the random hits.
+    num_features: The number of #=GS lines of each hit: a DE description
+      line, followed by AC lines.
+  """
+  rows = _alignment_rows(query, np.random.default_rng(seed))
+  names = [query_id] + [f'hit{i}/1-{len(query)}' for i in range(1, len(rows))]
+  width = max(len(name) for name in names + ['#=GC RF'])
+  reference = np.where(rows[0] == ord('-'), ord('.'), ord('x')).astype(
+      np.uint8)
+
+  lines = ['# STOCKHOLM 1.0', '']
+  for name in names[1:]:
+    lines.append(f'#=GS {name:<{width}} DE [subseq from] hit of {query_id}')
+    lines.extend(f'#=GS {name:<{width}} AC P{i:05d}'
+                 for i in range(1, num_features))
+  lines.append('')
+  for start in range(0, rows.shape[1], _BLOCK_WIDTH):
+    block = rows[:, start:start + _BLOCK_WIDTH]
+    lines.extend(f'{name:<{width}} {row.tobytes().decode()}'
+                 for name, row in zip(names, block))
+    lines.append(f'{"#=GC RF":<{width}} '
+                 f'{reference[start:start + _BLOCK_WIDTH].tobytes().decode()}')
+    lines.append('')
+  lines.append('//')
+  return '\n'.join(lines) + '\n'
+
+
+def _tblout(stockholm: str, seed: int) -> str:
+  """Returns a tblout with random e-values for the hits of an alignment."""
+  rng = np.random.default_rng(seed)
+  names = list(parsers.iter_stockholm_names(io.StringIO(stockholm)))[1:]
+  # Round e-values so that hits of different chunks tie.
+  e_values = np.round(rng.random(len(names)), 1)
+  lines = ['# target name  accession  query name  accession  E-value']
+  lines.extend(f'{name.partition("/")[0]} - query - {e_value:.1e} 100.0'
+               for name, e_value in zip(names, e_values))
+  return '\n'.join(lines) + '\n'
+
+
+def _assert_msas_equal(msa: parsers.Msa, expected: parsers.Msa):
+  assert list(msa.sequences) == list(expected.sequences)
+  assert ([list(row) for row in msa.deletion_matrix] ==
+          [list(row) for row in expected.deletion_matrix])
+  assert list(msa.descriptions) == list(expected.descriptions)
+
+
+def _write(tmp_path, name: str, contents: str) -> str:
+  path = tmp_path / name
+  path.write_text(contents)
+  return str(path)
+
+
+# Reference implementations of the parsers before they were optimized.
+
+
+def _deduplicate_stockholm_msa_reference(stockholm_msa: str) -> str:
+  sequence_dict = collections.defaultdict(str)
+  for line in stockholm_msa.splitlines():
+    if line.strip() and not line.startswith(('#', '//')):
+      seqname, alignment = line.strip().split()
+      sequence_dict[seqname] += alignment
+
+  seen_sequences = set()
+  seqnames = set()
+  query_align = next(iter(sequence_dict.values()))
+  mask = [c != '-' for c in query_align]
+  for seqname, alignment in sequence_dict.items():
+    masked_alignment = ''.join(itertools.compress(alignment, mask))
+    if masked_alignment not in seen_sequences:
+      seen_sequences.add(masked_alignment)
+      seqnames.add(seqname)
+  return '\n'.join(line for line in stockholm_msa.splitlines()
+                   if parsers._keep_line(line, seqnames)) + '\n'
+
+
+def _truncate_stockholm_msa_reference(stockholm_msa_path: str,
+                                      max_sequences: int) -> str:
+  seqnames = set()
+  with open(stockholm_msa_path) as f:
+    for line in f:
+      if line.strip() and not line.startswith(('#', '//')):
+        seqnames.add(line.partition(' ')[0])
+        if len(seqnames) >= max_sequences:
+          break
+    f.seek(0)
+    return ''.join(line for line in f if parsers._keep_line(line, seqnames))
+
+
+def _merge_chunked_msa_reference(results, max_hits=None) -> parsers.Msa:
+  unsorted_results = []
+  for chunk_index, chunk in enumerate(results):
+    msa = parsers.parse_stockholm(chunk['sto'], vectorized=False)
+    e_values_dict = parsers.parse_e_values_from_tblout(chunk['tbl'])
+    e_values = [e_values_dict[t.partition('/')[0]] for t in msa.descriptions]
+    chunk_results = zip(
+        msa.sequences, msa.deletion_matrix, msa.descriptions, e_values)
+    if chunk_index != 0:
+      next(chunk_results)
+    unsorted_results.extend(chunk_results)
+
+  sorted_by_evalue = sorted(unsorted_results, key=lambda x: x[-1])
+  sequences, deletion_matrix, descriptions, _ = zip(*sorted_by_evalue)
+  msa = parsers.Msa(sequences=list(sequences),
+                    deletion_matrix=list(deletion_matrix),
+                    descriptions=list(descriptions))
+  if max_hits is not None:
+    msa = msa.truncate(max_seqs=max_hits)
+  return msa
+
+
+_HHR = """\
+Query         T1050
+Match_columns 10
+No_of_seqs    1 out of 1
+
+ No Hit                             Prob E-value P-value  Score    SS Cols
+  1 1abc_A Protein A               99.9 1e-30   1e-34  200.0   0.0    8
+  2 2xyz_B Protein B               50.0 1e-2    1e-6    20.0   0.0    6
+
+No 1
+>1abc_A Protein A; hydrolase
+Probab=99.90  E-value=1e-30  Score=200.00  Aligned_cols=8  Identities=50%  Similarity=0.500  Sum_probs=7.5  Template_Neff=9.000
+
+Q T1050             1 MASQ--SYLF    8 (10)
+Q Consensus         1 ~~~~~~~~~~    8 (10)
+                      |||   ||||
+T Consensus         3 ~~~~~~~~~~   12 (50)
+T 1abc_A            3 MAS-QQSYLF   12 (50)
+
+No 2
+>2xyz_B Protein B
+Probab=50.00  E-value=1e-2  Score=20.00  Aligned_cols=6  Identities=30%  Similarity=0.300  Sum_probs=4.0  Template_Neff=2.000
+
+Q T1050             3 SQSYLF    8 (10)
+Q Consensus         3 ~~~~~~    8 (10)
+T Consensus        10 ~~~~~~   14 (20)
+T 2xyz_B           10 SQ-YLF   14 (20)
+
+Done!
+"""
+
+
+# user-001: vectorized parse_stockholm.
+
+
+@pytest.mark.parametrize('query_id,query', _QUERIES)
+def test_parse_stockholm_vectorized_matches_python(query_id, query):
+  stockholm = _stockholm(query_id, query)
+  _assert_msas_equal(parsers.parse_stockholm(stockholm, vectorized=True),
+                     parsers.parse_stockholm(stockholm, vectorized=False))
+
+
+def test_parse_stockholm_ragged_rows_fall_back():
+  stockholm = 'query ABC-D\nhit1 AB--D\nhit2 A-CDDE\n'
+  assert parsers._stockholm_residue_matrix(['ABC-D', 'A-CDDE']) is None
+  _assert_msas_equal(parsers.parse_stockholm(stockholm, vectorized=True),
+                     parsers.parse_stockholm(stockholm, vectorized=False))
+
+
+def test_parse_stockholm_non_ascii_rows_fall_back():
+  stockholm = 'query ABC-D\nhit1 ABÉ-D\nhit2 A-CXD\n'
+  assert parsers._stockholm_residue_matrix(['ABC-D', 'ABÉ-D']) is None
+  msa = parsers.parse_stockholm(stockholm, vectorized=True)
+  _assert_msas_equal(msa, parsers.parse_stockholm(stockholm, vectorized=False))
+  assert msa.sequences[1] == 'ABÉD'
+
+
+def test_parse_stockholm_empty():
+  _assert_msas_equal(parsers.parse_stockholm('', vectorized=True),
+                     parsers.parse_stockholm('', vectorized=False))
+
+
+# user-002: streaming readers.
+
+
+@pytest.mark.parametrize('query_id,query', _QUERIES[:3])
+@pytest.mark.parametrize('max_sequences', [None, 1, 5, 1000])
+def test_read_stockholm_matches_parse_of_truncated_file(
+    tmp_path, query_id, query, max_sequences):
+  path = _write(tmp_path, 'msa.sto', _stockholm(query_id, query))
+  if max_sequences is None:
+    with open(path) as f:
+      expected = parsers.parse_stockholm(f.read())
+  else:
+    expected = parsers.parse_stockholm(
+        _truncate_stockholm_msa_reference(path, max_sequences))
+  _assert_msas_equal(
+      parsers.read_stockholm(path, max_sequences=max_sequences), expected)
+  with open(path) as f:
+    _assert_msas_equal(
+        parsers.read_stockholm(f, max_sequences=max_sequences), expected)
+
+
+@pytest.mark.parametrize('query_id,query', _QUERIES[:3])
+@pytest.mark.parametrize('max_sequences', [None, 1, 5])
+def test_read_a3m_matches_parse_of_first_records(
+    tmp_path, query_id, query, max_sequences):
+  a3m = parsers.convert_stockholm_to_a3m(_stockholm(query_id, query))
+  path = _write(tmp_path, 'msa.a3m', a3m)
+  sequences, descriptions = parsers.parse_fasta(a3m)
+  num_sequences = max_sequences or len(sequences)
+  expected = parsers._a3m_to_msa_python(sequences[:num_sequences],
+                                        descriptions[:num_sequences])
+  _assert_msas_equal(parsers.read_a3m(path, max_sequences=max_sequences),
+                     expected)
+
+
+@pytest.mark.parametrize('path', _FASTA_PATHS)
+def test_iter_fasta_matches_parse_fasta(path):
+  with open(path) as f:
+    sequences, descriptions = parsers.parse_fasta(f.read())
+  assert list(parsers.iter_fasta(path)) == list(zip(descriptions, sequences))
+
+
+def test_iter_stockholm_names_reads_first_block():
+  stockholm = _stockholm('query', _QUERIES[0][1])
+  names = list(parsers.iter_stockholm_names(io.StringIO(stockholm)))
+  assert names == parsers.parse_stockholm(stockholm).descriptions
+
+
+# user-003: compact ArrayMsa.
+
+
+@pytest.mark.parametrize('query_id,query', _QUERIES)
+def test_array_msa_matches_msa(tmp_path, query_id, query):
+  stockholm = _stockholm(query_id, query)
+  path = _write(tmp_path, 'msa.sto', stockholm)
+  msa = parsers.parse_stockholm(stockholm, vectorized=False)
+  array_msa = parsers.read_stockholm(path, compact=True)
+
+  assert len(array_msa) == len(msa)
+  _assert_msas_equal(array_msa, msa)
+  _assert_msas_equal(array_msa.to_msa(), msa)
+  _assert_msas_equal(parsers.ArrayMsa.from_msa(msa), msa)
+  np.testing.assert_array_equal(array_msa.dense_deletion_matrix(),
+                                np.array(msa.deletion_matrix))
+
+  truncated = array_msa.truncate(7)
+  _assert_msas_equal(truncated, msa.truncate(7))
+
+  array_msa.save(str(tmp_path / 'msa.npy'))
+  _assert_msas_equal(parsers.ArrayMsa.load(str(tmp_path / 'msa.npy')), msa)
+
+
+# user-004: vectorized parse_a3m.
+
+
+@pytest.mark.parametrize('query_id,query', _QUERIES)
+def test_parse_a3m_vectorized_matches_python(query_id, query):
+  a3m = parsers.convert_stockholm_to_a3m(_stockholm(query_id, query))
+  _assert_msas_equal(parsers.parse_a3m(a3m, vectorized=True),
+                     parsers.parse_a3m(a3m, vectorized=False))
+
+
+def test_parse_a3m_ragged_and_non_ascii_rows_fall_back():
+  for a3m in ('>q\nABCD\n>h1\nAbBC\n>h2\nABCDE\n',
+              '>q\nABCD\n>h1\nAbBÉD\n'):
+    _assert_msas_equal(parsers.parse_a3m(a3m, vectorized=True),
+                       parsers.parse_a3m(a3m, vectorized=False))
+
+
+# user-005: fused template search preprocessing.
+
+
+@pytest.mark.parametrize('query_id,query', _QUERIES)
+def test_preprocess_stockholm_msa_matches_three_step_chain(
+    tmp_path, query_id, query):
+  stockholm = _stockholm(query_id, query)
+  path = _write(tmp_path, 'msa.sto', stockholm)
+  pruned = parsers.remove_empty_columns_from_stockholm_msa(
+      _deduplicate_stockholm_msa_reference(stockholm), vectorized=False)
+
+  assert (parsers.preprocess_stockholm_msa(path, output_format='a3m') ==
+          parsers.convert_stockholm_to_a3m(pruned))
+  _assert_msas_equal(
+      parsers.parse_stockholm(
+          parsers.preprocess_stockholm_msa(path, output_format='sto')),
+      parsers.parse_stockholm(pruned))
+
+
+# user-006: vectorized remove_empty_columns_from_stockholm_msa.
+
+
+@pytest.mark.parametrize('query_id,query', _QUERIES)
+def test_remove_empty_columns_vectorized_matches_python(query_id, query):
+  stockholm = _stockholm(query_id, query)
+  assert (parsers.remove_empty_columns_from_stockholm_msa(
+      stockholm, vectorized=True) ==
+          parsers.remove_empty_columns_from_stockholm_msa(
+              stockholm, vectorized=False))
+
+
+# user-007: digest-based deduplication.
+
+
+@pytest.mark.parametrize('query_id,query', _QUERIES)
+def test_deduplicate_stockholm_msa_matches_reference(query_id, query):
+  stockholm = _stockholm(query_id, query)
+  deduplicated = parsers.deduplicate_stockholm_msa(stockholm)
+  assert deduplicated == _deduplicate_stockholm_msa_reference(stockholm)
+  assert (len(parsers.parse_stockholm(deduplicated)) <
+          len(parsers.parse_stockholm(stockholm)))
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_deduplicate_msas_keeps_first_occurrences(compact):
+  msas = [parsers.parse_stockholm(_stockholm('query', query, seed=seed))
+          for seed, (_, query) in enumerate(_QUERIES[:1] * 3)]
+  seen = set()
+  expected = []
+  for msa in msas:
+    keep = [i for i, sequence in enumerate(msa.sequences)
+            if not (sequence in seen or seen.add(sequence))]
+    expected.append(parsers.Msa(
+        sequences=[msa.sequences[i] for i in keep],
+        deletion_matrix=[msa.deletion_matrix[i] for i in keep],
+        descriptions=[msa.descriptions[i] for i in keep]))
+  if compact:
+    msas = [parsers.ArrayMsa.from_msa(msa) for msa in msas]
+  for msa, expected_msa in zip(parsers.deduplicate_msas(msas), expected):
+    _assert_msas_equal(msa, expected_msa)
+
+
+# user-008: lazy HHR index.
+
+
+def test_parse_hhr():
+  hits = parsers.parse_hhr(_HHR)
+  assert len(hits) == parsers.count_hhr_hits(_HHR) == 2
+  assert [hit.index for hit in hits] == [1, 2]
+  assert hits[0].name == '1abc_A Protein A; hydrolase'
+  assert hits[0].aligned_cols == 8
+  assert hits[0].sum_probs == 7.5
+  assert hits[0].query == 'MASQ--SYLF'
+  assert hits[0].hit_sequence == 'MAS-QQSYLF'
+  np.testing.assert_array_equal(hits[0].indices_query,
+                                [0, 1, 2, 3, -1, -1, 4, 5, 6, 7])
+  np.testing.assert_array_equal(hits[0].indices_hit,
+                                [2, 3, 4, -1, 5, 6, 7, 8, 9, 10])
+
+
+def test_parse_hhr_max_hits():
+  first_hit, = parsers.parse_hhr(_HHR, max_hits=1)
+  assert first_hit.name == parsers.parse_hhr(_HHR)[0].name
+  assert parsers.HhrIndex(_HHR)[-1].name == '2xyz_B Protein B'
+  assert parsers.count_hhr_hits('') == 0
+
+
+# user-010: memory-mapped truncate_stockholm_msa.
+
+
+@pytest.mark.parametrize('query_id,query', _QUERIES[:3])
+@pytest.mark.parametrize('max_sequences', [1, 2, 10, 1000])
+def test_truncate_stockholm_msa_matches_reference(
+    tmp_path, query_id, query, max_sequences):
+  path = _write(tmp_path, 'msa.sto', _stockholm(query_id, query))
+  expected = _truncate_stockholm_msa_reference(path, max_sequences)
+  assert parsers.truncate_stockholm_msa(path, max_sequences) == expected
+
+  output_path = str(tmp_path / 'truncated.sto')
+  assert parsers.truncate_stockholm_msa(
+      path, max_sequences, output=output_path) is None
+  with open(output_path) as f:
+    assert f.read() == expected
+  buffer = io.BytesIO()
+  parsers.truncate_stockholm_msa(path, max_sequences, output=buffer)
+  assert buffer.getvalue().decode() == expected
+
+
+@pytest.mark.parametrize('max_sequences', [1, 2, 3, 10])
+def test_truncate_stockholm_msa_keeps_all_gs_lines(tmp_path, max_sequences):
+  # Several #=GS lines per kept sequence must not end the header early.
+  path = _write(tmp_path, 'msa.sto',
+                _stockholm('query', _QUERIES[0][1], num_features=3))
+  truncated = parsers.truncate_stockholm_msa(path, max_sequences)
+  assert truncated == _truncate_stockholm_msa_reference(path, max_sequences)
+  assert truncated.count('#=GS') == 3 * (max_sequences - 1)
+
+
+def test_truncate_stockholm_msa_empty_file(tmp_path):
+  path = _write(tmp_path, 'msa.sto', '')
+  assert parsers.truncate_stockholm_msa(path, 5) == ''
+
+
+# user-011: k-way merge of chunked jackhmmer results.
+
+
+def _chunked_results(num_chunks: int) -> Sequence[dict]:
+  query = _QUERIES[0][1]
+  results = []
+  for seed in range(num_chunks):
+    stockholm = _stockholm('query', query, seed=seed)
+    # Give each chunk its own hit names, as for distinct database shards.
+    stockholm = stockholm.replace('hit', f'chunk{seed}hit')
+    results.append({'sto': stockholm, 'tbl': _tblout(stockholm, seed)})
+  return results
+
+
+@pytest.mark.parametrize('max_hits', [None, 0, 1, 10, 1000])
+@pytest.mark.parametrize('num_chunks', [1, 3])
+def test_merge_chunked_msa_matches_reference(monkeypatch, max_hits, num_chunks):
+  # The notebook helpers import the parsers from the analysis package, and
+  # need matplotlib.
+  monkeypatch.syspath_prepend(os.path.join(
+      os.path.dirname(os.path.abspath(__file__)), os.pardir))
+  notebook_utils = pytest.importorskip('analysis.notebook_utils')
+  results = _chunked_results(num_chunks)
+  _assert_msas_equal(
+      notebook_utils.merge_chunked_msa(results, max_hits=max_hits),
+      _merge_chunked_msa_reference(results, max_hits=max_hits))
+
+
+# user-012: merge of the alignments of sharded jackhmmer searches.
+
+
+def _shard(stockholm: str, tblout: str,
+           hit_names: Sequence[str]) -> Tuple[str, str]:
+  """Returns the alignment and tblout of the query and some of its hits."""
+  query_name = next(parsers.iter_stockholm_names(io.StringIO(stockholm)))
+  names = {query_name, *hit_names}
+  target_names = {name.partition('/')[0] for name in hit_names}
+  shard_stockholm = '\n'.join(
+      line for line in stockholm.splitlines()
+      if parsers._keep_line(line, names)) + '\n'
+  shard_tblout = '\n'.join(
+      line for line in tblout.splitlines()
+      if line.startswith('#') or line.partition(' ')[0] in target_names)
+  return shard_stockholm, shard_tblout + '\n'
+
+
+def _sharded_search(seed: int):
+  """Returns an alignment, its tblout and the shards of its hits.
+
+  The hits are dealt to two shards, and the first hit is in both.
+  """
+  stockholm = _stockholm('query', _QUERIES[0][1], seed=seed)
+  tblout = _tblout(stockholm, seed)
+  hit_names = list(parsers.iter_stockholm_names(io.StringIO(stockholm)))[1:]
+  shard_hits = [hit_names[::2], hit_names[:1] + hit_names[1::2]]
+  return stockholm, tblout, [
+      _shard(stockholm, tblout, names) for names in shard_hits], shard_hits
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+@pytest.mark.parametrize('max_sequences', [None, 1, 10])
+def test_merge_stockholm_msas_matches_unsharded_search(seed, max_sequences):
+  stockholm, tblout, shards, shard_hits = _sharded_search(seed)
+
+  merged = parsers.merge_stockholm_msas(
+      stockholm_msas=[shard_stockholm for shard_stockholm, _ in shards],
+      tblouts=[shard_tblout for _, shard_tblout in shards],
+      max_sequences=max_sequences)
+
+  # The unsharded alignment sorted by e-value, ties broken by shard and then
+  # by row, as documented.
+  msa = parsers.parse_stockholm(stockholm, vectorized=False)
+  e_values = parsers.parse_e_values_from_tblout(tblout)
+  shard_of = {name: shard_index
+              for shard_index, names in reversed(list(enumerate(shard_hits)))
+              for name in names}
+  rows = sorted(range(1, len(msa)), key=lambda i: (
+      e_values[msa.descriptions[i].partition('/')[0]],
+      shard_of[msa.descriptions[i]], i))
+  rows = [0] + rows
+  if max_sequences is not None:
+    rows = rows[:max_sequences]
+  expected = parsers.Msa(
+      sequences=[msa.sequences[i] for i in rows],
+      deletion_matrix=[msa.deletion_matrix[i] for i in rows],
+      descriptions=[msa.descriptions[i] for i in rows])
+  _assert_msas_equal(parsers.parse_stockholm(merged), expected)
+
+
+def test_merge_stockholm_msas_hit_without_e_value():
+  _, _, shards, shard_hits = _sharded_search(0)
+  missing_name = shard_hits[1][-1]
+  truncated_tblout = '\n'.join(
+      line for line in shards[1][1].splitlines()
+      if line.partition(' ')[0] != missing_name.partition('/')[0])
+
+  with pytest.raises(ValueError, match=f'{missing_name} of shard 1'):
+    parsers.merge_stockholm_msas(
+        stockholm_msas=[shard_stockholm for shard_stockholm, _ in shards],
+        tblouts=[shards[0][1], truncated_tblout])
+
+
+# user-013: FASTA record index.
+
+
+def _multi_fasta() -> str:
+  """Returns the queries as a multi-FASTA file with wrapped sequences."""
+  records = []
+  for i, (query_id, query) in enumerate(_QUERIES):
+    lines = [query[start:start + _BLOCK_WIDTH]
+             for start in range(0, len(query), _BLOCK_WIDTH)]
+    if i % 3 == 1:
+      lines.append('')  # A blank line after the record.
+    records.append('\n'.join([f'>{query_id} record {i}'] + lines))
+  records.insert(2, '>empty record')
+  return '\n'.join(records) + '\n'
+
+
+@pytest.mark.parametrize('path', _FASTA_PATHS)
+def test_fasta_index_matches_parse_fasta(path):
+  with open(path) as f:
+    sequences, descriptions = parsers.parse_fasta(f.read())
+  assert list(parsers.FastaIndex(path)) == list(zip(descriptions, sequences))
+
+
+def test_fasta_index_random_access(tmp_path):
+  fasta = _multi_fasta()
+  path = _write(tmp_path, 'batch.fasta', fasta)
+  sequences, descriptions = parsers.parse_fasta(fasta)
+  expected = list(zip(descriptions, sequences))
+
+  index = parsers.FastaIndex(path)
+  assert len(index) == len(expected)
+  assert list(index) == expected
+  assert list(parsers.iter_fasta(path)) == expected
+  for i in reversed(range(len(expected))):
+    assert index[i] == expected[i]
+  assert index[-1] == expected[-1]
+  assert index[1:5] == expected[1:5]
+  with pytest.raises(IndexError):
+    index[len(expected)]
+
+  reused = parsers.FastaIndex(path, offsets=index.offsets)
+  assert list(reused) == expected
+
+
+def test_fasta_index_empty_file(tmp_path):
+  assert not len(parsers.FastaIndex(_write(tmp_path, 'empty.fasta', '')))
+
+
+# user-015: vectorized parse_hmmsearch_a3m.
+
+
+def _hmmsearch_a3m(query_id: str, query: str, seed: int = 0) -> str:
+  """Returns an hmmsearch-like a3m of template hits of a query.
+
+  Every fifth hit is not a protein chain and is skipped by the parser.
+  """
+  rng = np.random.default_rng(seed)
+  a3m = parsers.convert_stockholm_to_a3m(
+      _stockholm(query_id, query, seed=seed))
+  sequences, _ = parsers.parse_fasta(a3m)
+  records = [f'>{query_id}\n{sequences[0]}']
+  for i, sequence in enumerate(sequences[1:], start=1):
+    start = int(rng.integers(1, 200))
+    length = start + len(sequence) + int(rng.integers(0, 50))
+    molecule = 'na' if i % 5 == 0 else 'protein'
+    records.append(
+        f'>{i}abc_{"ABC"[i % 3]}/{start}-{start + len(sequence)} '
+        f'[subseq from] mol:{molecule} length:{length}  Hit {i}\n{sequence}')
+  return '\n'.join(records) + '\n'
+
+
+def _assert_template_hits_equal(hits, expected):
+  assert len(hits) == len(expected)
+  for hit, expected_hit in zip(hits, expected):
+    for field in ('index', 'name', 'aligned_cols', 'sum_probs', 'query',
+                  'hit_sequence'):
+      assert getattr(hit, field) == getattr(expected_hit, field)
+    np.testing.assert_array_equal(hit.indices_query,
+                                  expected_hit.indices_query)
+    np.testing.assert_array_equal(hit.indices_hit, expected_hit.indices_hit)
+
+
+@pytest.mark.parametrize('query_id,query', _QUERIES)
+@pytest.mark.parametrize('skip_first', [True, False])
+def test_parse_hmmsearch_a3m_vectorized_matches_python(
+    query_id, query, skip_first):
+  a3m = _hmmsearch_a3m(query_id, query)
+  if not skip_first:
+    # hmmsearch output without the query row.
+    a3m = a3m.split('\n', 2)[2]
+  hits = parsers.parse_hmmsearch_a3m(query, a3m, skip_first=skip_first,
+                                     vectorized=True)
+  assert hits
+  _assert_template_hits_equal(
+      hits, parsers.parse_hmmsearch_a3m(query, a3m, skip_first=skip_first,
+                                        vectorized=False))
+
+
+def test_parse_hmmsearch_a3m_non_ascii_falls_back():
+  query_id, query = _QUERIES[0]
+  a3m = _hmmsearch_a3m(query_id, query).replace('Hit 1\n', 'Hit 1\n\u00e9', 1)
+  _assert_template_hits_equal(
+      parsers.parse_hmmsearch_a3m(query, a3m, vectorized=True),
+      parsers.parse_hmmsearch_a3m(query, a3m, vectorized=False))
+
+
+def test_parse_hmmsearch_a3m_no_hits():
+  query_id, query = _QUERIES[0]
+  assert not parsers.parse_hmmsearch_a3m(query, f'>{query_id}\n{query}\n')
+
+
+# user-016: MSA record counts.
+
+
+@pytest.mark.parametrize('query_id,query', _QUERIES[:3])
+def test_count_msa_records_matches_parsed_length(tmp_path, query_id, query):
+  stockholm = _stockholm(query_id, query, num_features=2)
+  sto_path = _write(tmp_path, 'msa.sto', stockholm)
+  a3m_path = _write(tmp_path, 'msa.a3m',
+                    parsers.convert_stockholm_to_a3m(stockholm))
+  hhr_path = _write(tmp_path, 'hits.hhr', _HHR)
+
+  assert (parsers.count_msa_records(sto_path) ==
+          len(parsers.read_stockholm(sto_path)))
+  assert (parsers.count_msa_records(a3m_path) ==
+          len(parsers.read_a3m(a3m_path)))
+  assert parsers.count_msa_records(hhr_path) == len(parsers.parse_hhr(_HHR))
+  assert parsers.count_msa_records(_write(tmp_path, 'empty.sto', '')) == 0
+  with pytest.raises(ValueError):
+    parsers.count_msa_records(_write(tmp_path, 'msa.txt', stockholm))
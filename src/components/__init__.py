@@ -22,3 +22,4 @@ from .jackhmmer import jackhmmer
 from .model_predict import predict
 from .relax_protein import relax
 from .predict_relax import predict_relax
+from .predict_batch import predict_batch
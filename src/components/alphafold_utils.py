@@ -14,13 +14,24 @@
 
 """Utility functions that encapsulate AlphaFold inference components."""
 
-import glob
+import concurrent.futures
+import contextlib
+import fnmatch
+import functools
+import io
+import json
 import logging
+import multiprocessing
 import os
 import pickle
+import queue
 import shutil
+import tempfile
+import threading
 import time
-from typing import Dict, List, Mapping, Sequence, Tuple
+import uuid
+from typing import (Any, Callable, Dict, IO, List, Mapping, Optional, Sequence,
+                    Tuple, Union)
 
 from alphafold.common import protein
 from alphafold.common import residue_constants
@@ -37,11 +48,21 @@ from alphafold.data.tools import jackhmmer
 from alphafold.model import config
 from alphafold.model import data
 from alphafold.model import model
+from alphafold.model import utils as model_utils
+from alphafold.model.tf import shape_placeholders
 from alphafold.relax import relax
+import jax
+from jax import monitoring
+from jax.experimental.compilation_cache import compilation_cache
 
 
 import numpy as np
 
+import params_cache
+import parsers as msa_parsers
+import prediction_format
+import search_cache
+
 
 JACKHMMER_BINARY_PATH = shutil.which('jackhmmer')
 HHBLITS_BINARY_PATH = shutil.which('hhblits')
@@ -52,6 +73,164 @@ HMMBUILD_BINARY_PATH = shutil.which('hmmbuild')
 
 MAX_TEMPLATE_HITS = 20
 
+# Residue axes of the multimer model features. The monomer features are
+# described by the model config.
+_MULTIMER_FEATURE_RESIDUE_AXES = {
+    'aatype': (0,),
+    'residue_index': (0,),
+    'asym_id': (0,),
+    'sym_id': (0,),
+    'entity_id': (0,),
+    'entity_mask': (0,),
+    'seq_mask': (0,),
+    'deletion_mean': (0,),
+    'all_atom_mask': (0,),
+    'all_atom_positions': (0,),
+    'msa': (1,),
+    'msa_mask': (1,),
+    'deletion_matrix': (1,),
+    'bert_mask': (1,),
+    'template_aatype': (1,),
+    'template_all_atom_mask': (1,),
+    'template_all_atom_positions': (1,),
+}
+
+# Residue axes of the model outputs, by fnmatch pattern of their path, when
+# they are not the first axis. The first matching pattern applies. The
+# structure module trajectory and side chains have a leading layer axis.
+_PREDICTION_RESIDUE_AXES = (
+    ('distogram/logits', (0, 1)),
+    ('distogram/bin_edges', ()),
+    ('masked_msa/logits', (1,)),
+    ('predicted_aligned_error/logits', (0, 1)),
+    ('predicted_aligned_error/breaks', ()),
+    ('representations/msa', (1,)),
+    ('representations/pair', (0, 1)),
+    ('structure_module/traj', (1,)),
+    ('structure_module/sidechains/*', (1,)),
+)
+
+# Threads of the background artifact writer, and number of outputs that can
+# wait to be written before the next write blocks.
+_ARTIFACT_WRITER_THREADS = 2
+_ARTIFACT_WRITER_MAX_PENDING = 2
+
+# JAX monitoring events of the compilations that look up the persistent
+# compilation cache, and of the lookups that find an executable.
+_COMPILATION_CACHE_REQUEST_EVENT = (
+    '/jax/compilation_cache/compile_requests_use_cache')
+_COMPILATION_CACHE_HIT_EVENT = '/jax/compilation_cache/cache_hits'
+
+# Vertex AI custom jobs mount Cloud Storage buckets under /gcs.
+_GCS_PREFIX = 'gs://'
+_GCS_MOUNT_POINT = '/gcs/'
+
+# Suffix of the binary MSA written next to each MSA file by the searches.
+ARRAY_MSA_SUFFIX = '.arraymsa'
+
+# Bytes read at a time when splitting or counting a sequence database.
+_DATABASE_READ_BYTES = 64 * 1024 * 1024
+# Suffix of the manifest of the shards of a database.
+_SHARDS_MANIFEST_SUFFIX = '.shards.json'
+
+# MSA files written for each chain by the multimer data pipeline, and the
+# databases searched for each file.
+_CHAIN_MSA_DATABASES = {
+    'uniref90_hits.sto': ('uniref90',),
+    'mgnify_hits.sto': ('mgnify',),
+    'bfd_uniref_hits.a3m': ('bfd', 'uniref30'),
+    'small_bfd_hits.sto': ('small_bfd',),
+    'uniprot_hits.sto': ('uniprot',),
+}
+# The BFD MSA file written for each value of use_small_bfd. The file of the
+# other mode is not written.
+_BFD_MSA_NAMES = {
+    False: 'bfd_uniref_hits.a3m',
+    True: 'small_bfd_hits.sto',
+}
+
+
+class _ArtifactWriter:
+    """Writes output files in background threads.
+
+    Serializing and writing the outputs of a prediction to the artifact paths,
+    which are often on the Cloud Storage mount, overlaps with the next
+    prediction. The queue of pending writes is bounded and `write` blocks
+    while it is full, so at most max_pending + num_threads outputs are held in
+    memory. The writes are flushed when the writer is closed, and the first
+    error of a write is raised then, or by the next `write`.
+    """
+
+    def __init__(
+        self,
+        num_threads: int = _ARTIFACT_WRITER_THREADS,
+        max_pending: int = _ARTIFACT_WRITER_MAX_PENDING
+    ):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._errors = []
+        self._threads = [threading.Thread(target=self._run, daemon=True)
+                         for _ in range(num_threads)]
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            path, write_fn, mode = task
+            try:
+                with open(path, mode) as f:
+                    write_fn(f)
+            except Exception as e:  # pylint: disable=broad-except
+                self._errors.append(e)
+            # Release the output before waiting for the next one.
+            del task, write_fn
+
+    def _raise_error(self):
+        if self._errors:
+            raise self._errors[0]
+
+    def write(
+        self,
+        path: str,
+        write_fn: Callable[[IO], None],
+        binary: bool = False
+    ):
+        """Queues write_fn to be called on the file at path."""
+        self._raise_error()
+        self._queue.put((path, write_fn, 'wb' if binary else 'w'))
+
+    def close(self):
+        """Waits for the queued writes and raises the first error."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return
+        # Do not hide the error that interrupted the writes.
+        try:
+            self.close()
+        except Exception:  # pylint: disable=broad-except
+            logging.exception('Failed to write an artifact')
+
+
+def _write_pdb(structure: protein.Protein, f: IO[str]):
+    f.write(protein.to_pdb(structure))
+
+
+def _write_text(text: str, f: IO[str]):
+    f.write(text)
+
 
 def _load_features(features_path: str) -> Dict[str, str]:
     """Loads pickeled features."""
@@ -60,29 +239,71 @@ def _load_features(features_path: str) -> Dict[str, str]:
     return features
 
 
-def _read_msa(msa_path: str, msa_format: str) -> str:
-    """Reads and parses an MSA file."""
-    if os.path.exists(msa_path):
-        with open(msa_path) as f:
-            msa = f.read()
-        if msa_format == 'sto':
-            msa = parsers.parse_stockholm(msa)
-        elif msa_format == 'a3m':
-            msa = parsers.parse_a3m(msa)
-        else:
-            raise RuntimeError(f'Unsupported MSA format: {msa_format}')
-    return msa
+def _write_array_msa(msa: msa_parsers.ArrayMsa, msa_path: str):
+    """Writes the binary MSA that is read instead of the MSA file."""
+    msa.save(msa_path + ARRAY_MSA_SUFFIX)
+
+
+def _read_msa(
+    msa_path: str,
+    msa_format: str,
+    compact: bool = False
+) -> Union[msa_parsers.ArrayMsa, msa_parsers.Msa]:
+    """Reads and parses an MSA file.
+
+    The binary MSA written next to the file by the search is memory-mapped if
+    it exists, otherwise the MSA file is parsed.
+
+    Returns:
+      An `ArrayMsa` if compact, otherwise an `Msa`.
+    """
+    array_msa_path = msa_path + ARRAY_MSA_SUFFIX
+    if os.path.exists(array_msa_path):
+        msa = msa_parsers.ArrayMsa.load(array_msa_path)
+        return msa if compact else msa.to_msa()
+    if not os.path.exists(msa_path):
+        raise FileNotFoundError(
+            f'Neither {msa_path} nor {array_msa_path} exists')
+    if msa_format == 'sto':
+        return msa_parsers.read_stockholm(msa_path, compact=compact)
+    if msa_format == 'a3m':
+        return msa_parsers.read_a3m(msa_path, compact=compact)
+    raise RuntimeError(f'Unsupported MSA format: {msa_format}')
+
+
+def _read_msa_for_templates(
+    msa_path: str,
+    msa_format: str,
+    max_sequences: int,
+    output_format: str
+) -> str:
+    """Reads at most `max_sequences` sequences of an MSA for template search.
+
+    Stockholm MSAs are deduplicated and stripped of empty columns in a
+    single pass before being converted to `output_format`.
+    """
+    if msa_format == 'sto':
+        return msa_parsers.preprocess_stockholm_msa(
+            msa_path,
+            output_format=output_format,
+            max_sequences=max_sequences)
+    if msa_format == 'a3m' and output_format == 'a3m':
+        return ''.join(
+            f'>{description}\n{sequence}\n'
+            for description, sequence in msa_parsers.iter_a3m(
+                msa_path, max_sequences=max_sequences))
+    raise ValueError(f'Unsupported MSA format: {msa_format}')
 
 
 def _read_sequence(sequence_path: str) -> Tuple[str, str, int]:
     """Reads and parses a FASTA sequence file."""
-    with open(sequence_path) as f:
-        sequence_str = f.read()
-    sequences, sequence_descs = parsers.parse_fasta(sequence_str)
-    if len(sequences) != 1:
+    # Reading a second record is enough to reject batch files.
+    records = list(msa_parsers.iter_fasta(sequence_path, max_sequences=2))
+    if len(records) != 1:
         raise ValueError(
             f'More than one input sequence found in {sequence_path}.')
-    return sequences[0], sequence_descs[0], len(sequences[0])
+    sequence_desc, sequence = records[0]
+    return sequence, sequence_desc, len(sequence)
 
 
 def _read_template_features(template_features_path) -> Dict[str, str]:
@@ -92,6 +313,96 @@ def _read_template_features(template_features_path) -> Dict[str, str]:
     return template_features
 
 
+def _count_msas(
+    msa_output_path: str,
+    run_multimer_system: bool
+) -> Dict[str, int]:
+    """Returns the number of sequences or hits of each data pipeline MSA."""
+    if run_multimer_system:
+        folders = [os.path.join(msa_output_path, folder)
+                   for folder in os.listdir(msa_output_path)
+                   if os.path.isdir(os.path.join(msa_output_path, folder))]
+        paths = []
+        for folder in folders:
+            paths += [os.path.join(folder, file)
+                      for file in os.listdir(folder)]
+    else:
+        paths = [os.path.join(msa_output_path, file)
+                 for file in os.listdir(msa_output_path)]
+
+    # Only the number of sequences or hits is recorded, so the files are
+    # scanned rather than parsed, and concurrently.
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        counts = executor.map(msa_parsers.count_msa_records, paths)
+        msas_metadata = {
+            os.path.join(file.split(os.sep)[-2], file.split(os.sep)[-1]): count
+            for file, count in zip(paths, counts)}
+    return msas_metadata
+
+
+def _chain_msa_keys(
+    fasta_path: str,
+    database_paths: Mapping[str, str],
+    use_small_bfd: bool
+) -> Dict[str, Dict[str, str]]:
+    """Returns the cache keys of the MSA files of each chain of a complex.
+
+    Only the first chain with a given sequence is searched by the multimer
+    data pipeline, so the keys are returned for these chains only, by chain
+    id and MSA file name. Homomers are not paired, so their uniprot MSA is
+    not searched. Only the BFD MSA of the use_small_bfd mode is keyed, so an
+    MSA cached by a run in the other mode is not restored.
+    """
+    msa_databases = {
+        msa_name: databases
+        for msa_name, databases in _CHAIN_MSA_DATABASES.items()
+        if msa_name != _BFD_MSA_NAMES[not use_small_bfd]}
+    keys = {}
+    searched_sequences = set()
+    for chain_id, (_, sequence) in zip(
+            protein.PDB_CHAIN_IDS, msa_parsers.iter_fasta(fasta_path)):
+        if sequence in searched_sequences:
+            continue
+        searched_sequences.add(sequence)
+        keys[chain_id] = {
+            msa_name: search_cache.cache_key(
+                tool='chain_msa',
+                sequences=[sequence],
+                database_paths=[database_paths[database]
+                                for database in databases],
+                parameters={'msa_name': msa_name})
+            for msa_name, databases in msa_databases.items()}
+    if len(keys) == 1:
+        del next(iter(keys.values()))['uniprot_hits.sto']
+    return keys
+
+
+def _restore_chain_msas(
+    cache: search_cache.SearchCache,
+    chain_msa_keys: Mapping[str, Mapping[str, str]],
+    msa_output_path: str
+):
+    """Copies the cached MSAs of each chain to its MSA directory."""
+    for chain_id, keys in chain_msa_keys.items():
+        chain_msa_path = os.path.join(msa_output_path, chain_id)
+        os.makedirs(chain_msa_path, exist_ok=True)
+        for msa_name, key in keys.items():
+            cache.get(key, {'msa': os.path.join(chain_msa_path, msa_name)})
+
+
+def _store_chain_msas(
+    cache: search_cache.SearchCache,
+    chain_msa_keys: Mapping[str, Mapping[str, str]],
+    msa_output_path: str
+):
+    """Stores the MSAs of each chain that were written by the pipeline."""
+    for chain_id, keys in chain_msa_keys.items():
+        for msa_name, key in keys.items():
+            msa_path = os.path.join(msa_output_path, chain_id, msa_name)
+            if os.path.exists(msa_path):
+                cache.put(key, {'msa': msa_path})
+
+
 def run_data_pipeline(
     fasta_path: str,
     run_multimer_system: bool,
@@ -109,8 +420,51 @@ def run_data_pipeline(
     msa_output_path: str,
     features_output_path: str,
     use_small_bfd: bool,
+    cache: Optional[search_cache.SearchCache] = None
 ) -> Dict[str, str]:
-    """Runs AlphaFold data pipeline."""
+    """Runs AlphaFold data pipeline.
+
+    If a cache is given, the features and MSAs of a previous run with the same
+    sequences, databases and parameters are copied instead. Otherwise, in
+    multimer mode, the MSAs of each chain (including the uniprot MSA used for
+    pairing) are also cached by chain sequence and database versions, so that
+    complexes sharing chains with previous runs only search the new chains.
+    """
+    outputs = {'msas': msa_output_path, 'features': features_output_path}
+    if cache is not None:
+        descriptions, sequences = zip(*msa_parsers.iter_fasta(fasta_path))
+        key = search_cache.cache_key(
+            tool='data_pipeline',
+            sequences=sequences,
+            database_paths=[
+                uniref90_database_path, mgnify_database_path,
+                bfd_database_path, small_bfd_database_path,
+                uniref30_database_path, uniprot_database_path,
+                pdb70_database_path, obsolete_pdbs_path,
+                seqres_database_path, mmcif_path],
+            # The descriptions are part of the features.
+            parameters={'descriptions': descriptions,
+                        'run_multimer_system': run_multimer_system,
+                        'use_small_bfd': use_small_bfd,
+                        'max_template_date': max_template_date})
+        if cache.get(key, outputs):
+            return (_load_features(features_output_path),
+                    _count_msas(msa_output_path, run_multimer_system))
+
+    chain_msa_keys = {}
+    if cache is not None and run_multimer_system:
+        chain_msa_keys = _chain_msa_keys(fasta_path, {
+            'uniref90': uniref90_database_path,
+            'mgnify': mgnify_database_path,
+            'bfd': bfd_database_path,
+            'small_bfd': small_bfd_database_path,
+            'uniref30': uniref30_database_path,
+            'uniprot': uniprot_database_path,
+        }, use_small_bfd)
+        _restore_chain_msas(cache, chain_msa_keys, msa_output_path)
+    # The MSA searches are skipped for the MSA files that were restored.
+    use_precomputed_msas = bool(chain_msa_keys)
+
     if run_multimer_system:
         template_searcher = hmmsearch.Hmmsearch(
             binary_path=HMMSEARCH_BINARY_PATH,
@@ -145,13 +499,15 @@ def run_data_pipeline(
         small_bfd_database_path=small_bfd_database_path,
         template_searcher=template_searcher,
         template_featurizer=template_featurizer,
-        use_small_bfd=use_small_bfd)
+        use_small_bfd=use_small_bfd,
+        use_precomputed_msas=use_precomputed_msas)
 
     if run_multimer_system:
         data_pipeline = pipeline_multimer.DataPipeline(
             monomer_data_pipeline=monomer_data_pipeline,
             jackhmmer_binary_path=JACKHMMER_BINARY_PATH,
-            uniprot_database_path=uniprot_database_path)
+            uniprot_database_path=uniprot_database_path,
+            use_precomputed_msas=use_precomputed_msas)
     else:
         data_pipeline = monomer_data_pipeline
 
@@ -163,37 +519,206 @@ def run_data_pipeline(
     with open(features_output_path, 'wb') as f:
         pickle.dump(feature_dict, f, protocol=4)
 
-    msas_metadata = {}
-    paths = glob.glob(os.path.join(msa_output_path, '**'), recursive=True)
-    paths = [path for path in paths if os.path.isfile(path)]
+    if cache is not None:
+        _store_chain_msas(cache, chain_msa_keys, msa_output_path)
+        cache.put(key, outputs)
+
+    return feature_dict, _count_msas(msa_output_path, run_multimer_system)
+
+
+class _CompilationCacheCounter:
+    """Counts the lookups and hits of the persistent compilation cache.
+
+    JAX records a monitoring event for each compilation that looks up the
+    cache, and another for each lookup that finds an executable. The events
+    are recorded by the process that compiles, so the counts are exact even
+    if the cache directory is shared by several jobs.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.hits = 0
+
+    def __call__(self, event: str, **kwargs):
+        if event == _COMPILATION_CACHE_REQUEST_EVENT:
+            self.requests += 1
+        elif event == _COMPILATION_CACHE_HIT_EVENT:
+            self.hits += 1
+
+    def snapshot(self) -> Tuple[int, int]:
+        return self.requests, self.hits
+
+    def timings(self, name: str, since: Tuple[int, int]) -> Dict[str, int]:
+        """Returns the hits and misses since a snapshot, as timings entries."""
+        requests = self.requests - since[0]
+        hits = self.hits - since[1]
+        return {
+            f'compilation_cache_hits_{name}': hits,
+            f'compilation_cache_misses_{name}': requests - hits,
+        }
+
+
+_COMPILATION_CACHE_COUNTER = _CompilationCacheCounter()
+monitoring.register_event_listener(_COMPILATION_CACHE_COUNTER)
+
+
+def _initialize_compilation_cache(compilation_cache_path: str):
+    """Enables the persistent XLA compilation cache of JAX.
+
+    JAX keys the compiled executables by a hash of the computation, which
+    covers the model config and the padded shapes of the features, and by the
+    backend, its compile options and the JAX version. Models that only differ
+    in their parameters share executables. The hits and misses of each
+    prediction are counted by `_COMPILATION_CACHE_COUNTER`.
+
+    Args:
+      compilation_cache_path: A local directory, a mounted directory or a
+        gs://bucket/prefix, which is read through the Cloud Storage mount.
+    """
+    if compilation_cache_path.startswith(_GCS_PREFIX):
+        compilation_cache_path = (
+            _GCS_MOUNT_POINT + compilation_cache_path[len(_GCS_PREFIX):])
+    os.makedirs(compilation_cache_path, exist_ok=True)
+    # The cache can only be initialized once per process.
+    if not compilation_cache.is_initialized():
+        compilation_cache.initialize_cache(compilation_cache_path)
+
+
+def _bucket_length(num_res: int, length_buckets: Sequence[int]) -> int:
+    """Returns the smallest bucket that fits num_res, or num_res if none."""
+    return min((bucket for bucket in length_buckets if bucket >= num_res),
+               default=num_res)
+
+
+def _feature_residue_axes(
+    model_runner: model.RunModel
+) -> Mapping[str, Tuple[int, ...]]:
+    """Returns the residue axes of the processed features of a model."""
+    if model_runner.multimer_mode:
+        return _MULTIMER_FEATURE_RESIDUE_AXES
+    # The processed monomer features have a leading ensemble axis.
+    return {
+        name: tuple(axis + 1 for axis, size in enumerate(shape)
+                    if size == shape_placeholders.NUM_RES)
+        for name, shape in model_runner.config.data.eval.feat.items()}
+
+
+def _pad_residues(
+    processed_feature_dict: Mapping[str, np.ndarray],
+    residue_axes: Mapping[str, Tuple[int, ...]],
+    padded_length: int
+) -> Dict[str, np.ndarray]:
+    """Pads the residue axes of features with zeros, which are masked."""
+    padded_features = {}
+    for name, value in processed_feature_dict.items():
+        axes = residue_axes.get(name, ())
+        if axes:
+            pad_width = [(0, 0)] * np.ndim(value)
+            for axis in axes:
+                pad_width[axis] = (0, padded_length - value.shape[axis])
+            value = np.pad(value, pad_width)
+        padded_features[name] = value
+    return padded_features
+
+
+def _strip_padding(
+    prediction_result: Mapping[str, np.ndarray],
+    num_res: int,
+    padded_length: int,
+    path: str = ''
+) -> Dict[str, np.ndarray]:
+    """Removes the padded residues from the outputs of a model."""
+    if isinstance(prediction_result, Mapping):
+        return {
+            name: _strip_padding(
+                value, num_res, padded_length,
+                f'{path}/{name}' if path else name)
+            for name, value in prediction_result.items()}
+    if hasattr(prediction_result, '_fields'):
+        # The side chain positions and frames are named tuples of arrays
+        # with the layout of the whole output.
+        return type(prediction_result)(*(
+            _strip_padding(value, num_res, padded_length, path)
+            for value in prediction_result))
+    value = np.asarray(prediction_result)
+    index = [slice(None)] * value.ndim
+    residue_axes = next(
+        (axes for pattern, axes in _PREDICTION_RESIDUE_AXES
+         if fnmatch.fnmatchcase(path, pattern)), (0,))
+    for axis in residue_axes:
+        if axis < value.ndim and value.shape[axis] == padded_length:
+            index[axis] = slice(num_res)
+    return value[tuple(index)]
+
+
+def _predict(
+    model_runner: model.RunModel,
+    processed_feature_dict: Mapping[str, np.ndarray],
+    random_seed: int,
+    length_buckets: Optional[Sequence[int]] = None
+) -> Mapping[str, np.ndarray]:
+    """Runs a model, padding the residues to a length bucket if given.
+
+    The padded model is compiled once per bucket rather than once per
+    sequence length. The padded residues are masked, and are removed from the
+    outputs before the confidence metrics are computed, so the result has the
+    same shapes as an unpadded prediction.
+    """
+    num_res = processed_feature_dict['aatype'].shape[-1]
+    padded_length = _bucket_length(num_res, length_buckets or [])
+    if padded_length == num_res:
+        return model_runner.predict(
+            processed_feature_dict, random_seed=random_seed)
+
+    logging.info(f'Padding {num_res} residues to {padded_length}')
+    padded_features = _pad_residues(
+        processed_feature_dict, _feature_residue_axes(model_runner),
+        padded_length)
+    prediction_result = model_runner.apply(
+        model_runner.params, jax.random.PRNGKey(random_seed), padded_features)
+    prediction_result = _strip_padding(
+        jax.device_get(prediction_result), num_res, padded_length)
+    prediction_result.update(model.get_confidence_metrics(
+        prediction_result, multimer_mode=model_runner.multimer_mode))
+    return prediction_result
+
+
+def _get_model_params(
+    model_name: str,
+    model_params_path: str,
+    params_cache_path: Optional[str] = None
+) -> Mapping[str, Any]:
+    """Loads the Haiku parameters of a model.
+
+    If a parameters cache path is given, the parameters are loaded from
+    memory-mapped arrays on the local disk, which are copied from
+    model_params_path by the first job on the node.
+    """
+    if not params_cache_path:
+        return data.get_model_haiku_params(
+            model_name=model_name, data_dir=model_params_path)
+    cache = params_cache.ParamsCache(params_cache_path)
+    return model_utils.flat_params_to_haiku(
+        cache.load(model_name, model_params_path))
+
 
+def _create_model_runner(
+    model_name: str,
+    model_params_path: str,
+    num_ensemble: int,
+    run_multimer_system: bool,
+    params_cache_path: Optional[str] = None
+) -> model.RunModel:
+    """Loads the parameters of a model and creates its runner."""
+    model_config = config.model_config(model_name)
     if run_multimer_system:
-        folders = [os.path.join(msa_output_path, folder)
-                   for folder in os.listdir(msa_output_path)
-                   if os.path.isdir(os.path.join(msa_output_path, folder))]
-        paths = []
-        for folder in folders:
-            paths += [os.path.join(folder, file)
-                      for file in os.listdir(folder)]
+        model_config.model.num_ensemble_eval = num_ensemble
     else:
-        paths = [os.path.join(msa_output_path, file)
-                 for file in os.listdir(msa_output_path)]
-    for file in paths:
-        with open(file, 'r') as f:
-            artifact = f.read()
-        file_format = file.split('.')[-1]
-        if file_format == 'sto':
-            artifact = parsers.parse_stockholm(artifact)
-        elif file_format == 'a3m':
-            artifact = parsers.parse_a3m(artifact)
-        elif file_format == 'hhr':
-            artifact = parsers.parse_hhr(artifact)
-        else:
-            raise ValueError('Unknown artifact type')
-        msas_metadata[os.path.join(
-            file.split(os.sep)[-2], file.split(os.sep)[-1])] = len(artifact)
+        model_config.data.eval.num_ensemble_eval = num_ensemble
 
-    return feature_dict, msas_metadata
+    model_params = _get_model_params(
+        model_name, model_params_path, params_cache_path)
+    return model.RunModel(model_config, model_params)
 
 
 def predict(
@@ -205,30 +730,55 @@ def predict(
     random_seed: int,
     raw_prediction_path: str,
     unrelaxed_protein_path: str,
+    compilation_cache_path: Optional[str] = None,
+    length_buckets: Optional[Sequence[int]] = None,
+    raw_prediction_format: str = prediction_format.PICKLE_FORMAT,
+    raw_prediction_keys: Optional[Sequence[str]] = None,
+    params_cache_path: Optional[str] = None,
 ) -> Mapping[str, str]:
-    """Runs inference on an AlphaFold model."""
-
-    model_config = config.model_config(model_name)
-    if run_multimer_system:
-        model_config.model.num_ensemble_eval = num_ensemble
-    else:
-        model_config.data.eval.num_ensemble_eval = num_ensemble
-
-    model_params = data.get_model_haiku_params(
-        model_name=model_name, data_dir=model_params_path)
-    model_runner = model.RunModel(model_config, model_params)
+    """Runs inference on an AlphaFold model.
+
+    If a compilation cache path is given, the XLA executables of the model are
+    read from and written to a persistent cache, so that warm jobs skip the
+    compilation. If length buckets are given, the residues are padded to the
+    smallest bucket that fits them, so that sequences of similar lengths share
+    executables. The padding is removed from the prediction result.
+
+    The prediction result is written in raw_prediction_format, with only the
+    arrays selected by raw_prediction_keys in the npz format (see
+    `prediction_format.write_prediction_result`). If a parameters cache path
+    is given, the model parameters are loaded through a node-local cache (see
+    `params_cache.ParamsCache`).
+    """
+
+    if compilation_cache_path:
+        _initialize_compilation_cache(compilation_cache_path)
+
+    model_runner = _create_model_runner(
+        model_name=model_name,
+        model_params_path=model_params_path,
+        num_ensemble=num_ensemble,
+        run_multimer_system=run_multimer_system,
+        params_cache_path=params_cache_path)
 
     features = _load_features(model_features_path)
     processed_feature_dict = model_runner.process_features(
         raw_features=features,
         random_seed=random_seed)
 
-    prediction_result = model_runner.predict(
-        feat=processed_feature_dict,
-        random_seed=random_seed)
-
-    with open(raw_prediction_path, 'wb') as f:
-        pickle.dump(prediction_result, f, protocol=4)
+    timings = {}
+    t_0 = time.time()
+    cache_snapshot = _COMPILATION_CACHE_COUNTER.snapshot()
+    prediction_result = _predict(
+        model_runner=model_runner,
+        processed_feature_dict=processed_feature_dict,
+        random_seed=random_seed,
+        length_buckets=length_buckets)
+    timings[f'predict_and_compile_{model_name}'] = time.time() - t_0
+    if compilation_cache_path:
+        timings.update(_COMPILATION_CACHE_COUNTER.timings(
+            model_name, cache_snapshot))
+    logging.info('Final timings  %s ',  timings)
 
     plddt = prediction_result['plddt']
     plddt_b_factors = np.repeat(
@@ -238,9 +788,18 @@ def predict(
         result=prediction_result,
         b_factors=plddt_b_factors,
         remove_leading_feature_dimension=not model_runner.multimer_mode)
-    unrelaxed_pdbs = protein.to_pdb(unrelaxed_structure)
-    with open(unrelaxed_protein_path, 'w') as f:
-        f.write(unrelaxed_pdbs)
+
+    # The result is serialized while the PDB is written.
+    with _ArtifactWriter() as writer:
+        writer.write(raw_prediction_path,
+                     functools.partial(
+                         prediction_format.write_prediction_result,
+                         prediction_result,
+                         output_format=raw_prediction_format,
+                         keys=raw_prediction_keys),
+                     binary=True)
+        writer.write(unrelaxed_protein_path,
+                     functools.partial(_write_pdb, unrelaxed_structure))
 
     return prediction_result
 
@@ -277,6 +836,21 @@ def relax_protein(
     return relaxed_protein_pdb
 
 
+def _relax_protein(
+    unrelaxed_protein: protein.Protein,
+    relax_options: Mapping[str, Any]
+) -> Tuple[str, float]:
+    """Relaxes a protein on the CPU in a relaxation worker process.
+
+    Returns:
+      The relaxed protein PDB and the relaxation time.
+    """
+    t_0 = time.time()
+    amber_relaxer = relax.AmberRelaxation(**relax_options, use_gpu=False)
+    relaxed_protein_pdb, _, _ = amber_relaxer.process(prot=unrelaxed_protein)
+    return relaxed_protein_pdb, time.time() - t_0
+
+
 def predict_relax(
     model_features_path: str,
     model_params_path: str,
@@ -292,9 +866,32 @@ def predict_relax(
     stiffness: float = 10.0,
     exclude_residues: List[str] = [],
     max_outer_iterations: int = 3,
-    use_gpu=True
+    use_gpu=True,
+    compilation_cache_path: Optional[str] = None,
+    length_buckets: Optional[Sequence[int]] = None,
+    relax_workers: int = 0,
+    raw_prediction_format: str = prediction_format.PICKLE_FORMAT,
+    raw_prediction_keys: Optional[Sequence[str]] = None,
+    params_cache_path: Optional[str] = None,
 ) -> Mapping[str, str]:
-    """Runs predictions and relaxations sequentially on all specified models."""
+    """Runs predictions and relaxations on all specified models.
+
+    If relax_workers is 0, each prediction is relaxed before the next one
+    starts. Otherwise the relaxations run on the CPU in relax_workers worker
+    processes while the next predictions run, and the relaxations that have
+    not started when the last prediction is done run on the idle GPU (if
+    use_gpu) in this process. All the relaxations are done when this returns.
+
+    If a compilation cache path is given, the XLA executables of the models are
+    read from and written to a persistent cache, so that warm jobs skip the
+    compilation. If length buckets are given, the residues are padded as in
+    `predict`. The prediction results are written and the model parameters
+    are loaded as in `predict`.
+    """
+
+    result_extension = prediction_format.file_extension(raw_prediction_format)
+    if compilation_cache_path:
+        _initialize_compilation_cache(compilation_cache_path)
 
     model_names = set([runner['model_name'] for runner in prediction_runners])
     runners = {}
@@ -304,8 +901,8 @@ def predict_relax(
             model_config.model.num_ensemble_eval = num_ensemble
         else:
             model_config.data.eval.num_ensemble = num_ensemble
-        model_params = data.get_model_haiku_params(
-            model_name=model_name, data_dir=model_params_path)
+        model_params = _get_model_params(
+            model_name, model_params_path, params_cache_path)
         model_runner = model.RunModel(model_config, model_params)
         runners[model_name] = model_runner
 
@@ -318,86 +915,264 @@ def predict_relax(
     logging.info('Have %d models: %s', len(model_runners),
                  list(model_runners.keys()))
 
-    if run_relax:
-        amber_relaxer = relax.AmberRelaxation(
-            max_iterations=max_iterations,
-            tolerance=tolerance,
-            stiffness=stiffness,
-            exclude_residues=exclude_residues,
-            max_outer_iterations=max_outer_iterations,
-            use_gpu=use_gpu)
-    else:
-        amber_relaxer = None
-
-    # Run the predictions
-    feature_dict = _load_features(model_features_path)
-    timings = {}
-    unrelaxed_pdbs = {}
-    relaxed_pdbs = {}
-    ranking_confidences = {}
-    for model_name, prediction_runner in model_runners.items():
-        logging.info('Running prediction %s', model_name)
-        t_0 = time.time()
-        model_random_seed = prediction_runner[1]
-        model_runner = prediction_runner[0]
-        processed_feature_dict = model_runner.process_features(
-            feature_dict, random_seed=model_random_seed)
-        timings[f'process_features_{model_name}'] = time.time() - t_0
-
-        t_0 = time.time()
-        prediction_result = model_runner.predict(processed_feature_dict,
-                                                 random_seed=model_random_seed)
-        t_diff = time.time() - t_0
-        timings[f'predict_and_compile_{model_name}'] = t_diff
-        logging.info(
-            'Total JAX model %s predict time (includes compilation time, see --benchmark): %.1fs',
-            model_name, t_diff)
-
-        plddt = prediction_result['plddt']
-        ranking_confidences[model_name] = prediction_result['ranking_confidence']
-
-        # Save the model outputs.
-        result_output_path = os.path.join(
-            raw_prediction_path, f'result_{model_name}.pkl')
-        with open(result_output_path, 'wb') as f:
-            pickle.dump(prediction_result, f, protocol=4)
-
-        # Add the predicted LDDT in the b-factor column.
-        # Note that higher predicted LDDT value means higher model confidence.
-        plddt_b_factors = np.repeat(
-            plddt[:, None], residue_constants.atom_type_num, axis=-1)
-        unrelaxed_protein = protein.from_prediction(
-            features=processed_feature_dict,
-            result=prediction_result,
-            b_factors=plddt_b_factors,
-            remove_leading_feature_dimension=not model_runner.multimer_mode)
-
-        unrelaxed_pdbs[model_name] = protein.to_pdb(unrelaxed_protein)
-        unrelaxed_pdb_path = os.path.join(
-            unrelaxed_protein_path, f'unrelaxed_{model_name}.pdb')
-        with open(unrelaxed_pdb_path, 'w') as f:
-            f.write(unrelaxed_pdbs[model_name])
-
-        if amber_relaxer:
-            # Relax the prediction.
-            t_0 = time.time()
-            relaxed_pdb_str, _, _ = amber_relaxer.process(
-                prot=unrelaxed_protein)
-            timings[f'relax_{model_name}'] = time.time() - t_0
+    relax_options = dict(
+        max_iterations=max_iterations,
+        tolerance=tolerance,
+        stiffness=stiffness,
+        exclude_residues=exclude_residues,
+        max_outer_iterations=max_outer_iterations)
+    # The relaxation workers and the artifact writer are shut down even if a
+    # prediction or relaxation fails. The writer flushes the queued outputs,
+    # and the relaxations that have not started are cancelled.
+    with contextlib.ExitStack() as stack:
+        relax_executor = None
+        if run_relax:
+            amber_relaxer = relax.AmberRelaxation(
+                **relax_options, use_gpu=use_gpu)
+            if relax_workers > 0:
+                # The workers are spawned rather than forked from a process
+                # that has initialized JAX.
+                relax_executor = concurrent.futures.ProcessPoolExecutor(
+                    relax_workers,
+                    mp_context=multiprocessing.get_context('spawn'))
+                stack.callback(relax_executor.shutdown, cancel_futures=True)
+        else:
+            amber_relaxer = None
 
+        def save_relaxed_protein(model_name, relaxed_pdb_str):
             relaxed_pdbs[model_name] = relaxed_pdb_str
 
             # Save the relaxed PDB.
             relaxed_output_path = os.path.join(
                 relaxed_protein_path, f'relaxed_{model_name}.pdb')
-            with open(relaxed_output_path, 'w') as f:
-                f.write(relaxed_pdb_str)
+            writer.write(relaxed_output_path,
+                         functools.partial(_write_text, relaxed_pdb_str))
+
+        # Run the predictions. The outputs are written in the background while
+        # the next prediction runs.
+        feature_dict = _load_features(model_features_path)
+        writer = stack.enter_context(_ArtifactWriter())
+        timings = {}
+        relaxed_pdbs = {}
+        ranking_confidences = {}
+        unrelaxed_structures = {}
+        relax_futures = {}
+        for model_name, prediction_runner in model_runners.items():
+            logging.info('Running prediction %s', model_name)
+            t_0 = time.time()
+            model_random_seed = prediction_runner[1]
+            model_runner = prediction_runner[0]
+            processed_feature_dict = model_runner.process_features(
+                feature_dict, random_seed=model_random_seed)
+            timings[f'process_features_{model_name}'] = time.time() - t_0
+
+            t_0 = time.time()
+            cache_snapshot = _COMPILATION_CACHE_COUNTER.snapshot()
+            prediction_result = _predict(
+                model_runner=model_runner,
+                processed_feature_dict=processed_feature_dict,
+                random_seed=model_random_seed,
+                length_buckets=length_buckets)
+            t_diff = time.time() - t_0
+            timings[f'predict_and_compile_{model_name}'] = t_diff
+            if compilation_cache_path:
+                timings.update(_COMPILATION_CACHE_COUNTER.timings(
+                    model_name, cache_snapshot))
+            logging.info(
+                'Total JAX model %s predict time (includes compilation time, see --benchmark): %.1fs',
+                model_name, t_diff)
+
+            plddt = prediction_result['plddt']
+            ranking_confidences[model_name] = (
+                prediction_result['ranking_confidence'])
+
+            # Save the model outputs.
+            result_output_path = os.path.join(
+                raw_prediction_path, f'result_{model_name}{result_extension}')
+            writer.write(result_output_path,
+                         functools.partial(
+                             prediction_format.write_prediction_result,
+                             prediction_result,
+                             output_format=raw_prediction_format,
+                             keys=raw_prediction_keys),
+                         binary=True)
+
+            # Add the predicted LDDT in the b-factor column.
+            # Note that higher predicted LDDT value means higher model
+            # confidence.
+            plddt_b_factors = np.repeat(
+                plddt[:, None], residue_constants.atom_type_num, axis=-1)
+            unrelaxed_protein = protein.from_prediction(
+                features=processed_feature_dict,
+                result=prediction_result,
+                b_factors=plddt_b_factors,
+                remove_leading_feature_dimension=not model_runner.multimer_mode)
+
+            unrelaxed_pdb_path = os.path.join(
+                unrelaxed_protein_path, f'unrelaxed_{model_name}.pdb')
+            writer.write(unrelaxed_pdb_path,
+                         functools.partial(_write_pdb, unrelaxed_protein))
+
+            if relax_executor:
+                # Relax the prediction while the next one runs.
+                unrelaxed_structures[model_name] = unrelaxed_protein
+                relax_futures[model_name] = relax_executor.submit(
+                    _relax_protein, unrelaxed_protein, relax_options)
+            elif amber_relaxer:
+                # Relax the prediction.
+                t_0 = time.time()
+                relaxed_pdb_str, _, _ = amber_relaxer.process(
+                    prot=unrelaxed_protein)
+                timings[f'relax_{model_name}'] = time.time() - t_0
+                save_relaxed_protein(model_name, relaxed_pdb_str)
+
+        for model_name, future in relax_futures.items():
+            if future.cancel():
+                # The relaxation has not started, and the GPU is idle.
+                t_0 = time.time()
+                relaxed_pdb_str, _, _ = amber_relaxer.process(
+                    prot=unrelaxed_structures[model_name])
+                relax_time = time.time() - t_0
+            else:
+                relaxed_pdb_str, relax_time = future.result()
+            timings[f'relax_{model_name}'] = relax_time
+            save_relaxed_protein(model_name, relaxed_pdb_str)
 
     logging.info('Final timings  %s ',  timings)
 
     return ranking_confidences
 
 
+def predict_batch(
+    model_features_paths: List[str],
+    num_residues: Sequence[int],
+    model_params_path: str,
+    prediction_runners: List[Dict],
+    num_ensemble: int,
+    run_multimer_system: bool,
+    raw_prediction_path: str,
+    unrelaxed_protein_path: str,
+    compilation_cache_path: Optional[str] = None,
+    length_buckets: Optional[Sequence[int]] = None,
+    raw_prediction_format: str = prediction_format.PICKLE_FORMAT,
+    raw_prediction_keys: Optional[Sequence[str]] = None,
+    params_cache_path: Optional[str] = None,
+) -> Dict[str, Dict]:
+    """Runs predictions on all specified models for a batch of sequences.
+
+    The parameters of each model are loaded once, as in `predict`, and its
+    runner is kept for the whole batch. The sequences are predicted from the
+    shortest to the longest, so that with length buckets each compiled model
+    is reused for consecutive sequences before moving to the next bucket. The
+    lengths are given by num_residues, in the order of the features files, so
+    that each features file is only loaded when its sequence is predicted.
+
+    The outputs of the i-th features file are written to <i>/result_<name>.pkl
+    (or .npz, as in `predict`) and <i>/unrelaxed_<name>.pdb under
+    raw_prediction_path and unrelaxed_protein_path, where <name> is
+    <model name>_pred_<index>.
+
+    Returns:
+      The features path and the ranking confidence of each prediction of each
+      sequence, by sequence index.
+    """
+
+    result_extension = prediction_format.file_extension(raw_prediction_format)
+    if compilation_cache_path:
+        _initialize_compilation_cache(compilation_cache_path)
+
+    model_names = sorted(set(
+        runner['model_name'] for runner in prediction_runners))
+    runners = {
+        model_name: _create_model_runner(
+            model_name=model_name,
+            model_params_path=model_params_path,
+            num_ensemble=num_ensemble,
+            run_multimer_system=run_multimer_system,
+            params_cache_path=params_cache_path)
+        for model_name in model_names}
+
+    if len(num_residues) != len(model_features_paths):
+        raise ValueError(
+            f'Got {len(num_residues)} sequence lengths for '
+            f'{len(model_features_paths)} features files')
+    order = sorted(range(len(model_features_paths)),
+                   key=lambda i: num_residues[i])
+
+    # The outputs are written in the background while the next prediction runs.
+    with _ArtifactWriter() as writer:
+        timings = {}
+        sequences_metadata = {}
+        for index in order:
+            sequence_name = str(index)
+            logging.info(f'Running predictions on sequence {sequence_name} '
+                         f'with {num_residues[index]} residues')
+            features = _load_features(model_features_paths[index])
+            os.makedirs(os.path.join(raw_prediction_path, sequence_name),
+                        exist_ok=True)
+            os.makedirs(os.path.join(unrelaxed_protein_path, sequence_name),
+                        exist_ok=True)
+
+            ranking_confidences = {}
+            for runner in prediction_runners:
+                prediction_name = (
+                    f'{runner["model_name"]}_pred_{runner["prediction_index"]}')
+                model_runner = runners[runner['model_name']]
+                processed_feature_dict = model_runner.process_features(
+                    features, random_seed=runner['random_seed'])
+
+                t_0 = time.time()
+                cache_snapshot = _COMPILATION_CACHE_COUNTER.snapshot()
+                prediction_result = _predict(
+                    model_runner=model_runner,
+                    processed_feature_dict=processed_feature_dict,
+                    random_seed=runner['random_seed'],
+                    length_buckets=length_buckets)
+                timing_name = f'{sequence_name}_{prediction_name}'
+                timings[f'predict_and_compile_{timing_name}'] = (
+                    time.time() - t_0)
+                if compilation_cache_path:
+                    timings.update(_COMPILATION_CACHE_COUNTER.timings(
+                        timing_name, cache_snapshot))
+                ranking_confidences[prediction_name] = float(
+                    prediction_result['ranking_confidence'])
+
+                result_path = os.path.join(
+                    raw_prediction_path, sequence_name,
+                    f'result_{prediction_name}{result_extension}')
+                writer.write(result_path,
+                             functools.partial(
+                                 prediction_format.write_prediction_result,
+                                 prediction_result,
+                                 output_format=raw_prediction_format,
+                                 keys=raw_prediction_keys),
+                             binary=True)
+
+                plddt_b_factors = np.repeat(
+                    prediction_result['plddt'][:, None],
+                    residue_constants.atom_type_num, axis=-1)
+                unrelaxed_structure = protein.from_prediction(
+                    features=processed_feature_dict,
+                    result=prediction_result,
+                    b_factors=plddt_b_factors,
+                    remove_leading_feature_dimension=(
+                        not model_runner.multimer_mode))
+                unrelaxed_pdb_path = os.path.join(
+                    unrelaxed_protein_path, sequence_name,
+                    f'unrelaxed_{prediction_name}.pdb')
+                writer.write(unrelaxed_pdb_path,
+                             functools.partial(_write_pdb, unrelaxed_structure))
+
+            sequences_metadata[sequence_name] = {
+                'features_path': model_features_paths[index],
+                'ranking_confidences': ranking_confidences,
+            }
+
+    logging.info('Final timings  %s ',  timings)
+
+    return sequences_metadata
+
+
 def aggregate(
     sequence_path: str,
     msa_paths: List[Tuple[str, str]],
@@ -413,13 +1188,27 @@ def aggregate(
         description=seq_desc,
         num_res=num_res
     )
-    # Create MSA features
+    # Create MSA features. The MSAs are kept as compact arrays that are
+    # decoded row by row while the features are built.
     msas = []
     for msa_path, msa_format in msa_paths:
-        msas.append(_read_msa(msa_path, msa_format))
+        msas.append(_read_msa(msa_path, msa_format, compact=True))
     if not msas:
         raise RuntimeError('No MSAs passed to the component')
-    msa_features = make_msa_features(msas=msas)
+    # Drop sequences already present in a prior MSA before the features
+    # are built, so that duplicated rows are never decoded. MSAs that only
+    # held duplicates, such as a search without hits that only returned the
+    # query, add no rows and are left out. Empty MSAs are passed through, and
+    # rejected by make_msa_features.
+    deduplicated_msas = []
+    for (msa_path, _), msa, deduplicated_msa in zip(
+            msa_paths, msas, msa_parsers.deduplicate_msas(msas)):
+        if len(deduplicated_msa) or not len(msa):
+            deduplicated_msas.append(deduplicated_msa)
+        else:
+            logging.warning(f'Dropping MSA {msa_path}: all of its {len(msa)} '
+                            'sequences occur in a prior MSA')
+    msa_features = make_msa_features(msas=deduplicated_msas)
     # Create template features
     template_features = _read_template_features(template_features_path)
 
@@ -434,26 +1223,243 @@ def aggregate(
     return model_features
 
 
+def _shard_path(database_path: str, index: int) -> str:
+    return f'{database_path}.{index}'
+
+
+def _read_shard_layout(
+    database_path: str
+) -> Optional[Tuple[List[str], int]]:
+    """Returns the shards and number of sequences of a pre-sharded database.
+
+    The layout is <database_path>.1 ... <database_path>.N and a manifest
+    <database_path>.shards.json holding {"num_shards": N, "num_records": M},
+    where M is the number of sequences of the whole database.
+
+    Returns:
+      The paths of the shards and the number of sequences, or None if the
+      database has no complete layout.
+    """
+    try:
+        with open(f'{database_path}{_SHARDS_MANIFEST_SUFFIX}') as f:
+            manifest = json.load(f)
+        shard_paths = [_shard_path(database_path, i)
+                       for i in range(1, manifest['num_shards'] + 1)]
+        num_records = int(manifest['num_records'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    if not all(os.path.exists(path) for path in shard_paths):
+        return None
+    return shard_paths, num_records
+
+
+def _write_shard_layout(
+    database_path: str,
+    num_shards: int,
+    num_records: int
+):
+    """Writes the manifest of the shards of a database, once they exist."""
+    manifest_path = f'{database_path}{_SHARDS_MANIFEST_SUFFIX}'
+    incomplete_path = f'{manifest_path}.{uuid.uuid4().hex}'
+    with open(incomplete_path, 'w') as f:
+        json.dump({'num_shards': num_shards, 'num_records': num_records}, f)
+    os.replace(incomplete_path, manifest_path)
+
+
+def _split_fasta_database(
+    database_path: str,
+    num_shards: int,
+    shard_prefix: str
+) -> Tuple[List[str], int]:
+    """Splits a FASTA database into shards of about the same size.
+
+    The shards are written to <shard_prefix>.1, <shard_prefix>.2, ... Each is
+    first written under a temporary name and then renamed, so concurrent
+    splits of the same database never expose a partial shard.
+
+    Returns:
+      The paths of the shards and the number of sequences of the database,
+      counted while the shards are copied.
+    """
+    size = os.path.getsize(database_path)
+    shard_paths = []
+    num_records = 0
+    with open(database_path, 'rb') as f:
+        start = 0
+        for i in range(1, num_shards + 1):
+            end = size
+            if i < num_shards:
+                # Move the end of the shard to the start of the next record.
+                f.seek(max(start, size * i // num_shards))
+                f.readline()
+                while True:
+                    position = f.tell()
+                    line = f.readline()
+                    if not line or line.startswith(b'>'):
+                        end = position if line else size
+                        break
+            if end == start:
+                continue
+
+            shard_path = _shard_path(shard_prefix, len(shard_paths) + 1)
+            incomplete_path = f'{shard_path}.{uuid.uuid4().hex}'
+            try:
+                with open(incomplete_path, 'wb') as shard:
+                    f.seek(start)
+                    remaining = end - start
+                    at_line_start = True
+                    while remaining:
+                        chunk = f.read(min(remaining, _DATABASE_READ_BYTES))
+                        # The records are the lines that start with '>'.
+                        num_records += chunk.count(b'\n>') + (
+                            at_line_start and chunk.startswith(b'>'))
+                        at_line_start = chunk.endswith(b'\n')
+                        shard.write(chunk)
+                        remaining -= len(chunk)
+                os.replace(incomplete_path, shard_path)
+            finally:
+                if os.path.exists(incomplete_path):
+                    os.remove(incomplete_path)
+            shard_paths.append(shard_path)
+            start = end
+    return shard_paths, num_records
+
+
+def _prepare_database_shards(
+    database_path: str,
+    num_shards: int,
+    shard_dir: str
+) -> Tuple[List[str], int]:
+    """Returns the shards of a database and its number of sequences.
+
+    A pre-sharded layout (see `_read_shard_layout`) is used as is, without
+    reading the database. Otherwise the database is split into num_shards
+    shards, which are cached next to it with their manifest so that later
+    searches reuse them. If the database directory is not writable, the
+    shards are written to shard_dir for this search only.
+    """
+    layout = _read_shard_layout(database_path)
+    if layout is not None:
+        return layout
+
+    logging.warning(
+        f'{database_path} is not pre-sharded. Splitting it into {num_shards} '
+        f'shards, which copies the whole database.')
+    t0 = time.time()
+    try:
+        shard_paths, num_records = _split_fasta_database(
+            database_path, num_shards, database_path)
+        _write_shard_layout(database_path, len(shard_paths), num_records)
+    except OSError:
+        logging.warning(
+            f'Could not cache the shards next to {database_path}. Splitting '
+            f'it into temporary shards for this search.')
+        shard_paths, num_records = _split_fasta_database(
+            database_path, num_shards,
+            os.path.join(shard_dir, os.path.basename(database_path)))
+    logging.info(f'Split {database_path} into {len(shard_paths)} shards in '
+                 f'{time.time() - t0:.1f}s')
+    return shard_paths, num_records
+
+
+def _run_sharded_jackhmmer(
+    input_path: str,
+    database_path: str,
+    maxseq: int,
+    n_cpu: int,
+    num_shards: int
+) -> str:
+    """Searches the shards of a database in parallel and merges the results."""
+    with tempfile.TemporaryDirectory() as shard_dir:
+        # E-values are computed for the size of the full database, so that
+        # the hits of different shards can be ranked together.
+        shard_paths, z_value = _prepare_database_shards(
+            database_path, num_shards, shard_dir)
+
+        def query_shard(shard_path):
+            # A single iteration, as in the unsharded search. Later iterations
+            # would build a different profile in each shard.
+            runner = jackhmmer.Jackhmmer(
+                binary_path=JACKHMMER_BINARY_PATH,
+                database_path=shard_path,
+                n_cpu=max(1, n_cpu // len(shard_paths)),
+                n_iter=1,
+                z_value=z_value,
+                get_tblout=True,
+            )
+            return runner.query(input_path, maxseq)[0]
+
+        with concurrent.futures.ThreadPoolExecutor(
+                len(shard_paths)) as executor:
+            results = list(executor.map(query_shard, shard_paths))
+
+    return msa_parsers.merge_stockholm_msas(
+        stockholm_msas=[result['sto'] for result in results],
+        tblouts=[result['tbl'] for result in results],
+        max_sequences=maxseq)
+
+
 def run_jackhmmer(
     input_path: str,
     msa_path: str,
     database_path: str,
     maxseq: int,
-    n_cpu: int = 8
+    n_cpu: int = 8,
+    num_shards: int = 1,
+    cache: Optional[search_cache.SearchCache] = None
 ):
-    """Runs jackhmeer and saves results to files."""
-
-    runner = jackhmmer.Jackhmmer(
-        binary_path=JACKHMMER_BINARY_PATH,
-        database_path=database_path,
-        n_cpu=n_cpu,
-    )
+    """Runs jackhmeer and saves results to files.
+
+    If num_shards is greater than 1, the database is searched in shards by
+    jackhmmer processes in parallel, each using n_cpu / num_shards CPUs, and
+    their alignments are merged by e-value. The shards and the number of
+    sequences of the database are read from a pre-sharded layout (see
+    `_prepare_database_shards`), or the database is split once and the shards
+    are cached next to it. E-values are computed for the whole database.
+    Sharding is limited to a single jackhmmer iteration, the default of the
+    unsharded search: with more iterations each shard would build its own
+    profile, and the merged MSA would differ from a search of the whole
+    database.
+
+    If a cache is given, the results of a previous search of the same sequence
+    with the same database and parameters are copied instead of searching.
+    """
+
+    outputs = {'msa': msa_path, 'array_msa': msa_path + ARRAY_MSA_SUFFIX}
+    if cache is not None:
+        sequence, _, _ = _read_sequence(input_path)
+        key = search_cache.cache_key(
+            tool='jackhmmer',
+            sequences=[sequence],
+            database_paths=[database_path],
+            parameters={'maxseq': maxseq, 'num_shards': num_shards})
+        if cache.get(key, outputs):
+            return _read_msa(msa_path, 'sto', compact=True), 'sto'
+
+    if num_shards > 1:
+        sto = _run_sharded_jackhmmer(
+            input_path=input_path,
+            database_path=database_path,
+            maxseq=maxseq,
+            n_cpu=n_cpu,
+            num_shards=num_shards,
+        )
+    else:
+        runner = jackhmmer.Jackhmmer(
+            binary_path=JACKHMMER_BINARY_PATH,
+            database_path=database_path,
+            n_cpu=n_cpu,
+        )
+        sto = runner.query(input_path, maxseq)[0]['sto']
 
-    results = runner.query(input_path, maxseq)[0]
     with open(msa_path, 'w') as f:
-        f.write(results['sto'])
+        f.write(sto)
+    msa = msa_parsers.read_stockholm(io.StringIO(sto), compact=True)
+    _write_array_msa(msa, msa_path)
+    if cache is not None:
+        cache.put(key, outputs)
 
-    return parsers.parse_stockholm(results['sto']), 'sto'
+    return msa, 'sto'
 
 
 def run_hhblits(
@@ -461,9 +1467,25 @@ def run_hhblits(
     msa_path: str,
     database_paths: List[str],
     n_cpu: int,
-    maxseq: int
+    maxseq: int,
+    cache: Optional[search_cache.SearchCache] = None
 ):
-    """Runs hhblits and saves results to a file."""
+    """Runs hhblits and saves results to a file.
+
+    If a cache is given, the results of a previous search of the same sequence
+    with the same databases and parameters are copied instead of searching.
+    """
+
+    outputs = {'msa': msa_path, 'array_msa': msa_path + ARRAY_MSA_SUFFIX}
+    if cache is not None:
+        sequence, _, _ = _read_sequence(input_path)
+        key = search_cache.cache_key(
+            tool='hhblits',
+            sequences=[sequence],
+            database_paths=database_paths,
+            parameters={'maxseq': maxseq})
+        if cache.get(key, outputs):
+            return _read_msa(msa_path, 'a3m', compact=True), 'a3m'
 
     runner = hhblits.HHBlits(
         binary_path=HHBLITS_BINARY_PATH,
@@ -475,8 +1497,12 @@ def run_hhblits(
     results = runner.query(input_path)[0]
     with open(msa_path, 'w') as f:
         f.write(results['a3m'])
+    msa = msa_parsers.read_a3m(io.StringIO(results['a3m']), compact=True)
+    _write_array_msa(msa, msa_path)
+    if cache is not None:
+        cache.put(key, outputs)
 
-    return parsers.parse_a3m(results['a3m']), 'a3m'
+    return msa, 'a3m'
 
 
 def run_hhsearch(
@@ -490,15 +1516,38 @@ def run_hhsearch(
     obsolete_path: str,
     max_template_date: str,
     max_template_hits: int,
-    maxseq: int
+    maxseq: int,
+    cache: Optional[search_cache.SearchCache] = None
 ):
-    """Runs hhsearch and saves results to a file."""
+    """Runs hhsearch and saves results to a file.
+
+    If a cache is given, the hits and features of a previous search with the
+    same sequence, MSA, databases and parameters are copied instead.
+    """
 
     if msa_data_format != 'sto' and msa_data_format != 'a3m':
         raise ValueError(f'Unsupported MSA format: {msa_data_format}')
 
     sequence, _, _ = _read_sequence(sequence_path)
 
+    outputs = {'template_hits': template_hits_path,
+               'template_features': template_features_path}
+    if cache is not None:
+        key = search_cache.cache_key(
+            tool='hhsearch',
+            sequences=[sequence],
+            database_paths=[*template_dbs_paths, mmcif_path, obsolete_path],
+            parameters={'msa_data_format': msa_data_format,
+                        'max_template_date': max_template_date,
+                        'max_template_hits': max_template_hits,
+                        'maxseq': maxseq},
+            input_paths=[msa_path])
+        if cache.get(key, outputs):
+            with open(template_hits_path) as f:
+                hhr_str = f.read()
+            return (msa_parsers.HhrIndex(hhr_str),
+                    _read_template_features(template_features_path))
+
     template_searcher = hhsearch.HHSearch(
         binary_path=HHSEARCH_BINARY_PATH,
         databases=template_dbs_paths,
@@ -514,14 +1563,8 @@ def run_hhsearch(
         release_dates_path=None,
     )
 
-    with open(msa_path) as f:
-        msa_str = f.read()
-
-    if msa_data_format == 'sto':
-        msa_for_templates = parsers.deduplicate_stockholm_msa(msa_str)
-        msa_for_templates = parsers.remove_empty_columns_from_stockholm_msa(
-            msa_for_templates)
-        msa_for_templates = parsers.convert_stockholm_to_a3m(msa_for_templates)
+    msa_for_templates = _read_msa_for_templates(
+        msa_path, msa_data_format, maxseq, output_format='a3m')
 
     hhr_str = template_searcher.query(msa_for_templates)
     with open(template_hits_path, 'w') as f:
@@ -534,8 +1577,10 @@ def run_hhsearch(
         hits=template_hits)
     with open(template_features_path, 'wb') as f:
         pickle.dump(templates_result.features, f, protocol=4)
+    if cache is not None:
+        cache.put(key, outputs)
 
-    return parsers.parse_hhr(hhr_str), templates_result.features
+    return msa_parsers.HhrIndex(hhr_str), templates_result.features
 
 
 def run_hmmsearch(
@@ -548,9 +1593,15 @@ def run_hmmsearch(
     mmcif_path: str,
     obsolete_path: str,
     max_template_date,
-    max_template_hits
+    max_template_hits,
+    maxseq: int = 1_000_000,
+    cache: Optional[search_cache.SearchCache] = None
 ):
-    """Runs hhsearch and saves results to a file."""
+    """Runs hhsearch and saves results to a file.
+
+    If a cache is given, the hits and features of a previous search with the
+    same sequence, MSA, databases and parameters are copied instead.
+    """
 
     if msa_data_format != 'sto':
         raise ValueError(f'Unsupported MSA format: {msa_data_format}')
@@ -563,6 +1614,26 @@ def run_hmmsearch(
         database_path=template_db_path
     )
 
+    outputs = {'template_hits': template_hits_path,
+               'template_features': template_features_path}
+    if cache is not None:
+        key = search_cache.cache_key(
+            tool='hmmsearch',
+            sequences=[sequence],
+            database_paths=[template_db_path, mmcif_path, obsolete_path],
+            parameters={'msa_data_format': msa_data_format,
+                        'max_template_date': max_template_date,
+                        'max_template_hits': max_template_hits,
+                        'maxseq': maxseq},
+            input_paths=[msa_path])
+        if cache.get(key, outputs):
+            with open(template_hits_path) as f:
+                sto_str = f.read()
+            template_hits = template_searcher.get_template_hits(
+                output_string=sto_str, input_sequence=sequence)
+            return (parsers.parse_stockholm(template_hits),
+                    _read_template_features(template_features_path))
+
     template_featurizer = templates.HmmsearchHitFeaturizer(
         mmcif_dir=mmcif_path,
         max_template_date=max_template_date,
@@ -572,12 +1643,8 @@ def run_hmmsearch(
         release_dates_path=None
     )
 
-    with open(msa_path) as f:
-        msa_str = f.read()
-
-    msa_for_templates = parsers.deduplicate_stockholm_msa(msa_str)
-    msa_for_templates = parsers.remove_empty_columns_from_stockholm_msa(
-        msa_for_templates)
+    msa_for_templates = _read_msa_for_templates(
+        msa_path, msa_data_format, maxseq, output_format='sto')
 
     sto_str = template_searcher.query(msa_for_templates)
     with open(template_hits_path, 'w') as f:
@@ -591,5 +1658,7 @@ def run_hmmsearch(
 
     with open(template_features_path, 'wb') as f:
         pickle.dump(templates_result.features, f, protocol=4)
+    if cache is not None:
+        cache.put(key, outputs)
 
     return parsers.parse_stockholm(template_hits), templates_result.features
@@ -0,0 +1,213 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the AlphaFold utilities that run without a model or databases.
+
+The module is imported as in the components image, where the parsers are
+next to it, and the tests are skipped if AlphaFold and JAX are not installed.
+"""
+import collections
+import os
+import sys
+
+import numpy as np
+import pytest
+
+_COMPONENTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.extend([_COMPONENTS_DIR,
+                 os.path.join(_COMPONENTS_DIR, os.pardir, 'analysis')])
+alphafold_utils = pytest.importorskip('alphafold_utils')
+
+
+_NUM_RES = 37
+_PADDED_LENGTH = 64
+_NUM_MSA = 5
+_NUM_TEMPLATES = 2
+_NUM_LAYERS = 8
+
+_Vecs = collections.namedtuple('_Vecs', ['x', 'y', 'z'])
+
+
+def _multimer_features(num_res):
+    rng = np.random.default_rng(0)
+    return {
+        'aatype': rng.integers(0, 20, num_res),
+        'residue_index': np.arange(num_res),
+        'asym_id': np.ones(num_res),
+        'sym_id': np.ones(num_res),
+        'entity_id': np.ones(num_res),
+        'seq_mask': np.ones(num_res, np.float32),
+        'msa': rng.integers(0, 21, (_NUM_MSA, num_res)),
+        'msa_mask': np.ones((_NUM_MSA, num_res), np.float32),
+        'deletion_matrix': np.zeros((_NUM_MSA, num_res), np.float32),
+        'template_aatype': np.zeros((_NUM_TEMPLATES, num_res)),
+        'template_all_atom_positions': rng.random(
+            (_NUM_TEMPLATES, num_res, 37, 3)),
+        'num_templates': np.array(_NUM_TEMPLATES),
+    }
+
+
+def _model_outputs(num_res):
+    """Returns outputs with the layout of an AlphaFold prediction."""
+    return {
+        'distogram': {
+            'logits': np.zeros((num_res, num_res, 64)),
+            'bin_edges': np.zeros(63),
+        },
+        'experimentally_resolved': {'logits': np.zeros((num_res, 37))},
+        'masked_msa': {'logits': np.zeros((_NUM_MSA, num_res, 23))},
+        'predicted_aligned_error': {
+            'logits': np.zeros((num_res, num_res, 64)),
+            'breaks': np.zeros(63),
+        },
+        'predicted_lddt': {'logits': np.zeros((num_res, 50))},
+        'representations': {
+            'msa': np.zeros((_NUM_MSA, num_res, 256)),
+            'msa_first_row': np.zeros((num_res, 256)),
+            'pair': np.zeros((num_res, num_res, 128)),
+            'single': np.zeros((num_res, 384)),
+            'structure_module': np.zeros((num_res, 384)),
+        },
+        'structure_module': {
+            'final_atom_mask': np.zeros((num_res, 37)),
+            'final_atom_positions': np.zeros((num_res, 37, 3)),
+            'traj': np.zeros((_NUM_LAYERS, num_res, 7)),
+            'sidechains': {
+                'angles_sin_cos': np.zeros((_NUM_LAYERS, num_res, 7, 2)),
+                'unnormalized_angles_sin_cos': np.zeros(
+                    (_NUM_LAYERS, num_res, 7, 2)),
+                'atom_pos': _Vecs(*[np.zeros((_NUM_LAYERS, num_res, 14))
+                                    for _ in range(3)]),
+            },
+        },
+    }
+
+
+def _shapes(tree, path=''):
+    if isinstance(tree, dict):
+        shapes = {}
+        for name, value in tree.items():
+            shapes.update(_shapes(value, f'{path}/{name}'))
+        return shapes
+    if isinstance(tree, tuple):
+        return {f'{path}.{field}': np.shape(value)
+                for field, value in zip(tree._fields, tree)}
+    return {path: np.shape(tree)}
+
+
+def test_bucket_length():
+    assert alphafold_utils._bucket_length(37, [32, 64, 128]) == 64
+    assert alphafold_utils._bucket_length(64, [32, 64, 128]) == 64
+    assert alphafold_utils._bucket_length(200, [32, 64, 128]) == 200
+    assert alphafold_utils._bucket_length(37, []) == 37
+
+
+def test_pad_residues():
+    features = _multimer_features(_NUM_RES)
+    padded = alphafold_utils._pad_residues(
+        features, alphafold_utils._MULTIMER_FEATURE_RESIDUE_AXES,
+        _PADDED_LENGTH)
+
+    assert padded['aatype'].shape == (_PADDED_LENGTH,)
+    assert padded['msa'].shape == (_NUM_MSA, _PADDED_LENGTH)
+    assert padded['template_all_atom_positions'].shape == (
+        _NUM_TEMPLATES, _PADDED_LENGTH, 37, 3)
+    assert padded['num_templates'].shape == ()
+    np.testing.assert_array_equal(
+        padded['msa'][:, :_NUM_RES], features['msa'])
+    assert not padded['seq_mask'][_NUM_RES:].any()
+    assert not padded['msa_mask'][:, _NUM_RES:].any()
+
+
+def test_strip_padding_restores_unpadded_shapes():
+    padded = alphafold_utils._pad_residues(
+        _multimer_features(_NUM_RES),
+        alphafold_utils._MULTIMER_FEATURE_RESIDUE_AXES, _PADDED_LENGTH)
+    padded_outputs = _model_outputs(padded['aatype'].shape[-1])
+
+    stripped = alphafold_utils._strip_padding(
+        padded_outputs, _NUM_RES, _PADDED_LENGTH)
+
+    assert _shapes(stripped) == _shapes(_model_outputs(_NUM_RES))
+    atom_pos = stripped['structure_module']['sidechains']['atom_pos']
+    assert isinstance(atom_pos, _Vecs)
+
+
+def test_compilation_cache_counter():
+    counter = alphafold_utils._CompilationCacheCounter()
+    counter(alphafold_utils._COMPILATION_CACHE_REQUEST_EVENT)
+    snapshot = counter.snapshot()
+    counter(alphafold_utils._COMPILATION_CACHE_REQUEST_EVENT)
+    counter(alphafold_utils._COMPILATION_CACHE_HIT_EVENT)
+    counter(alphafold_utils._COMPILATION_CACHE_REQUEST_EVENT)
+    counter('/jax/compilation_cache/tasks_using_cache', extra=1)
+
+    assert counter.timings('model_1', snapshot) == {
+        'compilation_cache_hits_model_1': 1,
+        'compilation_cache_misses_model_1': 1,
+    }
+
+
+def test_read_msa_without_files(tmp_path):
+    msa_path = str(tmp_path / 'uniref90_hits.sto')
+    with pytest.raises(FileNotFoundError, match='arraymsa'):
+        alphafold_utils._read_msa(msa_path, 'sto')
+
+
+def _write_database(path, num_records):
+    rng = np.random.default_rng(0)
+    records = [
+        f'>seq{i} description {i}\n' + ''.join(
+            ('ACDEFGHIKLMNPQRSTVWY' * 4)[:rng.integers(1, 70)] + '\n'
+            for _ in range(rng.integers(1, 4)))
+        for i in range(num_records)]
+    path.write_text(''.join(records))
+    return str(path)
+
+
+@pytest.mark.parametrize('num_shards', [1, 3, 50])
+def test_split_fasta_database(tmp_path, monkeypatch, num_shards):
+    # Small reads cover records and lines that straddle two reads.
+    monkeypatch.setattr(alphafold_utils, '_DATABASE_READ_BYTES', 7)
+    database_path = _write_database(tmp_path / 'db.fasta', 20)
+
+    shard_paths, num_records = alphafold_utils._split_fasta_database(
+        database_path, num_shards, str(tmp_path / 'shards'))
+
+    assert num_records == 20
+    assert 1 <= len(shard_paths) <= num_shards
+    shards = []
+    for path in shard_paths:
+        with open(path) as f:
+            shards.append(f.read())
+    assert all(shard.startswith('>') for shard in shards)
+    with open(database_path) as f:
+        assert ''.join(shards) == f.read()
+
+
+def test_prepare_database_shards_reuses_layout(tmp_path, monkeypatch):
+    database_path = _write_database(tmp_path / 'db.fasta', 20)
+    shard_paths, num_records = alphafold_utils._prepare_database_shards(
+        database_path, 3, str(tmp_path))
+    assert alphafold_utils._read_shard_layout(database_path) == (
+        shard_paths, num_records)
+
+    def split(*args):
+        raise AssertionError('The database was split again')
+    monkeypatch.setattr(alphafold_utils, '_split_fasta_database', split)
+    assert alphafold_utils._prepare_database_shards(
+        database_path, 3, str(tmp_path)) == (shard_paths, num_records)
+
+    os.remove(shard_paths[-1])
+    assert alphafold_utils._read_shard_layout(database_path) is None
@@ -45,10 +45,11 @@ def configure_run(
   import random
   import sys
   from collections import namedtuple
-  from alphafold.data import parsers
   from alphafold.model import config
   from google.cloud import storage
 
+  import parsers
+
   run_multimer_system = 'multimer' == model_preset
   num_ensemble = 8 if model_preset == 'monomer_casp14' else 1
   num_predictions_per_model = num_multimer_predictions_per_model if model_preset == 'multimer' else 1
@@ -58,11 +59,13 @@ def configure_run(
   with open(sequence.path, 'wb') as f:
     client.download_blob_to_file(sequence_path, f)
 
-  with open(sequence.path) as f:
-    sequence_str = f.read()
-  seqs, seq_descs = parsers.parse_fasta(sequence_str)
+  seq_descs = []
+  num_residues = []
+  for seq_desc, seq in parsers.iter_fasta(sequence.path):
+    seq_descs.append(seq_desc)
+    num_residues.append(len(seq))
 
-  if len(seqs) != 1 and model_preset != 'multimer':
+  if len(seq_descs) != 1 and model_preset != 'multimer':
     raise ValueError(
         f'More than one sequence found in {sequence_path}.',
         'Unsupported for monomer predictions.')
@@ -85,7 +88,7 @@ def configure_run(
 
   sequence.metadata['category'] = 'sequence'
   sequence.metadata['description'] = seq_descs
-  sequence.metadata['num_residues'] = [len(seq) for seq in seqs]
+  sequence.metadata['num_residues'] = num_residues
 
   output = namedtuple('ConfigureRunOutputs',
                       ['sequence_path', 'model_runners',
@@ -31,7 +31,9 @@ def data_pipeline(
     use_small_bfd: bool,
     max_template_date: str,
     msas: Output[Artifact],
-    features: Output[Artifact]
+    features: Output[Artifact],
+    search_cache_path: str = '',
+    search_cache_max_gb: float = 0.0,
 ):
   """Configures and runs AlphaFold data pipelines."""
 
@@ -40,6 +42,7 @@ def data_pipeline(
   import time
 
   from alphafold_utils import run_data_pipeline
+  from search_cache import create_search_cache
 
   logging.info(f'Starting {"multimer" if run_multimer_system else "monomer"} AlphaFold data pipeline')
   t0 = time.time()
@@ -65,6 +68,8 @@ def data_pipeline(
       mount_path, ref_databases.metadata['pdb_seqres'])
   mmcif_path = os.path.join(mount_path, ref_databases.metadata['pdb_mmcif'])
   os.makedirs(msas.path, exist_ok=True)
+  cache = create_search_cache(
+      search_cache_path, mount_path, search_cache_max_gb)
 
   features_dict, msas_metadata = run_data_pipeline(
       fasta_path=sequence.path,
@@ -83,6 +88,7 @@ def data_pipeline(
       max_template_date=max_template_date,
       msa_output_path=msas.path,
       features_output_path=features.path,
+      cache=cache,
   )
 
   features.metadata['category'] = 'features'
@@ -32,6 +32,8 @@ def hhblits(
     msa: Output[Artifact],
     n_cpu: int = 12,
     maxseq: int = 1_000_000,
+    search_cache_path: str = '',
+    search_cache_max_gb: float = 0.0,
 ):
   """Configures and runs hhblits."""
 
@@ -39,7 +41,9 @@ def hhblits(
   import os
   import time
 
+  from alphafold_utils import ARRAY_MSA_SUFFIX
   from alphafold_utils import run_hhblits
+  from search_cache import create_search_cache
 
   logging.info(f'Starting hhblits search on {databases}')
   t0 = time.time()
@@ -47,13 +51,16 @@ def hhblits(
   mount_path = ref_databases.uri
   database_paths = [os.path.join(mount_path, ref_databases.metadata[database])
                     for database in databases]
+  cache = create_search_cache(
+      search_cache_path, mount_path, search_cache_max_gb)
 
   parsed_msa, msa_format = run_hhblits(
       input_path=sequence.path,
       database_paths=database_paths,
       msa_path=msa.path,
       n_cpu=n_cpu,
-      maxseq=maxseq
+      maxseq=maxseq,
+      cache=cache
   )
 
   msa.metadata['category'] = 'msa'
@@ -61,6 +68,7 @@ def hhblits(
   msa.metadata['data_format'] = msa_format
   msa.metadata['databases'] = databases
   msa.metadata['tool'] = 'hhblits'
+  msa.metadata['array_msa_uri'] = msa.uri + ARRAY_MSA_SUFFIX
 
   t1 = time.time()
   logging.info(f'Hhblits search completed. Elapsed time: {t1-t0}')
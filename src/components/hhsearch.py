@@ -37,7 +37,9 @@ def hhsearch(
     template_hits: Output[Artifact],
     template_features: Output[Artifact],
     max_template_hits: int = 20,
-    maxseq: int = 1_000_000
+    maxseq: int = 1_000_000,
+    search_cache_path: str = '',
+    search_cache_max_gb: float = 0.0,
 ):
   """Configures and runs hhsearch."""
 
@@ -46,6 +48,7 @@ def hhsearch(
   import time
 
   from alphafold_utils import run_hhsearch
+  from search_cache import create_search_cache
 
   logging.info('Starting hhsearch search')
   t0 = time.time()
@@ -54,6 +57,8 @@ def hhsearch(
   template_dbs_paths = [os.path.join(
       mount_path, ref_databases.metadata[database])
                         for database in template_dbs]
+  cache = create_search_cache(
+      search_cache_path, mount_path, search_cache_max_gb)
 
   hhr, features = run_hhsearch(
       sequence_path=sequence.path,
@@ -68,6 +73,7 @@ def hhsearch(
       template_hits_path=template_hits.path,
       template_features_path=template_features.path,
       maxseq=maxseq,
+      cache=cache,
   )
 
   template_hits.metadata['category'] = 'msa'
@@ -35,6 +35,9 @@ def hmmsearch(
     template_hits: Output[Artifact],
     template_features: Output[Artifact],
     max_template_hits: int = 20,
+    maxseq: int = 1_000_000,
+    search_cache_path: str = '',
+    search_cache_max_gb: float = 0.0,
 ):
   """Configures and runs hmmsearch."""
 
@@ -43,11 +46,14 @@ def hmmsearch(
   import time
 
   from alphafold_utils import run_hmmsearch
+  from search_cache import create_search_cache
 
   logging.info('Starting hmmsearch search')
   t0 = time.time()
 
   mount_path = ref_databases.uri
+  cache = create_search_cache(
+      search_cache_path, mount_path, search_cache_max_gb)
 
   msa, features = run_hmmsearch(
       sequence_path=sequence.path,
@@ -62,7 +68,9 @@ def hmmsearch(
       max_template_date=max_template_date,
       max_template_hits=max_template_hits,
       template_hits_path=template_hits.path,
-      template_features_path=template_features.path
+      template_features_path=template_features.path,
+      maxseq=maxseq,
+      cache=cache,
   )
 
   template_hits.metadata['category'] = 'msa'
@@ -31,27 +31,45 @@ def jackhmmer(
     msa: Output[Artifact],
     n_cpu: int = 8,
     maxseq: int = 10000,
+    num_shards: int = 1,
+    search_cache_path: str = '',
+    search_cache_max_gb: float = 0.0,
 ):
-  """Configures and runs jackhmmer."""
+  """Configures and runs jackhmmer.
+
+  If num_shards is greater than 1, the shards of the database are searched in
+  parallel and their alignments are merged. The shards are read from a
+  pre-sharded layout, <database>.1 ... <database>.N with a
+  <database>.shards.json manifest of the number of shards and sequences, or
+  the database is split once and the shards are cached next to it. Sharded
+  searches run a single jackhmmer iteration, so the merged MSA matches the
+  unsharded search; searches with more iterations cannot be sharded.
+  """
 
   import logging
   import os
   import time
 
+  from alphafold_utils import ARRAY_MSA_SUFFIX
   from alphafold_utils import run_jackhmmer
+  from search_cache import create_search_cache
 
   logging.info(f'Starting jackhmmer search on {database}')
   t0 = time.time()
 
   mount_path = ref_databases.uri
   database_path = os.path.join(mount_path, ref_databases.metadata[database])
+  cache = create_search_cache(
+      search_cache_path, mount_path, search_cache_max_gb)
 
   parsed_msa, msa_format = run_jackhmmer(
       input_path=sequence.path,
       database_path=database_path,
       msa_path=msa.path,
       n_cpu=n_cpu,
-      maxseq=maxseq
+      maxseq=maxseq,
+      num_shards=num_shards,
+      cache=cache
   )
 
   msa.metadata['category'] = 'msa'
@@ -59,6 +77,7 @@ def jackhmmer(
   msa.metadata['data_format'] = 'sto'
   msa.metadata['databases'] = [database]
   msa.metadata['tool'] = 'jackhmmer'
+  msa.metadata['array_msa_uri'] = msa.uri + ARRAY_MSA_SUFFIX
 
   t1 = time.time()
   logging.info(f'Jackhmmer search completed. Elapsed time: {t1-t0}')
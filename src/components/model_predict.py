@@ -36,7 +36,12 @@ def predict(
     tf_force_unified_memory: str,
     xla_python_client_mem_fraction: str,
     raw_prediction: Output[Artifact],
-    unrelaxed_protein: Output[Artifact]
+    unrelaxed_protein: Output[Artifact],
+    compilation_cache_path: str = '',
+    length_buckets: str = '',
+    raw_prediction_format: str = 'pickle',
+    raw_prediction_keys: str = '',
+    params_cache_path: str = '',
 ):
   """Configures and runs AlphaFold model runner."""
 
@@ -45,6 +50,7 @@ def predict(
   import os
 
   from alphafold_utils import predict as alphafold_predict
+  from prediction_format import file_extension
 
   os.environ['TF_FORCE_UNIFIED_MEMORY'] = tf_force_unified_memory
   os.environ['XLA_PYTHON_CLIENT_MEM_FRACTION'] = xla_python_client_mem_fraction
@@ -52,7 +58,8 @@ def predict(
   logging.info(f'Starting model prediction {prediction_index} using model {model_name}...')
   t0 = time.time()
 
-  raw_prediction.uri = f'{raw_prediction.uri}.pkl'
+  raw_prediction.uri = (
+      f'{raw_prediction.uri}{file_extension(raw_prediction_format)}')
   unrelaxed_protein.uri = f'{unrelaxed_protein.uri}.pdb'
   prediction_result = alphafold_predict(
       model_features_path=model_features.path,
@@ -62,10 +69,18 @@ def predict(
       run_multimer_system=run_multimer_system,
       random_seed=random_seed,
       raw_prediction_path=raw_prediction.path,
-      unrelaxed_protein_path=unrelaxed_protein.path
+      unrelaxed_protein_path=unrelaxed_protein.path,
+      compilation_cache_path=compilation_cache_path,
+      length_buckets=[int(length) for length in length_buckets.split(',')
+                      if length],
+      raw_prediction_format=raw_prediction_format,
+      raw_prediction_keys=[key for key in raw_prediction_keys.split(',')
+                           if key],
+      params_cache_path=params_cache_path,
   )
 
   raw_prediction.metadata['category'] = 'raw_prediction'
+  raw_prediction.metadata['format'] = raw_prediction_format
   raw_prediction.metadata['prediction_index'] = prediction_index
   raw_prediction.metadata['ranking_confidence'] = prediction_result[
       'ranking_confidence']
@@ -0,0 +1,212 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Node-local cache of AlphaFold model parameters.
+
+The parameters of a model are read from params/params_<model name>.npz under
+the model parameters artifact, which is on the Cloud Storage mount. The first
+job on a node copies the file to the local disk, verifies the copy against the
+checksum of the bytes read from the source, and converts it to an archive of
+aligned raw arrays whose checksum is stored with the entry. The arrays are then
+memory-mapped read-only, so the jobs on the node share the pages of the archive
+and load it without reading and unzipping the npz file. Each load verifies the
+mapped archive against the stored checksum, which reads its pages into the
+shared page cache before the model does.
+
+An entry is named after the path, size and modification time of its source,
+so a new version of the parameters gets a new entry.
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import uuid
+from typing import Dict, Tuple
+
+import numpy as np
+
+
+# Version of the entry layout. Changing it invalidates all entries.
+_CACHE_FORMAT_VERSION = 2
+
+# Raw arrays of an entry, and the file with their offsets, dtypes and shapes.
+# The manifest is written last, so an entry is complete if it exists.
+_ARRAYS_NAME = 'params.bin'
+_MANIFEST_NAME = 'manifest.json'
+# Directory under the cache root where entries are written before they are
+# renamed into place.
+_INCOMPLETE_DIR = '.incomplete'
+
+# Alignment of the arrays in the archive.
+_ALIGNMENT = 64
+
+# Bytes copied and hashed at a time.
+_READ_BYTES = 64 * 1024 * 1024
+
+
+def _params_path(model_name: str, params_dir: str) -> str:
+    return os.path.join(params_dir, 'params', f'params_{model_name}.npz')
+
+
+def _copy_with_digest(source: str, destination: str) -> str:
+    """Copies a file and returns the SHA-256 digest of the bytes read."""
+    digest = hashlib.sha256()
+    with open(source, 'rb') as fsrc, open(destination, 'wb') as fdst:
+        for chunk in iter(lambda: fsrc.read(_READ_BYTES), b''):
+            digest.update(chunk)
+            fdst.write(chunk)
+    return digest.hexdigest()
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_READ_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_arrays(
+        npz_path: str, arrays_path: str) -> Tuple[Dict[str, Dict], str]:
+    """Writes the arrays of an npz file as aligned raw bytes.
+
+    Returns:
+      The offset, dtype and shape of each array by name, and the SHA-256 digest
+      of the bytes written.
+    """
+    layout = {}
+    digest = hashlib.sha256()
+    params = np.load(npz_path, allow_pickle=False)
+    with open(arrays_path, 'wb') as f:
+        for name in params.files:
+            array = params[name]
+            padding = b'\0' * (-f.tell() % _ALIGNMENT)
+            digest.update(padding)
+            f.write(padding)
+            layout[name] = {
+                'offset': f.tell(),
+                'dtype': array.dtype.str,
+                'shape': list(array.shape),
+            }
+            data = array.tobytes(order='C')
+            digest.update(data)
+            f.write(data)
+    return layout, digest.hexdigest()
+
+
+def _buffer_digest(buffer: np.ndarray) -> str:
+    digest = hashlib.sha256()
+    for start in range(0, buffer.size, _READ_BYTES):
+        digest.update(buffer[start:start + _READ_BYTES])
+    return digest.hexdigest()
+
+
+class ParamsCache:
+    """Stores memory-mappable copies of model parameters on the local disk."""
+
+    def __init__(self, root: str):
+        """Initializes the cache.
+
+        Args:
+          root: A directory on the local disk of the node.
+        """
+        self.root = root
+
+    def _entry_dir(self, source_path: str) -> str:
+        stat = os.stat(source_path)
+        key = hashlib.sha256(
+            f'{_CACHE_FORMAT_VERSION}\0{os.path.abspath(source_path)}\0'
+            f'{stat.st_size}\0{stat.st_mtime_ns}'.encode()).hexdigest()
+        return os.path.join(self.root, key)
+
+    def _add(self, source_path: str, entry_dir: str):
+        """Copies, verifies and converts the parameters of an entry."""
+        incomplete_dir = os.path.join(
+            self.root, _INCOMPLETE_DIR, uuid.uuid4().hex)
+        os.makedirs(incomplete_dir)
+        try:
+            npz_path = os.path.join(incomplete_dir, 'params.npz')
+            source_digest = _copy_with_digest(source_path, npz_path)
+            if _file_digest(npz_path) != source_digest:
+                raise OSError(
+                    f'Checksum mismatch of the local copy of {source_path}')
+
+            arrays_path = os.path.join(incomplete_dir, _ARRAYS_NAME)
+            layout, arrays_digest = _write_arrays(npz_path, arrays_path)
+            os.remove(npz_path)
+            manifest = {
+                'source': source_path,
+                'sha256': source_digest,
+                'arrays_sha256': arrays_digest,
+                'size': os.path.getsize(arrays_path),
+                'arrays': layout,
+            }
+            with open(os.path.join(incomplete_dir, _MANIFEST_NAME), 'w') as f:
+                json.dump(manifest, f)
+            os.rename(incomplete_dir, entry_dir)
+        finally:
+            shutil.rmtree(incomplete_dir, ignore_errors=True)
+        logging.info(
+            f'Model parameters cache stored {manifest["size"]} bytes: '
+            f'{source_path}')
+
+    def load(self, model_name: str, params_dir: str) -> Dict[str, np.ndarray]:
+        """Returns the flat parameters of a model as read-only mapped arrays.
+
+        The parameters are added to the cache if they are not in it. Jobs that
+        load the same parameters concurrently wait for the first one to add
+        them.
+
+        Args:
+          model_name: The name of the model.
+          params_dir: The model parameters directory, as passed to
+            `data.get_model_haiku_params`.
+
+        Returns:
+          The arrays by their '//'-joined scope and name, as in the npz file.
+        """
+        source_path = _params_path(model_name, params_dir)
+        entry_dir = self._entry_dir(source_path)
+        manifest_path = os.path.join(entry_dir, _MANIFEST_NAME)
+
+        os.makedirs(self.root, exist_ok=True)
+        with open(f'{entry_dir}.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(manifest_path):
+                logging.info(f'Model parameters cache hit: {source_path}')
+            else:
+                logging.info(f'Model parameters cache miss: {source_path}')
+                self._add(source_path, entry_dir)
+
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        arrays_path = os.path.join(entry_dir, _ARRAYS_NAME)
+        if os.path.getsize(arrays_path) != manifest['size']:
+            raise OSError(
+                f'Model parameters cache entry is corrupt: {entry_dir}')
+
+        buffer = np.memmap(arrays_path, dtype=np.uint8, mode='r')
+        if _buffer_digest(buffer) != manifest['arrays_sha256']:
+            raise OSError(
+                f'Checksum mismatch of model parameters cache entry: '
+                f'{entry_dir}')
+        params = {}
+        for name, info in manifest['arrays'].items():
+            shape = tuple(info['shape'])
+            params[name] = np.frombuffer(
+                buffer, dtype=np.dtype(info['dtype']),
+                count=int(np.prod(shape)), offset=info['offset']).reshape(shape)
+        return params
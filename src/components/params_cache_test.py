@@ -0,0 +1,77 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the node-local cache of model parameters."""
+import glob
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import params_cache
+
+_MODEL_NAME = 'model_1'
+
+
+def _write_params(params_dir):
+    rng = np.random.default_rng(0)
+    params = {
+        'alphafold/alphafold_iteration/evoformer//weights': rng.random(
+            (3, 5), dtype=np.float32),
+        'alphafold/alphafold_iteration/evoformer//bias': rng.random(7),
+        'alphafold/alphafold_iteration/evoformer//offset': np.arange(3),
+    }
+    os.makedirs(os.path.join(params_dir, 'params'))
+    np.savez(os.path.join(params_dir, 'params', f'params_{_MODEL_NAME}.npz'),
+             **params)
+    return params
+
+
+def _arrays_path(cache_dir):
+    [path] = glob.glob(
+        os.path.join(cache_dir, '*', params_cache._ARRAYS_NAME))
+    return path
+
+
+def test_load_maps_the_parameters(tmp_path):
+    params_dir = str(tmp_path / 'params')
+    expected = _write_params(params_dir)
+    cache = params_cache.ParamsCache(str(tmp_path / 'cache'))
+
+    for _ in range(2):
+        params = cache.load(_MODEL_NAME, params_dir)
+        assert params.keys() == expected.keys()
+        for name, array in expected.items():
+            assert params[name].dtype == array.dtype
+            assert not params[name].flags.writeable
+            np.testing.assert_array_equal(params[name], array)
+
+
+def test_load_rejects_a_corrupt_entry(tmp_path):
+    params_dir = str(tmp_path / 'params')
+    _write_params(params_dir)
+    cache = params_cache.ParamsCache(str(tmp_path / 'cache'))
+    cache.load(_MODEL_NAME, params_dir)
+
+    # Corruption that keeps the size of the archive.
+    with open(_arrays_path(str(tmp_path / 'cache')), 'r+b') as f:
+        f.seek(params_cache._ALIGNMENT)
+        byte = f.read(1)
+        f.seek(params_cache._ALIGNMENT)
+        f.write(bytes([byte[0] ^ 0xff]))
+
+    with pytest.raises(OSError, match='Checksum mismatch'):
+        cache.load(_MODEL_NAME, params_dir)
@@ -0,0 +1,98 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A component encapsulating AlphaFold model predict on a batch of sequences."""
+
+
+from kfp.v2 import dsl
+from kfp.v2.dsl import Artifact
+from kfp.v2.dsl import Input
+from kfp.v2.dsl import Output
+
+import config as config
+
+
+@dsl.component(
+    base_image=config.ALPHAFOLD_COMPONENTS_IMAGE
+)
+def predict_batch(
+    model_features_uris: list,
+    num_residues: list,
+    model_params: Input[Artifact],
+    prediction_runners: list,
+    num_ensemble: int,
+    run_multimer_system: bool,
+    tf_force_unified_memory: str,
+    xla_python_client_mem_fraction: str,
+    raw_predictions: Output[Artifact],
+    unrelaxed_proteins: Output[Artifact],
+    compilation_cache_path: str = '',
+    length_buckets: str = '',
+    raw_prediction_format: str = 'pickle',
+    raw_prediction_keys: str = '',
+    params_cache_path: str = '',
+):
+  """Runs AlphaFold predictions on a batch of features artifacts.
+
+  The features artifacts are given by their gs:// URIs, and are read through
+  the Cloud Storage mount. num_residues lists the lengths of the sequences,
+  in the same order, such as the num_residues metadata of the sequence
+  artifacts, so that the batch is sorted without loading the features.
+
+  The component is not used by the pipelines, which predict one sequence per
+  run. It is run on the features artifacts of earlier runs.
+  """
+
+  import json
+  import logging
+  import os
+  import time
+
+  from alphafold_utils import predict_batch as alphafold_predict_batch
+
+  os.makedirs(raw_predictions.path, exist_ok=True)
+  os.makedirs(unrelaxed_proteins.path, exist_ok=True)
+
+  os.environ['TF_FORCE_UNIFIED_MEMORY'] = tf_force_unified_memory
+  os.environ['XLA_PYTHON_CLIENT_MEM_FRACTION'] = xla_python_client_mem_fraction
+
+  logging.info(f'Starting predictions on {len(model_features_uris)} '
+               f'sequences using {prediction_runners} ...')
+  t0 = time.time()
+
+  sequences_metadata = alphafold_predict_batch(
+      model_features_paths=[uri.replace('gs://', '/gcs/', 1)
+                            for uri in model_features_uris],
+      num_residues=num_residues,
+      model_params_path=model_params.path,
+      prediction_runners=prediction_runners,
+      num_ensemble=num_ensemble,
+      run_multimer_system=run_multimer_system,
+      raw_prediction_path=raw_predictions.path,
+      unrelaxed_protein_path=unrelaxed_proteins.path,
+      compilation_cache_path=compilation_cache_path,
+      length_buckets=[int(length) for length in length_buckets.split(',')
+                      if length],
+      raw_prediction_format=raw_prediction_format,
+      raw_prediction_keys=[key for key in raw_prediction_keys.split(',')
+                           if key],
+      params_cache_path=params_cache_path,
+  )
+
+  raw_predictions.metadata['category'] = 'raw_predictions'
+  raw_predictions.metadata['format'] = raw_prediction_format
+  raw_predictions.metadata['sequences'] = json.dumps(sequences_metadata)
+  unrelaxed_proteins.metadata['category'] = 'unrelaxed_proteins'
+
+  t1 = time.time()
+  logging.info(f'Model predictions completed. Elapsed time: {t1-t0}')
@@ -38,6 +38,12 @@ def predict_relax(
     raw_predictions: Output[Artifact],
     unrelaxed_proteins: Output[Artifact],
     relaxed_proteins: Output[Artifact],
+    compilation_cache_path: str = '',
+    length_buckets: str = '',
+    relax_workers: int = 0,
+    raw_prediction_format: str = 'pickle',
+    raw_prediction_keys: str = '',
+    params_cache_path: str = '',
 ):
     """Runs AlphaFold predictions and (optionally) relaxations sequentially."""
 
@@ -68,9 +74,18 @@ def predict_relax(
         raw_prediction_path=raw_predictions.path,
         unrelaxed_protein_path=unrelaxed_proteins.path,
         relaxed_protein_path=relaxed_proteins.path,
+        compilation_cache_path=compilation_cache_path,
+        length_buckets=[int(length) for length in length_buckets.split(',')
+                        if length],
+        relax_workers=relax_workers,
+        raw_prediction_format=raw_prediction_format,
+        raw_prediction_keys=[key for key in raw_prediction_keys.split(',')
+                             if key],
+        params_cache_path=params_cache_path,
     )
 
     raw_predictions.metadata['category'] = 'raw_predictions'
+    raw_predictions.metadata['format'] = raw_prediction_format
     raw_predictions.metadata['ranking_confidences'] = json.dumps(
         ranking_confidences)
     unrelaxed_proteins.metadata['category'] = 'unrelaxed_proteins'
@@ -0,0 +1,214 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Storage formats of raw AlphaFold prediction results.
+
+A prediction result is a nested dict of arrays and scalars. The legacy
+`pickle` format pickles the whole dict. The `npz` format is a zip archive
+with one compressed .npy member per array, named by the '/'-joined keys of
+the array in the dict (for example 'distogram/logits.npy'), so a reader can
+load single arrays without reading the others. Arrays can be selected by key
+and are stored with the dtypes of a per-key policy, such as float16 for the
+logits. A metadata member records the original dtypes, so that
+`load_prediction_result` reconstructs the legacy dict from either format.
+"""
+
+import fnmatch
+import json
+import pickle
+import zipfile
+from typing import Any, Dict, IO, Mapping, Optional, Sequence
+
+import numpy as np
+
+
+PICKLE_FORMAT = 'pickle'
+NPZ_FORMAT = 'npz'
+
+_FILE_EXTENSIONS = {
+    PICKLE_FORMAT: '.pkl',
+    NPZ_FORMAT: '.npz',
+}
+
+# Version of the npz layout, recorded in its metadata.
+_NPZ_FORMAT_VERSION = 1
+_METADATA_NAME = 'metadata.json'
+_ARRAY_SUFFIX = '.npy'
+
+# Dtypes of the arrays in the npz format, by key pattern. The first matching
+# pattern applies, and arrays that match no pattern keep their dtype. The
+# large per-pair and per-MSA-position logits and probabilities are stored
+# with half precision, the confidence metrics and coordinates are not.
+DEFAULT_DTYPES = (
+    ('*logits', np.float16),
+    ('aligned_confidence_probs', np.float16),
+    ('plddt', np.float32),
+    ('predicted_aligned_error', np.float32),
+)
+
+
+def file_extension(output_format: str) -> str:
+    """Returns the file extension of a raw prediction format."""
+    if output_format not in _FILE_EXTENSIONS:
+        raise ValueError(f'Unknown raw prediction format: {output_format}')
+    return _FILE_EXTENSIONS[output_format]
+
+
+def _flatten(result: Mapping[str, Any], prefix: str = '') -> Dict[str, Any]:
+    """Returns the leaves of a nested dict by their '/'-joined keys."""
+    leaves = {}
+    for key, value in result.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, Mapping):
+            leaves.update(_flatten(value, f'{path}/'))
+        else:
+            leaves[path] = value
+    return leaves
+
+
+def _matches(key: str, patterns: Sequence[str]) -> bool:
+    return any(fnmatch.fnmatchcase(key, pattern) for pattern in patterns)
+
+
+def _storage_array(
+    key: str,
+    value: Any,
+    dtypes: Sequence[Any]
+) -> np.ndarray:
+    """Returns a leaf as an array of the dtype of its policy."""
+    array = np.asarray(value)
+    if array.dtype.kind not in 'biuf':
+        raise ValueError(
+            f'Cannot store {key} of dtype {array.dtype} in the npz format')
+    for pattern, dtype in dtypes:
+        if fnmatch.fnmatchcase(key, pattern):
+            dtype = np.dtype(dtype)
+            if array.dtype.kind == 'f' and dtype.kind == 'f':
+                # Saturate instead of overflowing to inf.
+                info = np.finfo(dtype)
+                array = np.clip(array, info.min, info.max)
+            return array.astype(dtype, copy=False)
+    return array
+
+
+def write_prediction_result(
+    result: Mapping[str, Any],
+    f: IO[bytes],
+    output_format: str = PICKLE_FORMAT,
+    keys: Optional[Sequence[str]] = None,
+    dtypes: Sequence[Any] = DEFAULT_DTYPES
+):
+    """Writes a prediction result to a binary file.
+
+    Args:
+      result: The prediction result.
+      f: The file, opened for writing in binary mode.
+      output_format: `PICKLE_FORMAT` or `NPZ_FORMAT`.
+      keys: fnmatch patterns of the '/'-joined keys of the arrays to write in
+        the npz format, for example 'plddt' or 'structure_module/*'. All the
+        arrays are written if None or empty.
+      dtypes: The (pattern, dtype) policy of the arrays in the npz format.
+    """
+    if output_format == PICKLE_FORMAT:
+        pickle.dump(result, f, protocol=4)
+        return
+    file_extension(output_format)
+
+    metadata = {'version': _NPZ_FORMAT_VERSION, 'arrays': {}}
+    with zipfile.ZipFile(f, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for key, value in _flatten(result).items():
+            if keys and not _matches(key, keys):
+                continue
+            array = _storage_array(key, value, dtypes)
+            with archive.open(key + _ARRAY_SUFFIX, 'w',
+                              force_zip64=True) as member:
+                np.lib.format.write_array(member, array, allow_pickle=False)
+            metadata['arrays'][key] = {
+                'dtype': np.asarray(value).dtype.str,
+                # 0-d arrays are restored as arrays.
+                'scalar': not isinstance(value, np.ndarray),
+                # Only Python scalars, not numpy scalars such as np.float64,
+                # which subclasses float.
+                'python_type': (type(value).__name__
+                                if type(value) in (bool, int, float)
+                                else None),
+            }
+        archive.writestr(_METADATA_NAME, json.dumps(metadata))
+
+
+def _legacy_value(array: np.ndarray, info: Mapping[str, Any]) -> Any:
+    """Returns a stored array with its original dtype and type."""
+    array = array.astype(np.dtype(info['dtype']), copy=False)
+    if not info['scalar']:
+        return array
+    if info['python_type']:
+        return {'bool': bool, 'int': int, 'float': float}[
+            info['python_type']](array)
+    return array[()]
+
+
+def _unflatten(leaves: Mapping[str, Any]) -> Dict[str, Any]:
+    result = {}
+    for key, value in leaves.items():
+        *parents, name = key.split('/')
+        node = result
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[name] = value
+    return result
+
+
+def list_prediction_keys(path: str) -> Sequence[str]:
+    """Returns the '/'-joined keys of the arrays of an npz result."""
+    with zipfile.ZipFile(path) as archive:
+        metadata = json.loads(archive.read(_METADATA_NAME))
+    return list(metadata['arrays'])
+
+
+def load_prediction_result(
+    path: str,
+    keys: Optional[Sequence[str]] = None
+) -> Dict[str, Any]:
+    """Loads a prediction result written in either format.
+
+    The arrays of an npz result are converted back to their original dtypes,
+    so the result has the layout of the legacy pickled dict, without the keys
+    that were not written.
+
+    Args:
+      path: The path of the result.
+      keys: fnmatch patterns of the '/'-joined keys of the arrays to read from
+        an npz result. Only the members of these arrays are read. All the
+        arrays are read if None or empty, and from pickled results.
+
+    Returns:
+      The prediction result.
+    """
+    if not zipfile.is_zipfile(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    leaves = {}
+    with zipfile.ZipFile(path) as archive:
+        metadata = json.loads(archive.read(_METADATA_NAME))
+        if metadata['version'] > _NPZ_FORMAT_VERSION:
+            raise ValueError(
+                f'Unsupported raw prediction format version: '
+                f'{metadata["version"]}')
+        for key, info in metadata['arrays'].items():
+            if keys and not _matches(key, keys):
+                continue
+            with archive.open(key + _ARRAY_SUFFIX) as member:
+                array = np.lib.format.read_array(member, allow_pickle=False)
+            leaves[key] = _legacy_value(array, info)
+    return _unflatten(leaves)
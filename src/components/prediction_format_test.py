@@ -0,0 +1,91 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests that raw prediction results round-trip through both formats."""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import prediction_format
+
+
+def _prediction_result():
+    rng = np.random.default_rng(0)
+    return {
+        'distogram': {
+            'logits': rng.random((5, 5, 4), dtype=np.float32),
+            'bin_edges': np.linspace(2, 22, 3, dtype=np.float32),
+        },
+        'plddt': rng.random(5) * 100,
+        'predicted_aligned_error': rng.random((5, 5)),
+        'ptm': np.float64(0.75),
+        'iptm': np.asarray(0.5, dtype=np.float32),
+        'max_predicted_aligned_error': np.float64(31.75),
+        'ranking_confidence': 0.55,
+        'num_recycles': 3,
+        'is_multimer': True,
+    }
+
+
+def _assert_results_equal(result, expected):
+    assert result.keys() == expected.keys()
+    for key, value in expected.items():
+        if isinstance(value, dict):
+            _assert_results_equal(result[key], value)
+        else:
+            assert type(result[key]) is type(value), key
+            assert np.asarray(result[key]).dtype == np.asarray(value).dtype
+            np.testing.assert_array_equal(result[key], value)
+
+
+@pytest.mark.parametrize('output_format', [prediction_format.PICKLE_FORMAT,
+                                           prediction_format.NPZ_FORMAT])
+def test_round_trip_reproduces_legacy_result(tmp_path, output_format):
+    result = _prediction_result()
+    path = tmp_path / f'result{prediction_format.file_extension(output_format)}'
+    with open(path, 'wb') as f:
+        prediction_format.write_prediction_result(
+            result, f, output_format=output_format, dtypes=())
+
+    _assert_results_equal(
+        prediction_format.load_prediction_result(str(path)), result)
+
+
+def test_npz_dtype_policy_and_keys(tmp_path):
+    result = _prediction_result()
+    path = tmp_path / 'result.npz'
+    with open(path, 'wb') as f:
+        prediction_format.write_prediction_result(
+            result, f, output_format=prediction_format.NPZ_FORMAT,
+            keys=['distogram/*', 'plddt', 'ptm'])
+
+    assert sorted(prediction_format.list_prediction_keys(str(path))) == [
+        'distogram/bin_edges', 'distogram/logits', 'plddt', 'ptm']
+    loaded = prediction_format.load_prediction_result(
+        str(path), keys=['distogram/logits', 'ptm'])
+    assert sorted(loaded) == ['distogram', 'ptm']
+    # The logits are stored with half precision and restored as float32.
+    logits = loaded['distogram']['logits']
+    assert logits.dtype == np.float32
+    np.testing.assert_allclose(
+        logits, result['distogram']['logits'], atol=1e-3)
+    assert type(loaded['ptm']) is np.float64
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        prediction_format.file_extension('json')
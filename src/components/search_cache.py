@@ -0,0 +1,290 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Content-addressed cache of genetic database search results.
+
+A search is identified by a key that hashes the normalized query sequences,
+the paths and version fingerprints of the databases, the tool, its search
+parameters and the contents of its input files. The output files of a search
+are stored in a directory named after its key under the cache root, which is a
+directory on the NFS share or a Cloud Storage prefix, and the least recently
+used entries are evicted when the cache grows over its size limit.
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import uuid
+from typing import Any, Mapping, Optional, Sequence
+
+
+# Version of the key and entry layout. Changing it invalidates all entries.
+_CACHE_FORMAT_VERSION = 2
+
+# Vertex AI custom jobs mount Cloud Storage buckets under /gcs.
+_GCS_PREFIX = 'gs://'
+_GCS_MOUNT_POINT = '/gcs/'
+
+# File listing the outputs of an entry and the directory under the entry
+# that holds them. It is written last, so an entry is complete if it exists,
+# and its modification time is the last use.
+_MANIFEST_NAME = 'manifest.json'
+
+# Files of an HH-suite database, next to the common prefix of their paths.
+_HHSUITE_DATABASE_SUFFIXES = ('_a3m.*', '_hhm.*', '_cs219.*')
+
+# Bytes read at a time when hashing an input file.
+_READ_BYTES = 64 * 1024 * 1024
+
+
+def normalize_sequence(sequence: str) -> str:
+    """Returns a sequence without whitespace, in uppercase."""
+    return ''.join(sequence.split()).upper()
+
+
+def database_fingerprint(database_path: str) -> str:
+    """Returns a fingerprint of the version of a database.
+
+    A database is a file, a directory or the common prefix of the files of
+    an HH-suite database. The fingerprint hashes the names, sizes and
+    modification times of these paths, so that it changes when a database is
+    updated without reading the database. Other files next to the database,
+    such as the shards written by the sharded jackhmmer search, are not part
+    of its version.
+    """
+    paths = [database_path] if os.path.exists(database_path) else []
+    for suffix in _HHSUITE_DATABASE_SUFFIXES:
+        paths += glob.glob(glob.escape(database_path) + suffix)
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        stat = os.stat(path)
+        digest.update(
+            f'{os.path.basename(path)}\0{stat.st_size}\0'
+            f'{stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+
+def file_digest(path: str) -> str:
+    """Returns the SHA-256 digest of the contents of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_READ_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(
+    tool: str,
+    sequences: Sequence[str],
+    database_paths: Sequence[str],
+    parameters: Mapping[str, Any],
+    input_paths: Sequence[str] = ()
+) -> str:
+    """Returns the key of a search.
+
+    Args:
+      tool: The name of the search tool or pipeline.
+      sequences: The query sequences, which are normalized.
+      database_paths: The databases searched, identified by their path and
+        `database_fingerprint`.
+      parameters: The parameters that change the results of the search. The
+        values must be JSON serializable.
+      input_paths: Input files of the search, such as the MSA of a template
+        search, identified by their contents.
+
+    Returns:
+      A hexadecimal SHA-256 digest.
+    """
+    key = {
+        'version': _CACHE_FORMAT_VERSION,
+        'tool': tool,
+        'sequences': [normalize_sequence(s) for s in sequences],
+        'databases': [[path, database_fingerprint(path)]
+                      for path in database_paths],
+        'parameters': parameters,
+        'inputs': [file_digest(path) for path in input_paths],
+    }
+    return hashlib.sha256(
+        json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def _path_size(path: str) -> int:
+    """Returns the size of a file or the total size of a directory."""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+def _copy(source: str, destination: str):
+    """Copies a file or a directory tree."""
+    if os.path.isdir(source):
+        shutil.copytree(source, destination, dirs_exist_ok=True)
+    else:
+        shutil.copyfile(source, destination)
+
+
+class SearchCache:
+    """Stores the output files of searches by their `cache_key`."""
+
+    def __init__(self, root: str, max_bytes: Optional[int] = None):
+        """Initializes the cache.
+
+        Args:
+          root: A directory, such as a directory on the NFS share, or a
+            gs://bucket/prefix, which is read through the Cloud Storage mount
+            of Vertex AI jobs.
+          max_bytes: The size over which the least recently used entries are
+            evicted. The cache is not bounded if None.
+        """
+        if root.startswith(_GCS_PREFIX):
+            root = _GCS_MOUNT_POINT + root[len(_GCS_PREFIX):]
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key: str, output_paths: Mapping[str, str]) -> bool:
+        """Copies the outputs of a cached search to their paths.
+
+        Args:
+          key: The `cache_key` of the search.
+          output_paths: The path to copy each named output to, with the names
+            used when the search was stored.
+
+        Returns:
+          Whether the search was found. Nothing is copied if it was not.
+        """
+        entry_dir = self._entry_dir(key)
+        manifest_path = os.path.join(entry_dir, _MANIFEST_NAME)
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            logging.info(f'Search cache miss: {key}')
+            return False
+        if set(manifest['outputs']) != set(output_paths):
+            logging.info(f'Search cache miss: {key} has different outputs')
+            return False
+
+        try:
+            for name, path in output_paths.items():
+                _copy(os.path.join(entry_dir, manifest['data'], name), path)
+            os.utime(manifest_path)  # Mark the entry as recently used.
+        except OSError:
+            # The entry was evicted while it was copied. The partial outputs
+            # are overwritten by the search.
+            logging.info(f'Search cache miss: {key} was evicted')
+            return False
+        logging.info(f'Search cache hit: {key}')
+        return True
+
+    def put(self, key: str, output_paths: Mapping[str, str]):
+        """Stores the outputs of a search and evicts entries if needed.
+
+        The outputs are copied to a new directory under the entry, and the
+        manifest that names the directory is written last, so concurrent
+        readers never see a partial entry. Directories are not renamed, which
+        the Cloud Storage mount does not support. If another job stored the
+        same search first, its entry is kept.
+
+        Args:
+          key: The `cache_key` of the search.
+          output_paths: The path of each named output file or directory.
+        """
+        entry_dir = self._entry_dir(key)
+        manifest_path = os.path.join(entry_dir, _MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            return
+
+        data_name = uuid.uuid4().hex
+        data_dir = os.path.join(entry_dir, data_name)
+        incomplete_manifest_path = f'{manifest_path}.{data_name}'
+        os.makedirs(data_dir)
+        try:
+            for name, path in output_paths.items():
+                _copy(path, os.path.join(data_dir, name))
+            manifest = {
+                'data': data_name,
+                'outputs': sorted(output_paths),
+                'size': _path_size(data_dir),
+            }
+            if os.path.exists(manifest_path):
+                logging.info(f'Search cache entry already stored: {key}')
+                shutil.rmtree(data_dir, ignore_errors=True)
+                return
+            with open(incomplete_manifest_path, 'w') as f:
+                json.dump(manifest, f)
+            os.replace(incomplete_manifest_path, manifest_path)
+        except BaseException:
+            shutil.rmtree(data_dir, ignore_errors=True)
+            if os.path.exists(incomplete_manifest_path):
+                os.remove(incomplete_manifest_path)
+            raise
+        logging.info(f'Search cache stored {manifest["size"]} bytes: {key}')
+
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes)
+
+    def evict(self, max_bytes: int):
+        """Deletes the least recently used entries until under max_bytes."""
+        entries = []
+        for manifest_path in glob.glob(
+                os.path.join(self.root, '??', '*', _MANIFEST_NAME)):
+            try:
+                last_used = os.path.getmtime(manifest_path)
+                with open(manifest_path) as f:
+                    size = json.load(f)['size']
+            except (OSError, ValueError, KeyError):
+                continue  # Evicted concurrently or being replaced.
+            entries.append((last_used, size, os.path.dirname(manifest_path)))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in sorted(entries):
+            if total_bytes <= max_bytes:
+                break
+            # Remove the manifest first, so the entry is never read partially.
+            try:
+                os.remove(os.path.join(entry_dir, _MANIFEST_NAME))
+            except OSError:
+                continue
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_bytes -= size
+            logging.info(
+                f'Search cache evicted {size} bytes: '
+                f'{os.path.basename(entry_dir)}')
+
+
+def create_search_cache(
+    location: str,
+    mount_path: str,
+    max_gb: float = 0
+) -> Optional[SearchCache]:
+    """Returns the cache at a location, or None if the location is empty.
+
+    Args:
+      location: A gs://bucket/prefix, an absolute path or a path relative to
+        mount_path.
+      mount_path: The mount point of the NFS share.
+      max_gb: The size in GB over which entries are evicted. The cache is not
+        bounded if 0.
+    """
+    if not location:
+        return None
+    if not location.startswith(_GCS_PREFIX):
+        location = os.path.join(mount_path, location)
+    return SearchCache(location, max_bytes=int(max_gb * 2**30) or None)
@@ -41,6 +41,17 @@ PDB_SEQRES_PATH = os.getenv('PDB_SEQRES_PATH', 'pdb_seqres/pdb_seqres.txt')
 
 UNIREF_MAX_HITS = int(os.getenv('UNIREF_MAX_HITS', '10000'))
 MGNIFY_MAX_HITS = int(os.getenv('MGNIFY_MAX_HITS', '501'))
+# Number of parallel jackhmmer searches over shards of a database. A database
+# without a pre-sharded layout (<database>.1 ... <database>.N and
+# <database>.shards.json) is split once and the shards are cached next to it.
+# Sharded searches run a single jackhmmer iteration.
+JACKHMMER_NUM_SHARDS = int(os.getenv('JACKHMMER_NUM_SHARDS', '1'))
+
+# Cache of search results, as a path relative to the NFS mount point, an
+# absolute path or a gs:// prefix. The cache is disabled if empty, and is not
+# bounded if the size limit is 0.
+SEARCH_CACHE_PATH = os.getenv('SEARCH_CACHE_PATH', '')
+SEARCH_CACHE_MAX_GB = float(os.getenv('SEARCH_CACHE_MAX_GB', '0'))
 
 DATA_PIPELINE_MACHINE_TYPE = os.getenv(
     'DATA_PIPELINE_MACHINE_TYPE', 'c2-standard-16')
@@ -53,6 +64,28 @@ ALPHAFOLD_COMPONENTS_IMAGE = os.getenv('ALPHAFOLD_COMPONENTS_IMAGE')
 
 PARALLELISM = int(os.getenv('PARALLELISM', 5))
 
+# Persistent XLA compilation cache of the prediction jobs, as a local path, a
+# mounted path or a gs:// prefix. The cache is disabled if empty.
+JAX_COMPILATION_CACHE_PATH = os.getenv('JAX_COMPILATION_CACHE_PATH', '')
+# Comma-separated sequence lengths to which the residues are padded before
+# prediction, so that sequences of similar lengths share compiled models.
+# Padding is disabled if empty.
+PREDICT_LENGTH_BUCKETS = os.getenv('PREDICT_LENGTH_BUCKETS', '')
+# Number of CPU processes relaxing the predictions of the sequential pipeline
+# while the next predictions run. Relaxations follow predictions if 0.
+RELAX_WORKERS = int(os.getenv('RELAX_WORKERS', '0'))
+# Format of the raw prediction results: 'pickle', the legacy pickled dict, or
+# 'npz', a compressed archive with half precision logits. Comma-separated
+# patterns of the result keys to keep in the npz format, such as
+# 'plddt,predicted_aligned_error,structure_module/*'. All keys are kept if
+# empty.
+RAW_PREDICTION_FORMAT = os.getenv('RAW_PREDICTION_FORMAT', 'pickle')
+RAW_PREDICTION_KEYS = os.getenv('RAW_PREDICTION_KEYS', '')
+# Directory on the local disk of the prediction nodes where the model
+# parameters are cached as memory-mapped arrays. The cache is disabled if
+# empty.
+PARAMS_CACHE_PATH = os.getenv('PARAMS_CACHE_PATH', '')
+
 XLA_PYTHON_CLIENT_MEM_FRACTION = os.getenv(
     'XLA_PYTHON_CLIENT_MEM_FRACTION', '4.0')
 TF_FORCE_UNIFIED_MEMORY = os.getenv('TF_FORCE_UNIFIED_MEMORY', '1')
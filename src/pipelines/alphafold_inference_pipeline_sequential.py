@@ -94,6 +94,8 @@ def alphafold_inference_pipeline_seq(
         max_template_date=max_template_date,
         run_multimer_system=run_config.outputs['run_multimer_system'],
         use_small_bfd=use_small_bfd,
+        search_cache_path=config.SEARCH_CACHE_PATH,
+        search_cache_max_gb=config.SEARCH_CACHE_MAX_GB,
     ).set_display_name('Prepare Features')
 
     model_predict_relax = JobPredictRelaxOp(
@@ -106,5 +108,11 @@ def alphafold_inference_pipeline_seq(
         num_ensemble=run_config.outputs['num_ensemble'],
         is_run_relax=is_run_relax,
         tf_force_unified_memory=config.TF_FORCE_UNIFIED_MEMORY,
-        xla_python_client_mem_fraction=config.XLA_PYTHON_CLIENT_MEM_FRACTION
+        xla_python_client_mem_fraction=config.XLA_PYTHON_CLIENT_MEM_FRACTION,
+        compilation_cache_path=config.JAX_COMPILATION_CACHE_PATH,
+        length_buckets=config.PREDICT_LENGTH_BUCKETS,
+        relax_workers=config.RELAX_WORKERS,
+        raw_prediction_format=config.RAW_PREDICTION_FORMAT,
+        raw_prediction_keys=config.RAW_PREDICTION_KEYS,
+        params_cache_path=config.PARAMS_CACHE_PATH,
     ).set_display_name('Predict/Relax')
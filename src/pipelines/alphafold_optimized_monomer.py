@@ -126,6 +126,9 @@ def alphafold_monomer_pipeline(
       ref_databases=reference_databases.output,
       sequence=run_config.outputs['sequence'],
       maxseq=uniref_max_hits,
+      num_shards=config.JACKHMMER_NUM_SHARDS,
+      search_cache_path=config.SEARCH_CACHE_PATH,
+      search_cache_max_gb=config.SEARCH_CACHE_MAX_GB,
   )
   search_uniref.set_display_name('Search Uniref')
 
@@ -135,7 +138,10 @@ def alphafold_monomer_pipeline(
       database='mgnify',
       ref_databases=reference_databases.output,
       sequence=run_config.outputs['sequence'],
-      maxseq=mgnify_max_hits
+      maxseq=mgnify_max_hits,
+      num_shards=config.JACKHMMER_NUM_SHARDS,
+      search_cache_path=config.SEARCH_CACHE_PATH,
+      search_cache_max_gb=config.SEARCH_CACHE_MAX_GB,
   )
   search_mgnify.set_display_name('Search Mgnify')
 
@@ -145,6 +151,8 @@ def alphafold_monomer_pipeline(
       databases=['uniref30'],
       ref_databases=reference_databases.output,
       sequence=run_config.outputs['sequence'],
+      search_cache_path=config.SEARCH_CACHE_PATH,
+      search_cache_max_gb=config.SEARCH_CACHE_MAX_GB,
   )
   search_uniclust.set_display_name('Search Uniclust')
 
@@ -154,6 +162,8 @@ def alphafold_monomer_pipeline(
       databases=['bfd'],
       ref_databases=reference_databases.output,
       sequence=run_config.outputs['sequence'],
+      search_cache_path=config.SEARCH_CACHE_PATH,
+      search_cache_max_gb=config.SEARCH_CACHE_MAX_GB,
   )
   search_bfd.set_display_name('Search BFD')
 
@@ -167,6 +177,8 @@ def alphafold_monomer_pipeline(
       ref_databases=reference_databases.output,
       sequence=run_config.outputs['sequence'],
       msa=search_uniref.outputs['msa'],
+      search_cache_path=config.SEARCH_CACHE_PATH,
+      search_cache_max_gb=config.SEARCH_CACHE_MAX_GB,
   )
   search_pdb.set_display_name('Search Pdb')
 
@@ -192,7 +204,12 @@ def alphafold_monomer_pipeline(
         num_ensemble=run_config.outputs['num_ensemble'],
         random_seed=model_runner.random_seed,
         tf_force_unified_memory=config.TF_FORCE_UNIFIED_MEMORY,
-        xla_python_client_mem_fraction=config.XLA_PYTHON_CLIENT_MEM_FRACTION
+        xla_python_client_mem_fraction=config.XLA_PYTHON_CLIENT_MEM_FRACTION,
+        compilation_cache_path=config.JAX_COMPILATION_CACHE_PATH,
+        length_buckets=config.PREDICT_LENGTH_BUCKETS,
+        raw_prediction_format=config.RAW_PREDICTION_FORMAT,
+        raw_prediction_keys=config.RAW_PREDICTION_KEYS,
+        params_cache_path=config.PARAMS_CACHE_PATH,
     )
     model_predict.set_display_name('Predict')
 